@@ -0,0 +1,210 @@
+from api.storage import StorageBase
+from api.pool import FetchPool
+
+import ccxt
+import json
+import os
+import time
+import numpy as np
+
+
+def find_gaps(timestamps: np.ndarray, interval: int, start: int, end: int) -> list:
+    """
+    Find missing ranges of a regular timestamp grid.
+
+    Args:
+        timestamps: Sorted array of saved timestamps.
+        interval: Grid interval, in the same unit as timestamps.
+        start: First timestamp of the grid.
+        end: End of the grid, exclusive.
+
+    Returns:
+        List of (first missing timestamp, end of the missing range exclusive), in time order.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    timestamps = timestamps[(timestamps >= start) & (timestamps < end)]
+    # bracket saved timestamps by virtual ones just outside of the range, so leading and trailing gaps show up too
+    bounds = np.concatenate(([start - interval], timestamps, [end]))
+    holes = np.flatnonzero(np.diff(bounds) > interval)
+    return [(int(bounds[i]) + interval, int(bounds[i + 1])) for i in holes]
+
+
+def merge_ranges(ranges: list) -> list:
+    """
+    Returns:
+        Sorted list of (start, end exclusive) covering the same timestamps as ranges, without overlaps.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(ranges: list, known: list) -> list:
+    """
+    Returns:
+        Parts of sorted ranges that are not covered by sorted, merged known ranges.
+    """
+    result = []
+    for start, end in ranges:
+        for known_start, known_end in known:
+            if known_end <= start or known_start >= end:
+                continue
+            if known_start > start:
+                result.append((start, known_start))
+            start = max(start, known_end)
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+class Backfill(object):
+    fieldnames = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+    def __init__(self, exchange, storage: StorageBase, pool: FetchPool, timeframe: str='1m', limit: int=500):
+        """
+        Rebuild OHLCV history of many symbols by fetching only what is missing in storage.
+
+        Each run scans the saved timestamps for gaps, splits the gaps into pages of at most limit candles and fetches
+        the pages concurrently through pool. A symbol is written as soon as all of its pages are in, so an interrupted
+        job resumes from what has been saved by simply running it again.
+
+        Ranges the exchange has answered without candles, e.g. maintenance or no trades, are recorded in a sidecar
+        file next to the storage, see empty_filename, and are not fetched again. Only ranges before the last saved
+        candle of a symbol are recorded, as candles after it may not be published yet.
+
+        Args:
+            exchange: ccxt exchange instance.
+            storage: Storage of OHLCV data.
+            pool: Fetch pool that sends requests within the rate limit.
+            timeframe: OHLCV timeframe in ccxt notation. Defaults to '1m'.
+            limit: Max number of candles per request. Defaults to 500.
+        """
+        self.exchange = exchange
+        self.storage = storage
+        self.pool = pool
+        self.timeframe = timeframe
+        self.interval = ccxt.Exchange.parse_timeframe(timeframe) * 1000
+        self.limit = limit
+        self.empty_filename = os.path.join(storage.directory, 'backfill_empty.json')
+        self._empty = None      # {symbol: [(start, end)]}, loaded on first use
+
+    @property
+    def empty(self) -> dict:
+        """
+        Dictionary of form {symbol: [(start, end)]} of ranges known to have no candles on the exchange.
+        """
+        if self._empty is None:
+            self._empty = {}
+            if os.path.exists(self.empty_filename):
+                with open(self.empty_filename) as f:
+                    self._empty = {symbol: [tuple(r) for r in ranges] for symbol, ranges in json.load(f).items()}
+        return self._empty
+
+    def record_empty(self, symbol: str, ranges: list):
+        """
+        Add ranges without candles of symbol to the sidecar file.
+        """
+        if not ranges:
+            return
+        self.empty[symbol] = merge_ranges(self.empty.get(symbol, []) + ranges)
+        with open(self.empty_filename, 'w') as f:
+            json.dump(self.empty, f)
+
+    def plan(self, symbols: list, start: int=None, end: int=None) -> dict:
+        """
+        Find the pages to fetch for each symbol.
+
+        Args:
+            symbols: Symbols to backfill.
+            start: First timestamp to backfill. Defaults to None, i.e. from the first saved timestamp of the symbol.
+                   Symbols without saved data are skipped if start is None.
+            end: End of backfill, exclusive. Defaults to None, i.e. up to the last closed candle.
+
+        Returns:
+            Dictionary of form {symbol: [(since, until)]}. Ranges known to be empty on the exchange are skipped.
+        """
+        if end is None:
+            end = int(time.time() * 1000) // self.interval * self.interval
+        page = self.limit * self.interval
+
+        pages = {}
+        for symbol in symbols:
+            timestamps = self.storage.timestamps(symbol)
+            first = start
+            if first is None:
+                if len(timestamps) == 0:
+                    continue
+                first = int(timestamps[0])
+            first = first // self.interval * self.interval
+
+            gaps = subtract_ranges(find_gaps(timestamps, self.interval, first, end), self.empty.get(symbol, []))
+            pages[symbol] = [(since, min(since + page, until))
+                             for since, until in gaps
+                             for since in range(since, until, page)]
+        return pages
+
+    def fetch_page(self, symbol: str, since: int, until: int) -> list:
+        ohlcv = self.exchange.fetch_ohlcv(symbol, self.timeframe, since=since, limit=self.limit)
+        return [row for row in ohlcv if since <= row[0] < until]
+
+    def run(self, symbols: list, start: int=None, end: int=None) -> dict:
+        """
+        Fetch and save missing OHLCV of symbols between start and end.
+
+        Args:
+            symbols: Symbols to backfill.
+            start: First timestamp to backfill. See plan.
+            end: End of backfill, exclusive. See plan.
+
+        Returns:
+            Dictionary of form {symbol: number of rows saved}.
+        """
+        pages = self.plan(symbols, start, end)
+        remaining = {symbol: len(pages[symbol]) for symbol in pages}
+        fetched = {symbol: [] for symbol in pages}
+        # pages answered by the exchange, counted as answered only once their symbol is saved
+        pending = {symbol: [] for symbol in pages}
+        answered = {}
+        saved = {symbol: 0 for symbol in pages}
+        print("[Backfill] Fetching {:d} pages for {:d} symbols".format(sum(remaining.values()), len(pages)))
+
+        def save(symbol):
+            rows = sorted(fetched.pop(symbol), key=lambda row: row[0])
+            if rows:
+                self.storage.insert(symbol, self.fieldnames, rows)
+                self.storage.flush(symbol)
+                saved[symbol] = len(rows)
+                print("[Backfill] Saved {:d} rows for {:s}".format(len(rows), symbol))
+            answered[symbol] = pending.pop(symbol)
+
+        def on_fetched(key, rows):
+            symbol = key[0]
+            fetched[symbol].extend(rows)
+            pending[symbol].append(key[1:])
+            remaining[symbol] -= 1
+            if remaining[symbol] == 0:
+                save(symbol)
+
+        keys = [(symbol,) + page for symbol in pages for page in pages[symbol]]
+        _, failed = self.pool.run(lambda key: self.fetch_page(*key), keys, callback=on_fetched)
+
+        # pages that failed are missing again on the next run, save what has been fetched
+        for key in failed:
+            print("[Backfill] Fail to fetch {:s} from {:d}".format(key[0], key[1]))
+        for symbol in list(fetched):
+            save(symbol)
+
+        # what is still missing in answered pages has no candles on the exchange, a symbol that failed to save is
+        # skipped as its fetched candles are missing too
+        for symbol, ranges in answered.items():
+            last = self.storage.last_timestamp(symbol)
+            if not ranges or last is None:
+                continue
+            timestamps = self.storage.timestamps(symbol)
+            self.record_empty(symbol, [gap for since, until in ranges if since < last
+                                       for gap in find_gaps(timestamps, self.interval, since, min(until, last))])
+        return saved
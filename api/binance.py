@@ -2,20 +2,21 @@ from ccxt.base.errors import ExchangeNotAvailable
 from ccxt.base.errors import ExchangeError
 from ccxt.base.errors import RequestTimeout
 from ccxt.base.errors import DDoSProtection
+from ccxt.base.errors import NetworkError
 
-from api.errors import TimestampError
-from api.errors import PathNotSpecified
+from api.errors import PathNotSpecified, FetchError
+from api.storage import make_storage
+from api.pool import TokenBucket, FetchPool
+from api.backfill import Backfill
+from api.markets import MarketCache, shared_cache
 
-import os
-import csv
 import ccxt
 import time
-import json
-import base64
 
 
 class Binance:
-    def __init__(self, path='', retry=5, ddos_cooldown=120):
+    def __init__(self, path='', retry=5, ddos_cooldown=120, storage='csv', max_in_flight=8, burst=10,
+                 exchange=None, orderbook_storage=None, markets: MarketCache=None):
         """
         Initialize binance exchange data pipeline.
 
@@ -23,13 +24,26 @@ class Binance:
             path: Path on the disk to save fetched data. Defaults to ''.
             retry: Max number of retry if an exception is raised by exchange API. Default to 5.
             ddos_cooldown: Number of seconds to cool down if triggers an exchange DDOS protection. Default to be 120.
+            storage: Format of saved data, 'csv' or 'parquet'. Defaults to 'csv'.
+            max_in_flight: Max number of concurrent requests when fetching all pairs. Defaults to 8.
+            burst: Number of requests that can be sent at once before the rate limit applies. Defaults to 10.
+            exchange: ccxt exchange instance to fetch from. Defaults to None, which creates a new one.
+            orderbook_storage: Format of saved order books, 'csv', 'parquet' or 'book' for the compact binary format.
+                               Defaults to None, i.e. same as storage.
+            markets: Cache of market metadata. Defaults to None, i.e. the cache shared by all pipelines saving to path.
         """
         self.exchange_name = 'binance'
-        self.exchange = getattr(ccxt, self.exchange_name)()
+        self.exchange = getattr(ccxt, self.exchange_name)() if exchange is None else exchange
         self.path = path
         self.retry = retry
         self.cooldown = ddos_cooldown
 
+        # requests are throttled by the shared token bucket instead of ccxt's per-call sleep
+        self.exchange.enableRateLimit = False
+        self.limiter = TokenBucket(1000 / self.exchange.rateLimit, burst)
+        self.pool = FetchPool(self.limiter, max_in_flight, retry, ddos_cooldown, self.exchange.rateLimit / 1000)
+        self.markets = shared_cache(path) if markets is None else markets
+
         # data cache
         self.last_ohlcv = {}
         self.last_bid_ask = {}
@@ -37,24 +51,39 @@ class Binance:
         self.last_symbol = {}
 
         # create directories if not created
+        self.storage = {}
         if path != '':
             # the directory name for fetched data from different methods
             self.directory = {'OHLCV': 'OHLCV', 'bidask': 'bidask', 'orderbook': 'orderbook'}
             for dir_str in self.directory:
                 directory = path + self.exchange_name + '/' + self.directory[dir_str] + '/'
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
+                storage_format = orderbook_storage if dir_str == 'orderbook' and orderbook_storage else storage
+                self.storage[dir_str] = make_storage(storage_format, directory)
+
+    def close(self):
+        """
+        Flush pending data and close files kept open by storages.
+        """
+        for storage in self.storage.values():
+            storage.close()
 
-    def load_markets(self):
+    def load_markets(self, reload=False):
         """
-        Load market data.
+        Load market data. Markets are only requested if the cached ones are older than the cache ttl, and the last
+        cached markets are used if the request fails.
+
+        Args:
+            reload: Request markets even if the cached ones are fresh. Defaults to False.
 
         Returns:
             bool: True if successful, False otherwise.
         """
+        if not reload and self.markets.load(self.exchange):
+            return True
+
         for attempt in range(self.retry):
             try:
-                self.exchange.loadMarkets()
+                self.markets.fetch(self.exchange)
             except (ExchangeNotAvailable, ExchangeError, RequestTimeout) as exception:
                 print('   ' + exception.__class__.__name__ + ', retry ' + str(attempt + 1) + '/' + str(self.retry))
                 time.sleep(self.exchange.rateLimit / 1000)
@@ -63,81 +92,105 @@ class Binance:
                 print('   DDoSProtection error, cool down ' + str(self.cooldown) + "s...")
                 time.sleep(self.cooldown)
                 continue
+            except NetworkError as exception:
+                # e.g. no connection at all
+                print('   ' + exception.__class__.__name__ + ', retry ' + str(attempt + 1) + '/' + str(self.retry))
+                time.sleep(self.exchange.rateLimit / 1000)
+                continue
             else:
                 return True
         else:
+            if self.markets.load(self.exchange, stale=True):
+                print('   Fail to load market, use markets cached {:.0f}s ago'.format(
+                    self.markets.age(self.exchange.id)))
+                return True
             print('   Fail to load market')
             return False
 
     def fetch_ohlcv(self, save=True):
         """
-        Fetch last 500 ticks of OHLCV data (1 min per tick) for all tradable pairs.
+        Fetch last 500 ticks of OHLCV data (1 min per tick) for all tradable pairs, concurrently within the rate limit.
 
         Args:
             save: Save fetched data to disk. Defaults to False.
+
+        Returns:
+            Number of pairs fetched. FetchError is raised if markets or all pairs fail to load.
         """
 
         print("Fetching OHLCV from " + self.exchange_name + "...")
         if not self.load_markets():
-            return
+            raise FetchError('Fail to load market')
 
-        fieldnames = ['timestamp', 'open', 'high', 'low', 'closing', 'volume']
-        directory = self.path + self.exchange_name + '/' + self.directory['OHLCV'] + '/'
-
-        counter = 1
-        for symbol in self.exchange.markets:
-            print('    ' + str(counter) + '/' + str(len(self.exchange.markets)) + ' ' + symbol)
-            for attempt in range(self.retry):
-                try:
-                    self.last_ohlcv[symbol] = self.exchange.fetch_ohlcv(symbol, '1m')
-                except (ExchangeNotAvailable, ExchangeError, RequestTimeout) as exception:
-                    print('   ' + exception.__class__.__name__ + ', retry ' + str(attempt + 1) + '/' + str(self.retry))
-                    time.sleep(self.exchange.rateLimit / 1000)
-                    continue
-                except DDoSProtection:
-                    print('   DDoSProtection error, cool down ' + str(self.cooldown) + "s...")
-                    time.sleep(self.cooldown)
-                    continue
-                else:
-                    break
-            else:
-                print('   Fail to load OHLCV ' + symbol)
-                continue
+        fieldnames = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+        if save and self.path == '':
+            raise PathNotSpecified('Path not specified for saving data. ')
 
-            if save:
-                if self.path == '':
-                    raise PathNotSpecified('Path not specified for saving data. ')
+        counter = [0]
+        missed = []
 
-                filename = directory + symbol.translate({ord(c): '-' for c in '!@#$/'}) + '.csv'
-                if os.path.exists(filename):
-                    # for existed file, first search for the last timestamp and then append OHLCV after that
-                    with open(filename, 'rb') as file:
-                        file.seek(-2, os.SEEK_END)        # Jump to the second last byte
-                        while file.read(1) != b"\n":      # Until EOL is found...
-                            file.seek(-2, os.SEEK_CUR)    # ...jump back the read byte plus one more
-                        last = file.readline()
-                        last_timestamp_in_file = int(last.split(b",")[0])
+        def on_fetched(symbol, ohlcv):
+            counter[0] += 1
+            print('    ' + str(counter[0]) + '/' + str(len(self.exchange.markets)) + ' ' + symbol)
+            self.last_ohlcv[symbol] = ohlcv
 
+            if save and ohlcv:
+                # for existed file, first search for the last timestamp and then append OHLCV after that
+                last_timestamp_in_file = self.storage['OHLCV'].last_timestamp(symbol)
+                if last_timestamp_in_file is not None:
                     first_fetched_timestamp = self.last_ohlcv[symbol][0][0]
 
                     starting_row = (last_timestamp_in_file - first_fetched_timestamp) // (60 * 1000) + 1
                     if starting_row < 0:
-                        raise TimestampError('The last timestamp in the file is 1 min earlier than'
-                                             'the first timestamp in fetched data.')
+                        # a previous run was missed, the hole is filled by backfill below
+                        missed.append(symbol)
+                        return
                 else:
                     starting_row = 0
-                    # for newly created file, first write the header
-                    with open(filename, 'a+', newline='') as file:
-                        writer = csv.writer(file)
-                        writer.writerow(fieldnames)
 
-                with open(filename, 'a+', newline='') as file:
-                    writer = csv.writer(file)
-                    for row in range(starting_row, len(self.last_ohlcv[symbol])):
-                        writer.writerow(self.last_ohlcv[symbol][row])
+                self.storage['OHLCV'].append(symbol, fieldnames, self.last_ohlcv[symbol][starting_row:])
+
+        results, failed = self.pool.run(lambda symbol: self.exchange.fetch_ohlcv(symbol, '1m'),
+                                        list(self.exchange.markets), callback=on_fetched)
+        for symbol in failed:
+            print('   Fail to load OHLCV ' + symbol)
+        if save:
+            self.storage['OHLCV'].flush()
+        if failed and not results:
+            raise FetchError('Fail to load OHLCV of all {:d} pairs'.format(len(failed)))
+
+        if missed:
+            end = max(self.last_ohlcv[symbol][-1][0] for symbol in missed) + 60 * 1000
+            self.backfill_ohlcv(symbols=missed, end=end)
+        return len(results)
 
-            counter += 1
-            time.sleep(self.exchange.rateLimit / 1000)
+    def backfill_ohlcv(self, start=None, end=None, symbols=None, timeframe='1m', limit=500):
+        """
+        Fetch missing OHLCV history from start to end and save it in time order. Only gaps in saved data are fetched,
+        so an interrupted backfill is resumed by calling it again.
+
+        Args:
+            start: First timestamp to backfill in ms. Defaults to None, i.e. from the first saved timestamp of each
+                   symbol.
+            end: End of backfill in ms, exclusive. Defaults to None, i.e. up to the last closed candle.
+            symbols: Symbols to backfill. Defaults to None, i.e. all tradable pairs.
+            timeframe: OHLCV timeframe. Defaults to '1m'.
+            limit: Max number of candles per request. Defaults to 500.
+
+        Returns:
+            Dictionary of form {symbol: number of rows saved}.
+        """
+        if self.path == '':
+            raise PathNotSpecified('Path not specified for saving data. ')
+
+        print("Backfilling OHLCV from " + self.exchange_name + "...")
+        if symbols is None:
+            if not self.load_markets():
+                return {}
+            symbols = list(self.exchange.markets)
+
+        backfill = Backfill(self.exchange, self.storage['OHLCV'], self.pool, timeframe, limit)
+        return backfill.run(symbols, start, end)
 
     def fetch_bid_ask(self, save=True):
         """
@@ -145,14 +198,16 @@ class Binance:
 
         Args:
             save: Save fetched data to disk. Defaults to False.
+
+        Returns:
+            Number of pairs fetched. FetchError is raised if markets or bid-ask fail to load.
         """
 
         print("Fetching bid-ask from " + self.exchange_name + "...")
         if not self.load_markets():
-            return
+            raise FetchError('Fail to load market')
 
         fieldnames = ['timestamp', 'bid', 'ask', 'last']
-        directory = self.path + self.exchange_name + '/' + self.directory['bidask'] + '/'
 
         for attempt in range(self.retry):
             try:
@@ -169,7 +224,7 @@ class Binance:
                 break
         else:
             print('   Fail to load bid-ask')
-            return
+            raise FetchError('Fail to load bid-ask')
 
         for symbol in data:
             if symbol == '123456':
@@ -182,79 +237,60 @@ class Binance:
                 if self.path == '':
                     raise PathNotSpecified('Path not specified for saving data. ')
 
-                filename = directory + symbol.translate({ord(c): '-' for c in '!@#$/'}) + '.csv'
+                self.storage['bidask'].append(symbol, fieldnames, [self.last_bid_ask[symbol]])
 
-                if os.path.exists(filename):
-                    with open(filename, 'a', newline='') as file:
-                        writer = csv.writer(file)
-                        writer.writerow(self.last_bid_ask[symbol])
-                else:
-                    with open(filename, 'a+', newline='') as csvfile:
-                        writer = csv.writer(csvfile)
-                        writer.writerow(fieldnames)
-                        writer.writerow(self.last_bid_ask[symbol])
+        if save:
+            self.storage['bidask'].flush()
+        return len(data)
 
     """ TODO: fix, default orderbook_params value is mutable """
     def fetch_order_book(self, save=True, params={'limit': 100}):
         """
-        Fetch current order book for all tradable pairs, to self.last_order_book as list.
+        Fetch current order book for all tradable pairs concurrently within the rate limit, to self.last_order_book
+        as list.
 
         Args:
             save: Save fetched data to disk. Defaults to False.
             params: Parameter for order book. Defaults to {'limit': 100}, which fetches first 100 best prices.
+
+        Returns:
+            Number of pairs fetched. FetchError is raised if markets or all pairs fail to load.
         """
 
         print("Fetching orderbook from " + self.exchange_name + "...")
         if not self.load_markets():
-            return
+            raise FetchError('Fail to load market')
 
         fieldnames = ['timestamp', 'asks', 'bids']
-        directory = self.path + self.exchange_name + '/' + self.directory['orderbook'] + '/'
-
-        counter = 1
-        for symbol in self.exchange.markets:
-            print('    ' + str(counter) + '/' + str(len(self.exchange.markets)) + ' ' + symbol)
-            for attempt in range(self.retry):
-                try:
-                    data = self.exchange.fetchOrderBook(symbol, params)
-                except (ExchangeNotAvailable, ExchangeError, RequestTimeout) as exception:
-                    print('   ' + exception.__class__.__name__ + ', retry ' + str(attempt + 1) + '/' + str(self.retry))
-                    time.sleep(self.exchange.rateLimit / 1000)
-                    continue
-                except DDoSProtection:
-                    print('   DDoSProtection error, cool down ' + str(self.cooldown) + "s...")
-                    time.sleep(self.cooldown)
-                    continue
-                else:
-                    break
-            else:
-                print('   Fail to load order book ' + symbol)
-                continue
-
-            self.last_order_book[symbol] = [data['timestamp'], data['asks'], data['bids']]
-
-            if save:
-                if self.path == '':
-                    raise PathNotSpecified('Path not specified for saving data. ')
+        if save and self.path == '':
+            raise PathNotSpecified('Path not specified for saving data. ')
 
-                to_write = [data['timestamp'], base64.b64encode(json.dumps(data['asks']).encode()).decode(),
-                            base64.b64encode(json.dumps(data['bids']).encode()).decode()]
-                # decode with: decode_strings = json.loads(base64.b64decode(encoded_string.encode()).decode())
+        counter = [0]
 
-                filename = directory + symbol.translate({ord(c): '-' for c in '!@#$/'}) + '.csv'
+        def on_fetched(symbol, data):
+            counter[0] += 1
+            print('    ' + str(counter[0]) + '/' + str(len(self.exchange.markets)) + ' ' + symbol)
+            # binance doesn't timestamp order book snapshots, use the time they are received
+            timestamp = data['timestamp'] if data['timestamp'] is not None else int(time.time() * 1000)
+            self.last_order_book[symbol] = [timestamp, data['asks'], data['bids']]
 
-                if os.path.exists(filename):
-                    with open(filename, 'a', newline='') as file:
-                        writer = csv.writer(file)
-                        writer.writerow(to_write)
-                else:
-                    with open(filename, 'a+', newline='') as csvfile:
-                        writer = csv.writer(csvfile)
-                        writer.writerow(fieldnames)
-                        writer.writerow(to_write)
-
-            counter += 1
-            time.sleep(self.exchange.rateLimit / 1000)
+            if save:
+                # csv storage encodes asks and bids as base64 json, parquet storage keeps them as nested lists and
+                # book storage as fixed-width arrays
+                self.storage['orderbook'].append(symbol, fieldnames, [self.last_order_book[symbol]])
+
+        # binance weights depth requests by limit: 1 up to 100 levels, 5 up to 500, 10 up to 1000
+        limit = params.get('limit', 100)
+        weight = 1 if limit <= 100 else 5 if limit <= 500 else 10
+        results, failed = self.pool.run(lambda symbol: self.exchange.fetchOrderBook(symbol, params),
+                                        list(self.exchange.markets), weight=weight, callback=on_fetched)
+        for symbol in failed:
+            print('   Fail to load order book ' + symbol)
+        if save:
+            self.storage['orderbook'].flush()
+        if failed and not results:
+            raise FetchError('Fail to load order book of all {:d} pairs'.format(len(failed)))
+        return len(results)
 
     """ TODO: fix, default orderbook_params value is mutable """
     def fetch_symbol(self, symbol, interval='1m', ohlcv_limit=10, orderbook_params={'limit': 10}):
@@ -1,49 +1,180 @@
-from requests.exceptions import ReadTimeout
+from requests.exceptions import ReadTimeout, ConnectionError
+from requests.adapters import HTTPAdapter
 
 from api.errors import PathNotSpecified
 from api.errors import TimestampError
+from api.errors import FetchError
+from api.storage import CsvStorage
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-import os
-import csv
 import time
 import json
+import threading
 import requests
 
 
 class CoinMarketCap:
-    def __init__(self, path='', retry=5):
+    def __init__(self, path='', retry=5, max_in_flight=4, timeout=(5, 30),
+                 base_url='https://api.coinmarketcap.com/v1/'):
+        """
+        Initialize coinmarketcap data pipeline.
+
+        Args:
+            path: Path on the disk to save fetched data. Defaults to ''.
+            retry: Max number of retry of a request. Defaults to 5.
+            max_in_flight: Max number of listing pages fetched at once. Defaults to 4.
+            timeout: (connect, read) timeout of a request in seconds. Defaults to (5, 30).
+            base_url: URL of the API. Defaults to 'https://api.coinmarketcap.com/v1/'.
+        """
         self.data_source_name = 'coinmarketcap'
-        self.base_url = 'https://api.coinmarketcap.com/v1/'
+        self.base_url = base_url
         self.path = path
         self.retry = retry
-        self.timeout = 30
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
 
         # data cache
         self.last_volume = {}
+        # start offsets of listing pages that failed in the last fetch_listing
+        self.failed_pages = []
+        # {request: (ETag, Last-Modified, data)} of the last response of each request, for conditional requests
+        self.validators = {}
+        self._lock = threading.Lock()
 
+        # keep-alive connections shared by all requests, one per page in flight
         self.session = requests.session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
+        self.storage = None
         if path != '':
             self.path = path + '/' + self.data_source_name + '/'
-            if not os.path.exists(self.path):
-                os.makedirs(self.path)
+            self.storage = CsvStorage(self.path)
+
+    def request(self, endpoint, params):
+        """
+        Conditional GET request. If the server answers the data hasn't changed since the last request of the same
+        endpoint and params, the data of the last response is returned without being downloaded again.
+
+        Returns:
+            (Decoded JSON data, whether data changed since the last request). Data is None if the request failed.
+        """
+        key = (endpoint, tuple(sorted((params or {}).items())))
+        headers = {}
+        with self._lock:
+            cached = self.validators.get(key)
+        if cached is not None:
+            if cached[0] is not None:
+                headers['If-None-Match'] = cached[0]
+            if cached[1] is not None:
+                headers['If-Modified-Since'] = cached[1]
 
-    def get(self, endpoint, params):
         for attempt in range(self.retry):
             try:
-                response = self.session.get(self.base_url + endpoint, params=params, timeout=self.timeout)
-            except ReadTimeout as exception:
+                response = self.session.get(self.base_url + endpoint, params=params, headers=headers,
+                                            timeout=self.timeout)
+            except (ReadTimeout, ConnectionError) as exception:
                 print('   ' + exception.__class__.__name__ + ', retry ' + str(attempt + 1) + '/' + str(self.retry))
-                time.sleep(1)
+                # exponential backoff
+                time.sleep(min(0.5 * 2 ** attempt, 30))
+                continue
+
+            if response.status_code == 304 and cached is not None:
+                return cached[2], False
+            try:
+                if response.status_code != 200:
+                    raise ValueError('HTTP ' + str(response.status_code))
+                data = json.loads(response.text)
+            except ValueError as exception:
+                # an error page, or a 304 without cached data
+                print('   ' + str(exception) + ', retry ' + str(attempt + 1) + '/' + str(self.retry))
+                time.sleep(min(0.5 * 2 ** attempt, 30))
                 continue
-            else:
-                return json.loads(response.text)
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            if etag is not None or last_modified is not None:
+                with self._lock:
+                    self.validators[key] = (etag, last_modified, data)
+            return data, True
         else:
             print('   Fail to get from: ' + self.base_url + '/' + endpoint)
-            return
+            return None, False
 
-    """ TODO: fix, default params value is mutable """
-    def fetch_volume(self, save=True, params={'start': 0, 'limit': 200}):
+    def get(self, endpoint, params):
+        return self.request(endpoint, params)[0]
+
+    def fetch_listing(self, endpoint='/ticker/', page_size=100):
+        """
+        Fetch the full listing page by page, max_in_flight pages at once, until a page is shorter than page_size. A
+        page whose request failed is sent once more after the others, and its start offset is kept in failed_pages if
+        it fails again, instead of being taken as the end of the listing. Once max_in_flight requests in a row have
+        failed, e.g. during an outage, no more pages are sent and the pages in flight are waited for.
+
+        Returns:
+            List of (page data, whether data changed since last fetch), ordered by start offset, without failed pages.
+        """
+        pages = {}
+        end = None
+        next_start = 0
+        in_flight = {}
+        # start offsets of failed pages to send again, and of pages that failed twice
+        retries, failed, retried = [], [], set()
+        # number of requests failed in a row
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            while True:
+                while len(in_flight) < self.max_in_flight and failures < self.max_in_flight and \
+                        (retries or end is None or next_start < end):
+                    if retries:
+                        start = retries.pop()
+                    else:
+                        start = next_start
+                        next_start += page_size
+                    future = executor.submit(self.request, endpoint, {'start': start, 'limit': page_size})
+                    in_flight[future] = start
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start = in_flight.pop(future)
+                    data, changed = future.result()
+                    if data is None:
+                        failures += 1
+                        if start in retried or failures >= self.max_in_flight:
+                            failed.append(start)
+                        else:
+                            retried.add(start)
+                            retries.append(start)
+                        continue
+                    failures = 0
+                    pages[start] = (data, changed)
+                    # a short page is the end of the listing
+                    if len(data) < page_size:
+                        end = start + page_size if end is None else min(end, start + page_size)
+
+        # pages still to send again when the listing was given up
+        failed.extend(retries)
+        self.failed_pages = sorted(start for start in failed if end is None or start < end)
+        for start in self.failed_pages:
+            print('   Fail to load listing page from ' + str(start))
+        return [pages[start] for start in sorted(pages) if end is None or start < end]
+
+    def fetch_volume(self, save=True, params=None, page_size=100):
+        """
+        Fetch volume data of coins.
+
+        Args:
+            save: Save fetched data to disk. Defaults to True.
+            params: Parameters of a single listing request, e.g. {'start': 0, 'limit': 200}. Defaults to None, which
+                    fetches the full listing concurrently by pages of page_size.
+            page_size: Number of coins per page of the full listing. Defaults to 100.
+
+        Returns:
+            Number of coins fetched. FetchError is raised, after saving the fetched coins, if pages of the full listing
+            fail to load.
+        """
         def num(s):
             try:
                 return int(s)
@@ -57,42 +188,39 @@ class CoinMarketCap:
         fieldnames = ['timestamp', 'rank', 'available_supply', 'market_cap_usd', '24h_volume_usd',
                       'percent_change_7d', 'percent_change_24h', 'percent_change_1h', 'price_usd', 'price_btc']
 
-        data = self.get(endpoint, params)
-
-        for data_dict in data:
-            symbol = data_dict['symbol']
-            self.last_volume[symbol] = {}
-            for field in fieldnames:
-                if field == 'timestamp':
-                    self.last_volume[symbol]['timestamp'] = int(data_dict['last_updated']) * 1000    # to ms
-                else:
-                    self.last_volume[symbol][field] = num(data_dict[field])
-
-            if save:
-                if self.path == '':
-                    raise PathNotSpecified("Path not specified for saving data. ")
-
-                filename = self.path + data_dict['symbol'].translate({ord(c): '-' for c in '!@#$/'}) + '.csv'
-
-                if os.path.exists(filename):
-                    with open(filename, 'rb') as file:
-                        file.seek(-2, os.SEEK_END)      # Jump to the second last byte
-                        while file.read(1) != b"\n":    # Until EOL is found...
-                            file.seek(-2, os.SEEK_CUR)  # ...jump back the read byte plus one more
-                        last = file.readline()
-                        last_timestamp_in_file = int(last.split(b",")[0])
-
-                    if self.last_volume[symbol]['timestamp'] < last_timestamp_in_file:
+        if params is not None:
+            data, changed = self.request(endpoint, params)
+            pages = [(data or [], changed)]
+        else:
+            pages = self.fetch_listing(endpoint, page_size)
+
+        for data, changed in pages:
+            for data_dict in data:
+                symbol = data_dict['symbol']
+                self.last_volume[symbol] = {}
+                for field in fieldnames:
+                    if field == 'timestamp':
+                        self.last_volume[symbol]['timestamp'] = int(data_dict['last_updated']) * 1000    # to ms
+                    else:
+                        self.last_volume[symbol][field] = num(data_dict[field])
+
+                # an unchanged page has been saved by the fetch it was first downloaded in
+                if save and changed:
+                    if self.path == '':
+                        raise PathNotSpecified("Path not specified for saving data. ")
+
+                    # last timestamp is cached by storage, the file is only read once per symbol
+                    timestamp = self.last_volume[symbol]['timestamp']
+                    last_timestamp_in_file = self.storage.last_timestamp(symbol)
+                    if last_timestamp_in_file is not None and timestamp < last_timestamp_in_file:
                         raise TimestampError('It seems saved data is from the future. ')
-                    elif self.last_volume[symbol]['timestamp'] > last_timestamp_in_file:
-                        with open(filename, 'a+', newline='') as file:
-                            writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
-                            writer.writerow(self.last_volume[symbol])
-
-                else:
-                    with open(filename, 'a+', newline='') as file:
-                        writer = csv.writer(file)
-                        writer.writerow(fieldnames)
-
-                        writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
-                        writer.writerow(self.last_volume[symbol])
+                    elif last_timestamp_in_file is None or timestamp > last_timestamp_in_file:
+                        self.storage.append(symbol, fieldnames,
+                                            [[self.last_volume[symbol][field] for field in fieldnames]])
+
+        if save and self.storage is not None:
+            self.storage.flush()
+        if params is None and self.failed_pages:
+            # what was fetched is saved, but the listing is incomplete
+            raise FetchError('Fail to load {:d} listing pages'.format(len(self.failed_pages)))
+        return sum(len(data) for data, _ in pages)
@@ -0,0 +1,199 @@
+import time
+import heapq
+import random
+import threading
+
+
+class Job(object):
+    def __init__(self, name: str, fun, interval: float, jitter: float=0):
+        """
+        A task run by Collector every interval seconds.
+
+        Args:
+            name: Name of the job.
+            fun: Function with no argument. If it returns a number, it is counted as the number of items fetched.
+            interval: Number of seconds between two scheduled runs.
+            jitter: Max random delay in seconds added to each scheduled run. Defaults to 0.
+        """
+        self.name = name
+        self.fun = fun
+        self.interval = interval
+        self.jitter = jitter
+
+        # health and throughput counters
+        self.runs = 0
+        self.failures = 0
+        self.missed = 0
+        self.items = 0
+        self.busy_time = 0.0
+        self.last_duration = None
+        self.last_success = None
+        self.last_error = None
+
+    def stats(self) -> dict:
+        return {'runs': self.runs, 'failures': self.failures, 'missed': self.missed, 'items': self.items,
+                'last_duration': self.last_duration,
+                'mean_duration': self.busy_time / self.runs if self.runs else None,
+                'items_per_second': self.items / self.busy_time if self.busy_time else None,
+                'last_success': self.last_success, 'last_error': self.last_error}
+
+
+class Collector(object):
+    def __init__(self, clock=time.time, sleep=None, seed: int=None):
+        """
+        Long-running scheduler of collector jobs. Each job runs at its own cadence on a fixed grid of start + k *
+        interval, plus a random jitter so that jobs sharing a cadence don't hit the exchange at the same instant. A job
+        that overruns skips the grid points it missed, instead of running back to back to catch up.
+
+        Jobs run one at a time in the thread calling run, so data sources and storages are never used concurrently.
+        They are expected to keep their own state warm between runs, e.g. one Binance instance for all runs.
+
+        Args:
+            clock: Clock in seconds. Defaults to time.time.
+            sleep: Sleep function. Defaults to None, i.e. wait until the next job or until stop is called.
+            seed: Seed of the jitter. Defaults to None.
+        """
+        self._clock = clock
+        self._stopped = threading.Event()
+        self._sleep = sleep if sleep is not None else self._stopped.wait
+        self._random = random.Random(seed)
+
+        self.jobs = {}
+        # (time to run, order of insertion, grid time, job name)
+        self._queue = []
+        self._order = 0
+        self.started = None
+
+    def add_job(self, name: str, fun, interval: float, jitter: float=0, start: float=None) -> Job:
+        """
+        Schedule fun every interval seconds, from start.
+
+        Args:
+            name: Name of the job, unique.
+            fun: Function with no argument. If it returns a number, it is counted as the number of items fetched.
+            interval: Number of seconds between two runs.
+            jitter: Max random delay in seconds added to each run. Defaults to 0.
+            start: Time of the first run. Defaults to None, i.e. now.
+
+        Returns:
+            The job.
+        """
+        assert name not in self.jobs, "Job already added. "
+        job = Job(name, fun, interval, jitter)
+        self.jobs[name] = job
+        self.__schedule(job, self._clock() if start is None else start)
+        return job
+
+    def __schedule(self, job: Job, grid_time: float):
+        run_time = grid_time + (self._random.uniform(0, job.jitter) if job.jitter else 0)
+        heapq.heappush(self._queue, (run_time, self._order, grid_time, job.name))
+        self._order += 1
+
+    def __run_job(self, job: Job, grid_time: float):
+        start = self._clock()
+        try:
+            items = job.fun()
+        except Exception as exception:
+            job.failures += 1
+            job.last_error = (start, repr(exception))
+            print('[Collector] Job {:s} failed: {:s}'.format(job.name, repr(exception)))
+        else:
+            job.last_success = start
+            if isinstance(items, (int, float)):
+                job.items += items
+        end = self._clock()
+        job.runs += 1
+        job.last_duration = end - start
+        job.busy_time += job.last_duration
+
+        # next grid point in the future
+        next_time = grid_time + job.interval
+        if next_time <= end:
+            missed = int((end - next_time) // job.interval) + 1
+            job.missed += missed
+            next_time += missed * job.interval
+        self.__schedule(job, next_time)
+
+    def run_pending(self) -> int:
+        """
+        Run jobs that are due.
+
+        Returns:
+            Number of jobs run.
+        """
+        count = 0
+        now = self._clock()
+        while self._queue and self._queue[0][0] <= now and not self._stopped.is_set():
+            _, _, grid_time, name = heapq.heappop(self._queue)
+            self.__run_job(self.jobs[name], grid_time)
+            count += 1
+        return count
+
+    def run(self, duration: float=None):
+        """
+        Run jobs until stop is called, or for duration seconds.
+        """
+        self._stopped.clear()
+        self.started = self._clock()
+        end = None if duration is None else self.started + duration
+        print('[Collector] Started with {:d} jobs'.format(len(self.jobs)))
+        while not self._stopped.is_set() and self._queue:
+            now = self._clock()
+            if end is not None and now >= end:
+                break
+            wake = self._queue[0][0] if end is None else min(self._queue[0][0], end)
+            if wake > now:
+                self._sleep(wake - now)
+                continue
+            self.run_pending()
+        print('[Collector] Stopped')
+
+    def stop(self):
+        """
+        Stop run, from another thread or a signal handler. The running job, if any, is finished first.
+        """
+        self._stopped.set()
+
+    def health(self) -> dict:
+        """
+        Returns:
+            Dictionary of form {'uptime': seconds, 'healthy': bool, 'jobs': {name: counters}}. The collector is healthy
+            if every job succeeded within the last two intervals plus jitter.
+        """
+        now = self._clock()
+        jobs = {name: self.jobs[name].stats() for name in self.jobs}
+        healthy = True
+        for name, job in self.jobs.items():
+            since = job.last_success if job.last_success is not None else self.started
+            if since is None or now - since > 2 * job.interval + job.jitter:
+                healthy = False
+            jobs[name]['lag'] = None if job.last_success is None else now - job.last_success
+        return {'uptime': None if self.started is None else now - self.started, 'healthy': healthy, 'jobs': jobs}
+
+
+def make_collector(binance=None, coinmarketcap=None, ohlcv: float=60, bid_ask: float=10, order_book: float=300,
+                   volume: float=300, jitter: float=1, seed: int=None) -> Collector:
+    """
+    Collector of Binance and CoinMarketCap data at independent cadences, in seconds. A cadence of 0 disables the job.
+    Markets are loaded once before scheduling, and the data sources are reused by every run.
+
+    Args:
+        binance: Binance data pipeline. Defaults to None.
+        coinmarketcap: CoinMarketCap data pipeline. Defaults to None.
+        ohlcv: Cadence of Binance.fetch_ohlcv. Defaults to 60.
+        bid_ask: Cadence of Binance.fetch_bid_ask. Defaults to 10.
+        order_book: Cadence of Binance.fetch_order_book. Defaults to 300.
+        volume: Cadence of CoinMarketCap.fetch_volume. Defaults to 300.
+        jitter: Max random delay of each run, in seconds. Defaults to 1.
+        seed: Seed of the jitter. Defaults to None.
+    """
+    collector = Collector(seed=seed)
+    if binance is not None:
+        binance.load_markets()
+        for name, fun, interval in (('ohlcv', binance.fetch_ohlcv, ohlcv), ('bid_ask', binance.fetch_bid_ask, bid_ask),
+                                    ('order_book', binance.fetch_order_book, order_book)):
+            if interval:
+                collector.add_job(name, fun, interval, jitter)
+    if coinmarketcap is not None and volume:
+        collector.add_job('volume', coinmarketcap.fetch_volume, volume, jitter)
+    return collector
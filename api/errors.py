@@ -4,3 +4,7 @@ class TimestampError(Exception):
 
 class PathNotSpecified(Exception):
     pass
+
+
+class FetchError(Exception):
+    pass
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import threading
+
+
+class MarketCache(object):
+    def __init__(self, directory: str='', ttl: float=3600, clock=time.time):
+        """
+        Market metadata of exchanges, kept in memory for ttl seconds and saved to disk as a JSON snapshot, so that
+        data pipelines sharing the cache call the markets endpoint at most once per ttl. A snapshot older than ttl is
+        still used if the markets endpoint can't be reached, e.g. on a cold start without network.
+
+        Args:
+            directory: Directory of snapshots, saved as directory/exchange_id/markets.json. Defaults to '', i.e. in
+                       memory only.
+            ttl: Number of seconds markets stay fresh. Defaults to 3600.
+            clock: Clock in seconds. Defaults to time.time.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self._clock = clock
+        # {exchange id: (time loaded, markets, currencies)}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def filename(self, exchange_id: str) -> str:
+        return self.directory + exchange_id + '/markets.json'
+
+    def __read_snapshot(self, exchange_id: str):
+        if self.directory == '' or not os.path.exists(self.filename(exchange_id)):
+            return None
+        try:
+            with open(self.filename(exchange_id), 'r') as file:
+                snapshot = json.load(file)
+            return snapshot['timestamp'], snapshot['markets'], snapshot.get('currencies')
+        except (ValueError, KeyError):
+            print('[Markets] Ignore corrupted snapshot ' + self.filename(exchange_id))
+            return None
+
+    def __write_snapshot(self, exchange_id: str, entry: tuple):
+        if self.directory == '':
+            return
+        filename = self.filename(exchange_id)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # write aside and swap, so that a crash never leaves a truncated snapshot
+        with open(filename + '.tmp', 'w') as file:
+            json.dump({'timestamp': entry[0], 'markets': entry[1], 'currencies': entry[2]}, file)
+        os.replace(filename + '.tmp', filename)
+
+    def entry(self, exchange_id: str):
+        """
+        Returns:
+            (Time loaded, markets, currencies) of the last markets of the exchange in memory or on disk, None if
+            never loaded.
+        """
+        with self._lock:
+            entry = self._entries.get(exchange_id)
+            if entry is None:
+                entry = self.__read_snapshot(exchange_id)
+                if entry is not None:
+                    self._entries[exchange_id] = entry
+        return entry
+
+    def age(self, exchange_id: str):
+        entry = self.entry(exchange_id)
+        return None if entry is None else self._clock() - entry[0]
+
+    def load(self, exchange, stale: bool=False) -> bool:
+        """
+        Set cached markets to exchange, without any request.
+
+        Args:
+            exchange: ccxt exchange instance.
+            stale: Use markets older than ttl. Defaults to False.
+
+        Returns:
+            bool: True if markets are set, False if they have to be fetched.
+        """
+        entry = self.entry(exchange.id)
+        if entry is None or (not stale and self._clock() - entry[0] >= self.ttl):
+            return False
+        # markets already set from the same entry are not parsed again
+        if getattr(exchange, '_market_cache_entry', None) is not entry:
+            exchange.set_markets(entry[1], entry[2])
+            exchange._market_cache_entry = entry
+        return True
+
+    def fetch(self, exchange) -> dict:
+        """
+        Fetch markets of exchange from the markets endpoint, and cache them. Exceptions of the request are raised.
+
+        Returns:
+            Markets of exchange.
+        """
+        markets = exchange.load_markets(reload=True)
+        entry = (self._clock(), markets, getattr(exchange, 'currencies', None))
+        with self._lock:
+            self._entries[exchange.id] = entry
+            self.__write_snapshot(exchange.id, entry)
+        exchange._market_cache_entry = entry
+        return markets
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_cache(directory: str='') -> MarketCache:
+    """
+    Market cache shared by all data pipelines saving to directory.
+    """
+    with _shared_lock:
+        if directory not in _shared:
+            _shared[directory] = MarketCache(directory)
+        return _shared[directory]
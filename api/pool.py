@@ -0,0 +1,134 @@
+from ccxt.base.errors import ExchangeError
+from ccxt.base.errors import NetworkError
+from ccxt.base.errors import DDoSProtection
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import time
+import heapq
+import threading
+
+
+class TokenBucket(object):
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic, sleep=time.sleep):
+        """
+        Thread-safe token bucket rate limiter. Tokens refill at rate per second up to capacity, and each request takes
+        tokens equal to its weight. Requests reserve their tokens in arrival order and sleep outside of the lock until
+        the reservation is covered, so that the weight budget is used fully but never exceeded.
+
+        Args:
+            rate: Weight budget refilled per second.
+            capacity: Maximum weight that can be spent in a burst.
+            clock: Monotonic clock in seconds. Defaults to time.monotonic.
+            sleep: Sleep function. Defaults to time.sleep.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, weight: float=1):
+        """
+        Block until weight tokens are available, and take them.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= weight
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            self._sleep(delay)
+
+
+class FetchPool(object):
+    def __init__(self, limiter: TokenBucket, max_in_flight: int=8, retry: int=5, ddos_cooldown: float=120,
+                 retry_delay: float=1, clock=time.monotonic):
+        """
+        Fetch data of many symbols concurrently from an exchange API.
+
+        Args:
+            limiter: Rate limiter shared by all requests.
+            max_in_flight: Max number of requests in flight at once. Defaults to 8.
+            retry: Max number of attempts per symbol. Defaults to 5.
+            ddos_cooldown: Number of seconds a symbol waits before retry after a DDOS protection error. Defaults to 120.
+            retry_delay: Number of seconds a symbol waits before retry after a network error. Defaults to 1.
+            clock: Monotonic clock in seconds. Defaults to time.monotonic.
+        """
+        self.limiter = limiter
+        self.max_in_flight = max_in_flight
+        self.retry = retry
+        self.cooldown = ddos_cooldown
+        self.retry_delay = retry_delay
+        self._clock = clock
+
+    def __call(self, fetch, key, weight: float):
+        self.limiter.acquire(weight)
+        return fetch(key)
+
+    def run(self, fetch, keys, weight: float=1, callback=None):
+        """
+        Call fetch(key) for every key in worker threads. A failed key is rescheduled after a delay instead of blocking
+        its worker, so that retries and DDOS cooldowns of one symbol never stall the others.
+
+        Args:
+            fetch: Function of form fetch(key) -> result, e.g. a ccxt API call.
+            keys: Iterable of keys, e.g. symbols.
+            weight: Weight of each request in the limiter budget. Defaults to 1.
+            callback: Function of form callback(key, result), called in the calling thread as soon as a result is
+                      ready, e.g. to save it to disk. A key whose callback raises an exception is failed, without
+                      retry, and the other keys go on. Defaults to None.
+
+        Returns:
+            (Dictionary of form {key: result}, list of keys that failed after all retries or in callback).
+        """
+        results, failed = {}, []
+        # (time ready to be sent, original order, key, number of attempts)
+        queue = [(0, order, key, 0) for order, key in enumerate(keys)]
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            while queue or in_flight:
+                now = self._clock()
+                while queue and queue[0][0] <= now and len(in_flight) < self.max_in_flight:
+                    _, order, key, attempt = heapq.heappop(queue)
+                    in_flight[executor.submit(self.__call, fetch, key, weight)] = (order, key, attempt)
+
+                if not in_flight:
+                    # everything left is cooling down
+                    time.sleep(max(queue[0][0] - now, 0))
+                    continue
+
+                timeout = max(queue[0][0] - now, 0) if queue and len(in_flight) < self.max_in_flight else None
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    order, key, attempt = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except DDoSProtection:
+                        print('   DDoSProtection error on ' + str(key) + ', cool down ' + str(self.cooldown) + 's...')
+                        delay = self.cooldown
+                    except (NetworkError, ExchangeError) as exception:
+                        print('   ' + exception.__class__.__name__ + ' on ' + str(key) + ', retry ' +
+                              str(attempt + 1) + '/' + str(self.retry))
+                        delay = self.retry_delay
+                    else:
+                        if callback is not None:
+                            try:
+                                callback(key, result)
+                            except Exception as exception:
+                                print('   ' + exception.__class__.__name__ + ' on ' + str(key) + ': ' + str(exception))
+                                failed.append(key)
+                                continue
+                        results[key] = result
+                        continue
+
+                    if attempt + 1 < self.retry:
+                        heapq.heappush(queue, (self._clock() + delay, order, key, attempt + 1))
+                    else:
+                        failed.append(key)
+
+        return results, failed
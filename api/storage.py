@@ -0,0 +1,593 @@
+from api.errors import TimestampError
+
+from collections import OrderedDict
+
+import os
+import csv
+import json
+import zlib
+import struct
+import base64
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+class StorageBase(object):
+    extension = ''
+
+    def __init__(self, directory: str, buffer_size: int=10000, fsync: bool=False):
+        """
+        Storage backend that appends fetched rows of a data source to one file per symbol.
+
+        Appended rows are buffered in memory and written in batches, when buffer_size rows are pending or when flush is
+        called, so a collector should flush (or close) the storage at the end of each sweep. The last timestamp of each
+        symbol is cached in memory, which assumes this storage is the only writer of its directory.
+
+        Args:
+            directory: Directory to save data in. Created if not exists.
+            buffer_size: Number of pending rows, over all symbols, that triggers a flush. Defaults to 10000.
+            fsync: Force written data to disk at every flush. Defaults to False.
+        """
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._buffer = {}       # {symbol: (fieldnames, pending rows)}
+        self._buffered = 0
+        self._last = {}         # {symbol: last timestamp, None if nothing saved}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def filename(self, symbol: str) -> str:
+        return self.directory + symbol.translate({ord(c): '-' for c in '!@#$/'}) + self.extension
+
+    def exists(self, symbol: str) -> bool:
+        return symbol in self._buffer or os.path.exists(self.filename(symbol))
+
+    def last_timestamp(self, symbol: str):
+        """
+        Returns:
+            The last timestamp saved for symbol, or None if nothing has been saved yet.
+        """
+        if symbol not in self._last:
+            self._last[symbol] = self._read_last_timestamp(symbol)
+        return self._last[symbol]
+
+    def _read_last_timestamp(self, symbol: str):
+        raise NotImplementedError
+
+    def timestamps(self, symbol: str) -> np.ndarray:
+        """
+        Returns:
+            Sorted int64 array of all timestamps saved for symbol, empty if nothing has been saved yet.
+        """
+        raise NotImplementedError
+
+    def append(self, symbol: str, fieldnames: list, rows: list):
+        """
+        Append rows to the file of symbol. Rows are lists ordered as fieldnames, with timestamp first.
+        """
+        if not rows:
+            return
+        if symbol in self._buffer:
+            self._buffer[symbol][1].extend(rows)
+        else:
+            self._buffer[symbol] = (fieldnames, list(rows))
+        self._buffered += len(rows)
+        self._last[symbol] = rows[-1][0]
+
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def _write(self, symbol: str, fieldnames: list, rows: list):
+        raise NotImplementedError
+
+    def flush(self, symbol: str=None):
+        """
+        Write pending rows of symbol to disk, or of all symbols if symbol is None.
+        """
+        symbols = list(self._buffer) if symbol is None else [symbol] if symbol in self._buffer else []
+        for symbol in symbols:
+            fieldnames, rows = self._buffer.pop(symbol)
+            self._buffered -= len(rows)
+            self._write(symbol, fieldnames, rows)
+
+    def close(self):
+        """
+        Flush all pending rows and release open files.
+        """
+        self.flush()
+
+    def insert(self, symbol: str, fieldnames: list, rows: list):
+        """
+        Insert rows sorted by timestamp into the file of symbol, anywhere in time, keeping the file sorted. Rows with a
+        timestamp that is already saved are dropped.
+        """
+        raise NotImplementedError
+
+
+class CsvStorage(StorageBase):
+    extension = '.csv'
+
+    def __init__(self, directory: str, buffer_size: int=10000, fsync: bool=False, max_open: int=256):
+        """
+        Args:
+            max_open: Max number of append handles kept open, least recently used ones are closed first.
+                      Defaults to 256.
+        """
+        super(CsvStorage, self).__init__(directory, buffer_size, fsync)
+        self.max_open = max_open
+        self._files = OrderedDict()
+
+    def _read_last_timestamp(self, symbol: str):
+        filename = self.filename(symbol)
+        if not os.path.exists(filename):
+            return None
+
+        with open(filename, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() < 2:
+                return None
+            file.seek(-2, os.SEEK_END)        # Jump to the second last byte
+            while file.read(1) != b"\n":      # Until EOL is found...
+                if file.tell() < 2:
+                    file.seek(0)
+                    break
+                file.seek(-2, os.SEEK_CUR)    # ...jump back the read byte plus one more
+            last = file.readline()
+
+        try:
+            return int(last.split(b",")[0])
+        except ValueError:
+            # only the header has been written
+            return None
+
+    @staticmethod
+    def _encode_cell(cell):
+        # nested values such as order book levels don't fit in a CSV cell
+        # decode with: decode_strings = json.loads(base64.b64decode(encoded_string.encode()).decode())
+        if isinstance(cell, (list, tuple, dict)):
+            return base64.b64encode(json.dumps(cell).encode()).decode()
+        return cell
+
+    def timestamps(self, symbol: str) -> np.ndarray:
+        self.flush(symbol)
+        filename = self.filename(symbol)
+        if not os.path.exists(filename):
+            return np.empty(0, dtype=np.int64)
+        with open(filename, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            return np.array([int(row[0]) for row in reader if row], dtype=np.int64)
+
+    def _open(self, symbol: str, fieldnames: list):
+        file = self._files.pop(symbol, None)
+        if file is None:
+            if len(self._files) >= self.max_open:
+                self._close_file(next(iter(self._files)))
+            filename = self.filename(symbol)
+            is_new = not os.path.exists(filename) or os.path.getsize(filename) == 0
+            file = open(filename, 'a', newline='')
+            if is_new:
+                csv.writer(file).writerow(fieldnames)
+        # most recently used last
+        self._files[symbol] = file
+        return file
+
+    def _close_file(self, symbol: str):
+        file = self._files.pop(symbol, None)
+        if file is not None:
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+            file.close()
+
+    def _write(self, symbol: str, fieldnames: list, rows: list):
+        csv.writer(self._open(symbol, fieldnames)).writerows([self._encode_cell(cell) for cell in row] for row in rows)
+
+    def flush(self, symbol: str=None):
+        super(CsvStorage, self).flush(symbol)
+        files = list(self._files.values()) if symbol is None else [self._files[symbol]] if symbol in self._files else []
+        for file in files:
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+
+    def close(self):
+        super(CsvStorage, self).close()
+        for symbol in list(self._files):
+            self._close_file(symbol)
+
+    def insert(self, symbol: str, fieldnames: list, rows: list):
+        if not rows:
+            return
+        last_timestamp = self.last_timestamp(symbol)
+        if last_timestamp is None or rows[0][0] > last_timestamp:
+            self.append(symbol, fieldnames, rows)
+            return
+
+        self.flush(symbol)
+        self._close_file(symbol)
+        filename = self.filename(symbol)
+        with open(filename, 'r', newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            saved = [row for row in reader if row]
+
+        # merge two sorted lists, saved rows win on equal timestamps
+        merged, i = [], 0
+        for row in rows:
+            while i < len(saved) and int(saved[i][0]) < row[0]:
+                merged.append(saved[i])
+                i += 1
+            if i < len(saved) and int(saved[i][0]) == row[0]:
+                continue
+            merged.append([self._encode_cell(cell) for cell in row])
+        merged.extend(saved[i:])
+
+        # write aside and swap, so an interrupted insert never leaves a truncated file
+        with open(filename + '.tmp', 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(merged)
+        os.replace(filename + '.tmp', filename)
+        self._last[symbol] = max(last_timestamp, rows[-1][0])
+
+
+class ParquetStorage(StorageBase):
+    """
+    Each symbol is saved as a directory of parquet files, one file per flush, named after its first timestamp so that
+    lexical order is time order. The directory can be read as a single table by TickerBase.read_from_parquet.
+    Nested values such as order book levels are stored as native list columns.
+    """
+    extension = '.parquet'
+
+    def __init__(self, directory: str, compression: str='snappy', buffer_size: int=10000, fsync: bool=False):
+        if pq is None:
+            raise ImportError("pyarrow is required for parquet storage. ")
+        super(ParquetStorage, self).__init__(directory, buffer_size, fsync)
+        self.compression = compression
+
+    def _parts(self, symbol: str) -> list:
+        directory = self.filename(symbol)
+        if not os.path.exists(directory):
+            return []
+        return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.parquet'))
+
+    def _read_last_timestamp(self, symbol: str):
+        parts = self._parts(symbol)
+        if not parts:
+            return None
+        # only the footer of the last part is read
+        metadata = pq.ParquetFile(parts[-1]).metadata
+        column = metadata.schema.names.index('timestamp')
+        return max(metadata.row_group(i).column(column).statistics.max for i in range(metadata.num_row_groups))
+
+    def timestamps(self, symbol: str) -> np.ndarray:
+        self.flush(symbol)
+        if not self._parts(symbol):
+            return np.empty(0, dtype=np.int64)
+        table = pq.read_table(self.filename(symbol), columns=['timestamp'])
+        return np.sort(table.column('timestamp').to_numpy())
+
+    @staticmethod
+    def _column_type(values: list):
+        for value in values:
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                if value and isinstance(value[0], (list, tuple)):
+                    return pa.list_(pa.list_(pa.float64()))
+                return pa.list_(pa.float64())
+            break
+        return pa.float64()
+
+    def append(self, symbol: str, fieldnames: list, rows: list):
+        if not rows:
+            return
+        last_timestamp = self.last_timestamp(symbol)
+        if last_timestamp is not None and rows[0][0] <= last_timestamp:
+            raise TimestampError('Appended rows must be later than the last saved timestamp. ')
+
+        super(ParquetStorage, self).append(symbol, fieldnames, rows)
+
+    def _write(self, symbol: str, fieldnames: list, rows: list):
+        self._write_part(symbol, fieldnames, rows)
+
+    def _table(self, fieldnames: list, rows: list):
+        columns = {}
+        for i, field in enumerate(fieldnames):
+            values = [row[i] for row in rows]
+            columns[field] = pa.array(values, type=pa.int64() if field == 'timestamp' else self._column_type(values))
+        return pa.table(columns)
+
+    def _write_part(self, symbol: str, fieldnames: list, rows: list):
+        directory = self.filename(symbol)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        filename = os.path.join(directory, 'part-{:015d}.parquet'.format(rows[0][0]))
+        pq.write_table(self._table(fieldnames, rows), filename, compression=self.compression)
+        if self.fsync:
+            self._fsync(filename)
+
+    @staticmethod
+    def _fsync(filename: str):
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def insert(self, symbol: str, fieldnames: list, rows: list):
+        if not rows:
+            return
+        saved = self.timestamps(symbol)
+        timestamps = np.array([row[0] for row in rows], dtype=np.int64)
+        position = np.searchsorted(saved, timestamps)
+        duplicated = np.zeros(len(rows), dtype=bool)
+        if len(saved):
+            duplicated = saved[np.minimum(position, len(saved) - 1)] == timestamps
+
+        # rows between the same two saved timestamps are saved together
+        groups, group, group_position = [], [], None
+        for i, row in enumerate(rows):
+            if duplicated[i]:
+                continue
+            if group and position[i] != group_position:
+                groups.append(group)
+                group = []
+            group.append(row)
+            group_position = position[i]
+        if group:
+            groups.append(group)
+
+        for group in groups:
+            self._insert_group(symbol, fieldnames, group)
+        if groups:
+            last_timestamp = self.last_timestamp(symbol)
+            self._last[symbol] = groups[-1][-1][0] if last_timestamp is None else max(last_timestamp, groups[-1][-1][0])
+
+    def _insert_group(self, symbol: str, fieldnames: list, rows: list):
+        # parts never overlap in time, so that lexical order of part names stays time order. Rows that fall inside the
+        # range of an existing part are merged into it, other rows make a new part.
+        parts = self._parts(symbol)
+        firsts = [int(os.path.basename(part)[5:20]) for part in parts]
+        k = int(np.searchsorted(firsts, rows[0][0], side='right')) - 1
+        if k < 0:
+            self._write_part(symbol, fieldnames, rows)
+            return
+
+        metadata = pq.ParquetFile(parts[k]).metadata
+        column = metadata.schema.names.index('timestamp')
+        last = max(metadata.row_group(i).column(column).statistics.max for i in range(metadata.num_row_groups))
+        if last < rows[0][0]:
+            self._write_part(symbol, fieldnames, rows)
+            return
+
+        table = pq.read_table(parts[k])
+        merged = pa.concat_tables([table, self._table(fieldnames, rows).select(table.column_names).cast(table.schema)])
+        pq.write_table(merged.sort_by('timestamp'), parts[k] + '.tmp', compression=self.compression)
+        os.replace(parts[k] + '.tmp', parts[k])
+        if self.fsync:
+            self._fsync(parts[k])
+
+
+class OrderBookStorage(StorageBase):
+    """
+    Binary storage for order book snapshots. Each snapshot is a fixed-width record of depth (price, size) levels per
+    side, padded with NaN, so a range of snapshots reads back straight into NumPy arrays without per-row decoding.
+
+    A file starts with a header holding the depth, followed by one block per flush. A block holds its timestamps as
+    plain int64 and its levels zlib compressed. With delta encoding, the float64 bits of each snapshot are XORed with
+    the previous snapshot of the symbol before compression, which turns levels that didn't change into zero bytes.
+    Every keyframe_interval snapshots a block starts over from a raw snapshot, so a reader never has to decode more
+    than that many snapshots before the range it asks for.
+    """
+    extension = '.book'
+    magic = b'NYXBOOK1'
+    file_header = struct.Struct('<8sIBB2x')         # magic, depth, delta encoded, compressed
+    block_header = struct.Struct('<qqIIB3x')        # first timestamp, last timestamp, n, compressed size, keyframe
+
+    def __init__(self, directory: str, depth: int=100, delta: bool=True, keyframe_interval: int=1000,
+                 compression_level: int=6, buffer_size: int=10000, fsync: bool=False):
+        """
+        Args:
+            depth: Number of levels saved per side, deeper levels are dropped. Defaults to 100.
+            delta: XOR delta encode consecutive snapshots. Defaults to True.
+            keyframe_interval: Max number of snapshots between two raw snapshots. Defaults to 1000.
+            compression_level: zlib compression level, 0 to store uncompressed. Defaults to 6.
+        """
+        super(OrderBookStorage, self).__init__(directory, buffer_size, fsync)
+        self.depth = depth
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.compression_level = compression_level
+
+        self._previous = {}     # {symbol: bits of the last written snapshot, snapshots since keyframe}
+        self._checked = set()   # symbols whose existing file matches the format of this storage
+
+    def _levels(self, side) -> np.ndarray:
+        levels = np.full((self.depth, 2), np.nan)
+        if side:
+            side = np.asarray(side, dtype=np.float64)[:self.depth, :2]
+            levels[:len(side)] = side
+        return levels
+
+    def _index(self, symbol: str):
+        """
+        Returns:
+            (depth, delta encoded, compressed, structured array of block headers with their payload offsets), None if
+            there is no file.
+        """
+        filename = self.filename(symbol)
+        if not os.path.exists(filename):
+            return None
+        blocks = []
+        with open(filename, 'rb') as file:
+            magic, depth, delta, compressed = self.file_header.unpack(file.read(self.file_header.size))
+            if magic != self.magic:
+                raise ValueError('Not an order book file: ' + filename)
+            while True:
+                header = file.read(self.block_header.size)
+                if len(header) < self.block_header.size:
+                    break
+                first, last, n, size, keyframe = self.block_header.unpack(header)
+                blocks.append((file.tell(), first, last, n, size, keyframe))
+                # skip timestamps and levels
+                file.seek(8 * n + size, os.SEEK_CUR)
+        index = np.array(blocks, dtype=[('offset', np.int64), ('first', np.int64), ('last', np.int64),
+                                         ('n', np.int64), ('size', np.int64), ('keyframe', bool)])
+        return depth, bool(delta), bool(compressed), index
+
+    def _read_last_timestamp(self, symbol: str):
+        index = self._index(symbol)
+        if index is None or len(index[3]) == 0:
+            return None
+        return int(index[3]['last'][-1])
+
+    def timestamps(self, symbol: str) -> np.ndarray:
+        self.flush(symbol)
+        index = self._index(symbol)
+        if index is None:
+            return np.empty(0, dtype=np.int64)
+        with open(self.filename(symbol), 'rb') as file:
+            timestamps = []
+            for block in index[3]:
+                file.seek(block['offset'])
+                timestamps.append(np.frombuffer(file.read(8 * block['n']), dtype='<i8'))
+        return np.concatenate(timestamps) if timestamps else np.empty(0, dtype=np.int64)
+
+    def append(self, symbol: str, fieldnames: list, rows: list):
+        if not rows:
+            return
+        last_timestamp = self.last_timestamp(symbol)
+        if last_timestamp is not None and rows[0][0] <= last_timestamp:
+            raise TimestampError('Appended rows must be later than the last saved timestamp. ')
+        super(OrderBookStorage, self).append(symbol, fieldnames, rows)
+
+    def _write(self, symbol: str, fieldnames: list, rows: list):
+        asks, bids = fieldnames.index('asks'), fieldnames.index('bids')
+        timestamps = np.array([row[0] for row in rows], dtype='<i8')
+        levels = np.stack([np.stack([self._levels(row[asks]), self._levels(row[bids])]) for row in rows])
+        bits = levels.view('<u8').reshape(len(rows), -1)
+
+        filename = self.filename(symbol)
+        is_new = not os.path.exists(filename)
+        if not is_new and symbol not in self._checked:
+            with open(filename, 'rb') as file:
+                _, depth, delta, compressed = self.file_header.unpack(file.read(self.file_header.size))
+            if (depth, bool(delta), bool(compressed)) != (self.depth, self.delta, self.compression_level > 0):
+                raise ValueError('Format of ' + filename + ' does not match the storage. ')
+        self._checked.add(symbol)
+        # a cold start has no previous snapshot in memory, so it starts from a keyframe
+        previous, since_keyframe = self._previous.get(symbol, (None, self.keyframe_interval))
+        keyframe = not self.delta or previous is None or since_keyframe + len(rows) > self.keyframe_interval
+
+        if self.delta:
+            encoded = bits.copy()
+            encoded[1:] ^= bits[:-1]
+            if not keyframe:
+                encoded[0] ^= previous
+            self._previous[symbol] = (bits[-1].copy(), len(rows) if keyframe else since_keyframe + len(rows))
+        else:
+            encoded = bits
+        payload = encoded.tobytes()
+        if self.compression_level:
+            payload = zlib.compress(payload, self.compression_level)
+
+        with open(filename, 'ab') as file:
+            if is_new:
+                file.write(self.file_header.pack(self.magic, self.depth, self.delta, self.compression_level > 0))
+            file.write(self.block_header.pack(int(timestamps[0]), int(timestamps[-1]), len(rows), len(payload),
+                                              keyframe))
+            file.write(timestamps.tobytes())
+            file.write(payload)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+
+    def read(self, symbol: str, start: int=None, end: int=None):
+        """
+        Read snapshots of symbol between start and end into arrays. Only the blocks covering the range, back to their
+        keyframe, are decompressed.
+
+        Args:
+            symbol: Symbol to read.
+            start: Earliest timestamp to read. Defaults to None, i.e. no lower bound.
+            end: Latest timestamp to read. Defaults to None, i.e. no upper bound.
+
+        Returns:
+            (timestamps of shape (n,), asks of shape (n, depth, 2), bids of shape (n, depth, 2)). Levels are
+            (price, size) pairs from the best price, padded with NaN.
+        """
+        self.flush(symbol)
+        index = self._index(symbol)
+        depth = self.depth if index is None else index[0]
+        empty = (np.empty(0, dtype=np.int64), np.empty((0, depth, 2)), np.empty((0, depth, 2)))
+        if index is None or len(index[3]) == 0:
+            return empty
+        depth, delta, compressed, blocks = index
+
+        selected = np.ones(len(blocks), dtype=bool)
+        if start is not None:
+            selected &= blocks['last'] >= start
+        if end is not None:
+            selected &= blocks['first'] <= end
+        if not selected.any():
+            return empty
+        first, last = np.flatnonzero(selected)[[0, -1]]
+        if delta:
+            keyframes = np.flatnonzero(blocks['keyframe'][:first + 1])
+            first = keyframes[-1]
+
+        timestamps, bits, segment_starts, n = [], [], [], 0
+        with open(self.filename(symbol), 'rb') as file:
+            for block in blocks[first:last + 1]:
+                file.seek(block['offset'])
+                timestamps.append(np.frombuffer(file.read(8 * block['n']), dtype='<i8'))
+                payload = file.read(block['size'])
+                if compressed:
+                    payload = zlib.decompress(payload)
+                bits.append(np.frombuffer(payload, dtype='<u8').reshape(block['n'], -1))
+                if block['keyframe']:
+                    segment_starts.append(n)
+                n += block['n']
+
+        timestamps = np.concatenate(timestamps)
+        bits = np.concatenate(bits)
+        if delta:
+            # undo XOR delta with a running XOR, restarted at each keyframe
+            bounds = segment_starts + [n]
+            for i in range(len(segment_starts)):
+                bits[bounds[i]:bounds[i + 1]] = np.bitwise_xor.accumulate(bits[bounds[i]:bounds[i + 1]], axis=0)
+
+        levels = bits.view('<f8').reshape(n, 2, depth, 2)
+        mask = np.ones(n, dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps <= end
+        return timestamps[mask], levels[mask, 0], levels[mask, 1]
+
+
+def make_storage(storage_format: str, directory: str, **kwargs) -> StorageBase:
+    if storage_format == 'csv':
+        return CsvStorage(directory, **kwargs)
+    elif storage_format == 'parquet':
+        return ParquetStorage(directory, **kwargs)
+    elif storage_format == 'book':
+        return OrderBookStorage(directory, **kwargs)
+    else:
+        raise ValueError('Unknown storage format: ' + storage_format)
@@ -0,0 +1,194 @@
+"""
+Analyzers keep running statistics of a backtest, updated in O(1) at every tick and fill, so that results are available
+at any time without storing or post-processing the history of the run.
+"""
+
+import math
+
+_YEAR = 365 * 24 * 60 * 60 * 1000
+
+
+class AnalyzerBase(object):
+    name = 'analyzer'
+
+    def on_tick(self, timestamp: int, equity: float):
+        """
+        Called at every tick with the portfolio value, NaN if it can't be computed.
+        """
+        pass
+
+    def on_fill(self, timestamp: int, order_id, symbol: str, side: int, price: float, amount: float, fee: float):
+        """
+        Called at every transaction. side is 1 for buy and -1 for sell. Fee is in quote asset for buys and in base
+        asset for sells.
+        """
+        pass
+
+    def on_close(self, timestamp: int, order_id, symbol: str, side: int):
+        """
+        Called when an order is closed, filled or cancelled, after its last fill.
+        """
+        pass
+
+    def result(self) -> dict:
+        return {}
+
+
+class ReturnAnalyzer(AnalyzerBase):
+    name = 'returns'
+
+    def __init__(self, periods_per_year: float=None, risk_free: float=0):
+        """
+        Mean and variance of tick returns of equity by Welford's algorithm, and the Sharpe and Sortino ratios.
+
+        Args:
+            periods_per_year: Number of ticks per year to annualize ratios. Defaults to None, i.e. estimated from the
+                              mean interval between ticks.
+            risk_free: Risk free return per tick. Defaults to 0.
+        """
+        self.periods_per_year = periods_per_year
+        self.risk_free = risk_free
+
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        # sum of squared returns below the risk free return
+        self._downside = 0.0
+        self.first_equity = None
+        self.last_equity = None
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self._ticks = 0
+
+    def on_tick(self, timestamp: int, equity: float):
+        if math.isnan(equity):
+            return
+        if self.first_timestamp is None:
+            self.first_timestamp, self.first_equity = timestamp, equity
+        self._ticks += 1
+
+        if self.last_equity:
+            ret = equity / self.last_equity - 1
+            self.n += 1
+            delta = ret - self.mean
+            self.mean += delta / self.n
+            self._m2 += delta * (ret - self.mean)
+            if ret < self.risk_free:
+                self._downside += (ret - self.risk_free) ** 2
+        self.last_timestamp, self.last_equity = timestamp, equity
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.n - 1) if self.n > 1 else float('nan')
+
+    def __annualization(self) -> float:
+        if self.periods_per_year is not None:
+            return math.sqrt(self.periods_per_year)
+        if self._ticks < 2 or self.last_timestamp == self.first_timestamp:
+            return float('nan')
+        interval = (self.last_timestamp - self.first_timestamp) / (self._ticks - 1)
+        return math.sqrt(_YEAR / interval)
+
+    def result(self) -> dict:
+        std = math.sqrt(self.variance) if self.n > 1 else float('nan')
+        downside = math.sqrt(self._downside / self.n) if self.n else float('nan')
+        excess = self.mean - self.risk_free
+        annualization = self.__annualization()
+        return {'periods': self.n, 'mean': self.mean if self.n else float('nan'), 'std': std,
+                'total_return': self.last_equity / self.first_equity - 1 if self.first_equity else float('nan'),
+                'sharpe': excess / std * annualization if std else float('nan'),
+                'sortino': excess / downside * annualization if downside else float('nan')}
+
+
+class DrawdownAnalyzer(AnalyzerBase):
+    name = 'drawdown'
+
+    def __init__(self):
+        """
+        Max drawdown of equity from its running peak, and the longest time spent below a peak.
+        """
+        self.peak = None
+        self.peak_timestamp = None
+        self.drawdown = 0.0
+        self.max_drawdown = 0.0
+        self.max_duration = 0
+        self.last_timestamp = None
+
+    def on_tick(self, timestamp: int, equity: float):
+        if math.isnan(equity):
+            return
+        self.last_timestamp = timestamp
+        if self.peak is None or equity >= self.peak:
+            self.peak, self.peak_timestamp = equity, timestamp
+            self.drawdown = 0.0
+            return
+        self.drawdown = 1 - equity / self.peak if self.peak else 0.0
+        self.max_drawdown = max(self.max_drawdown, self.drawdown)
+        self.max_duration = max(self.max_duration, timestamp - self.peak_timestamp)
+
+    def result(self) -> dict:
+        duration = 0 if self.peak_timestamp is None else self.last_timestamp - self.peak_timestamp
+        return {'max_drawdown': self.max_drawdown, 'max_duration': self.max_duration, 'drawdown': self.drawdown,
+                'duration': duration}
+
+
+class TradeAnalyzer(AnalyzerBase):
+    name = 'trades'
+
+    def __init__(self):
+        """
+        Turnover and fees per asset, and win rate of closed sell orders. The profit of a sell order is computed against
+        the average cost of the position it sells, bought by earlier fills, and the order is counted as a win or a loss
+        once, when it is closed. Sells of a position that was deposited rather than bought have no cost and are not
+        counted as trades.
+        """
+        # {asset: traded value}, in base asset of each symbol
+        self.turnover = {}
+        # {asset: fee paid}
+        self.fees = {}
+        # {symbol: [amount held, cost in base asset]}
+        self._positions = {}
+        # {order id: realized profit} of orders not closed yet
+        self._profits = {}
+        self.wins = 0
+        self.losses = 0
+        self.fills = 0
+
+    def on_fill(self, timestamp: int, order_id, symbol: str, side: int, price: float, amount: float, fee: float):
+        quote_name, base_name = symbol.split('/')
+        self.fills += 1
+        self.turnover[base_name] = self.turnover.get(base_name, 0) + price * amount
+        position = self._positions.setdefault(symbol, [0.0, 0.0])
+
+        if side > 0:
+            self.fees[quote_name] = self.fees.get(quote_name, 0) + fee
+            position[0] += amount - fee
+            position[1] += price * amount
+            return
+
+        self.fees[base_name] = self.fees.get(base_name, 0) + fee
+        if position[0] <= 0:
+            return
+        sold = min(amount, position[0])
+        cost = position[1] * sold / position[0]
+        position[0] -= sold
+        position[1] -= cost
+        profit = (price * amount - fee) * sold / amount - cost
+        self._profits[order_id] = self._profits.get(order_id, 0.0) + profit
+
+    def on_close(self, timestamp: int, order_id, symbol: str, side: int):
+        profit = self._profits.pop(order_id, None)
+        if profit is None:
+            return
+        self.wins += profit > 0
+        self.losses += profit <= 0
+
+    def result(self) -> dict:
+        trades = self.wins + self.losses
+        return {'fills': self.fills, 'trades': trades, 'wins': self.wins,
+                'win_rate': self.wins / trades if trades else float('nan'),
+                'turnover': dict(self.turnover), 'fees': dict(self.fees)}
+
+
+def default_analyzers(periods_per_year: float=None, risk_free: float=0) -> list:
+    return [ReturnAnalyzer(periods_per_year, risk_free), DrawdownAnalyzer(), TradeAnalyzer()]
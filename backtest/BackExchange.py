@@ -4,21 +4,18 @@
 
 from backtest.Errors import NotSupported, InsufficientFunds, InvalidOrder, OrderNotFound, SlippageModelError
 
-from core.Ticker import Quotes, TickerFields
+from core.Ticker import Quotes, TickerFields, TickerPanel
 from core.Timer import Timer
-from backtest.Order import OrderSide, OrderType, OrderStatus, Order, OrderBook, OrderQueue
+from backtest.Order import OrderSide, OrderType, OrderStatus, Order, OrderBook, OrderQueue, to_units, from_units
 from backtest.Slippage import SlippageBase
 
 from enum import Enum
 from typing import Tuple
 from itertools import chain
+import copy
+import pickle
 
-from networkx.exception import NetworkXNoPath
-import networkx as nx
-import math
-
-_PREC = 8
-_ABS_TOL = 1e-9
+import numpy as np
 
 
 class PriceType(Enum):
@@ -30,24 +27,45 @@ class PriceType(Enum):
 
 class BackExchange(object):
     def __init__(self, timer: Timer, quotes: Quotes, buy_price: str='open', sell_price: str='open',
-                 fee_rate: float=0.05, slippage_model: SlippageBase=SlippageBase()):
+                 fee_rate: float=0.05, slippage_model: SlippageBase=SlippageBase(), timeframe: int=0,
+                 verbose: bool=True):
+        """
+        If timeframe is given, the exchange runs on quotes resampled to bars of timeframe milliseconds, see
+        Quotes.resample. The timer should then step by timeframe from a timestamp aligned to it.
+
+        If verbose is False, nothing is printed, e.g. when driven by a BackTest runner.
+        """
         assert isinstance(quotes, Quotes), "quotes has to be Tickers class"
 
+        if timeframe:
+            quotes = quotes.resample(timeframe)
+        self._timeframe = timeframe
         self._quotes = quotes
         self._timer = timer
+        # all symbols aligned on one timestamp axis, so that a time bar of every symbol is a single row
+        self._panel = quotes.get_panel()
 
         self._symbols, self._assets = self.__current_supported()
-
-        self._total_balance = {}
-        self._available_balance = {}
-        for asset in self._assets:
-            self._total_balance[asset] = 0
-            self._available_balance[asset] = 0
+        # (panel, listed mask) of the last listing update, listing only changes where the mask changes
+        self._listed_mask = (self._panel, self._panel.get_listed(self.__time).copy())
+        # (number of deposits, number of closed orders) at the last consistency check
+        self._checked = (0, 0)
+
+        # balances in integer units, see Order.to_units, in arrays indexed by asset id. Every asset of quotes has an id,
+        # balances of assets not currently listed are 0
+        self._asset_names = sorted(quotes.get_assets())
+        self._asset_ids = {asset: i for i, asset in enumerate(self._asset_names)}
+        self._total_balance = np.zeros(len(self._asset_names), dtype=np.int64)
+        self._available_balance = np.zeros(len(self._asset_names), dtype=np.int64)
+        # {(time, target, fee, ...): conversion rates into target by asset id}, see fetch_balance_in
+        self._rates = {}
         self._deposit_history = []
 
         self._submitted_orders = OrderQueue()
         self._open_orders = OrderBook()
         self._closed_orders = OrderBook()
+        # closed orders never change, so forks share the closed order book until one of them closes an order
+        self._closed_shared = False
 
         self._fee_rate = 0
         self._buy_price = None
@@ -56,6 +74,12 @@ class BackExchange(object):
 
         self._last_processed_timestamp = -1
 
+        self.verbose = verbose
+        # function of form on_fill(order, price, amount, fee) called at every transaction, e.g. to record fills
+        self.on_fill = None
+        # function of form on_close(order) called when an order is closed, filled or cancelled
+        self.on_close = None
+
         self.buy_price = buy_price
         self.sell_price = sell_price
         self.fee_rate = fee_rate
@@ -65,26 +89,31 @@ class BackExchange(object):
     def __time(self):
         return self._timer.time
 
-    def __get_price(self, symbol: str, price_type: PriceType) -> float:
-        return self._quotes.get_ticker(symbol).get_value(self.__time, price_type.value)
+    def __log(self, message: str):
+        if self.verbose:
+            print(message)
 
-    def __get_volume(self, symbol: str) -> float:
-        return self._quotes.get_ticker(symbol).volume(self.__time)
+    def __get_price(self, symbol: str, price_type: PriceType) -> float:
+        return self._panel.get_value(self.__time, symbol, price_type.value)
 
     def __current_supported(self) -> Tuple[set, set]:
+        panel = self._panel
         supported_symbols, supported_assets = set(), set()
-        for symbol in self._quotes:
-            try:
-                self.__get_volume(symbol)
-                supported_symbols.add(symbol)
-                supported_assets |= \
-                    {self._quotes.get_ticker(symbol).quote_name, self._quotes.get_ticker(symbol).base_name}
-            except KeyError:
-                continue
+        for column in np.flatnonzero(panel.get_listed(self.__time)):
+            supported_symbols.add(panel.symbols[column])
+            supported_assets |= {panel.quote_names[column], panel.base_names[column]}
         return supported_symbols, supported_assets
 
-    def __frozen_balance(self, asset: str):
-        return self._total_balance[asset] - self._available_balance[asset]
+    def __frozen_balance(self, asset: str) -> int:
+        i = self._asset_ids[asset]
+        return int(self._total_balance[i] - self._available_balance[i])
+
+    @staticmethod
+    def __locked(order: Order) -> int:
+        # balance held by the remaining amount of an open order, in units
+        if order.side is OrderSide.Buy:
+            return to_units(order.remaining * order.price)
+        return order.remaining_units
 
     @property
     def fee_rate(self) -> float:
@@ -134,6 +163,86 @@ class BackExchange(object):
     def slippage_model(self, slippage_model: SlippageBase):
         self._slippage_model = slippage_model
 
+    @property
+    def timer(self) -> Timer:
+        return self._timer
+
+    def __getstate__(self):
+        # price data is not part of the state, it is attached again on restore
+        state = self.__dict__.copy()
+        state['_quotes'] = None
+        state['_panel'] = None
+        state['_listed_mask'] = (None, self._listed_mask[1])
+        state['_rates'] = {}
+        return state
+
+    def snapshot(self, *attached) -> bytes:
+        """
+        Binary snapshot of the state of the exchange, i.e. timer, balances, deposit history, order books and slippage
+        model, without price data. Objects attached to the exchange, e.g. an algorithm, its operators or a BackTest
+        runner, are saved along, and keep referring to the same exchange when restored.
+
+        Args:
+            attached: Objects to save with the exchange.
+
+        Returns:
+            Snapshot to be restored by BackExchange.restore, e.g. after a crash or many times to branch a run.
+        """
+        return pickle.dumps((self, attached), protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def restore(snapshot: bytes, quotes: Quotes) -> tuple:
+        """
+        Restore an exchange from a snapshot. Exchanges restored from the same quotes share their price data.
+
+        Args:
+            snapshot: Snapshot by BackExchange.snapshot.
+            quotes: Quotes the exchange was created with.
+
+        Returns:
+            (Restored exchange, tuple of restored attached objects).
+        """
+        exchange, attached = pickle.loads(snapshot)
+        if exchange._timeframe:
+            quotes = quotes.resample(exchange._timeframe)
+        exchange._quotes = quotes
+        exchange._panel = quotes.get_panel()
+        exchange._listed_mask = (exchange._panel, exchange._listed_mask[1])
+        exchange._closed_shared = False
+        return exchange, attached
+
+    def fork(self, *attached) -> tuple:
+        """
+        Branch the exchange in its current state, e.g. to explore what if another order was placed now. The branch
+        gets its own timer, balances and open orders, while price data, slippage model, deposits and closed orders are
+        shared with this exchange. The closed order book is only copied by the first of them to close an order.
+
+        Args:
+            attached: Objects to branch along, e.g. an algorithm or a BackTest runner, which refer to the branch.
+
+        Returns:
+            (Branched exchange, tuple of branched attached objects).
+        """
+        self._closed_shared = True
+        memo = {id(self._quotes): self._quotes, id(self._panel): self._panel,
+                id(self._slippage_model): self._slippage_model, id(self._closed_orders): self._closed_orders}
+        for deposit in self._deposit_history:
+            memo[id(deposit)] = deposit
+        exchange, attached = copy.deepcopy((self, attached), memo)
+        # price data is left out by __getstate__
+        exchange._quotes = self._quotes
+        exchange._panel = self._panel
+        exchange._listed_mask = (self._panel, exchange._listed_mask[1])
+        return exchange, attached
+
+    def __close_order(self, order: Order):
+        if self._closed_shared:
+            self._closed_orders = self._closed_orders.copy()
+            self._closed_shared = False
+        self._closed_orders.insert_order(order)
+        if self.on_close is not None:
+            self.on_close(order)
+
     def fetch_timestamp(self) -> int:
         """
         Returns:
@@ -153,13 +262,15 @@ class BackExchange(object):
         Returns:
             The amount of successfully deposited asset.
         """
-        if amount <= 0:
+        units = to_units(amount)
+        if units <= 0:
             return 0
         if asset in self._assets:
-            self._total_balance[asset] += amount
-            self._available_balance[asset] += amount
-            self._deposit_history.append({'timestamp': self.__time, 'asset': asset, 'amount': round(amount, _PREC)})
-            return amount
+            i = self._asset_ids[asset]
+            self._total_balance[i] += units
+            self._available_balance[i] += units
+            self._deposit_history.append({'timestamp': self.__time, 'asset': asset, 'amount': from_units(units)})
+            return from_units(units)
         else:
             raise NotSupported
 
@@ -168,15 +279,16 @@ class BackExchange(object):
         Returns:
             The amount of successfully withdrawn asset.
         """
-        if amount <= 0:
+        units = to_units(amount)
+        if units <= 0:
             return 0
         if asset in self._assets:
-            if self._available_balance[asset] < amount:
-                amount = self._available_balance[asset]
-            self._total_balance[asset] -= amount
-            self._available_balance[asset] -= amount
-            self._deposit_history.append({'timestamp': self.__time, 'asset': asset, 'amount': round(-amount, _PREC)})
-            return amount
+            i = self._asset_ids[asset]
+            units = min(units, int(self._available_balance[i]))
+            self._total_balance[i] -= units
+            self._available_balance[i] -= units
+            self._deposit_history.append({'timestamp': self.__time, 'asset': asset, 'amount': from_units(-units)})
+            return from_units(units)
         else:
             raise NotSupported
 
@@ -192,13 +304,31 @@ class BackExchange(object):
         Returns:
             Dictionary of form: {asset: {'total': xxx, 'free': xxx, 'used': xxx}, ...}
         """
+        total, free = self._total_balance.tolist(), self._available_balance.tolist()
         balance = {}
         for asset in self._assets:
-            balance[asset] = {'total': round(self._total_balance[asset], _PREC),
-                              'free': round(self._available_balance[asset], _PREC),
-                              'used': round(self.__frozen_balance(asset), _PREC)}
+            i = self._asset_ids[asset]
+            balance[asset] = {'total': from_units(total[i]), 'free': from_units(free[i]),
+                              'used': from_units(total[i] - free[i])}
         return balance
 
+    @property
+    def asset_names(self) -> list:
+        """
+        Assets ordered by id, the index of balance arrays, see fetch_balance_array.
+        """
+        return list(self._asset_names)
+
+    def fetch_balance_array(self, free: bool=False) -> np.ndarray:
+        """
+        Args:
+            free: Return free balance instead of total balance. Defaults to False.
+
+        Returns:
+            Array of balance of every asset, ordered as in asset_names, 0 for assets not currently listed.
+        """
+        return from_units(self._available_balance if free else self._total_balance)
+
     def fetch_balance_in(self, target: str, fee: bool=False) -> float:
         """
         Return the value of current portfolio all in target asset. The transfer rate is computed from the most
@@ -213,31 +343,60 @@ class BackExchange(object):
             Portfolio value
         """
 
-        di_graph = nx.DiGraph()
-        multiplier = 1.0 - self._fee_rate / 100.0 if fee else 1.0
+        if target not in self._asset_ids:
+            raise NotSupported("Not possible to convert all assets to the target asset. ")
+        rates = self.__conversion_rates(target, fee)
+        if (rates[self._total_balance != 0] == 0).any():
+            raise NotSupported("Not possible to convert all assets to the target asset. ")
+
+        # a value in target asset, in units as balances
+        return from_units(to_units(from_units(self._total_balance) @ rates))
 
-        for symbol in self._symbols:
-            quote_name = self._quotes.get_ticker(symbol).quote_name
-            base_name = self._quotes.get_ticker(symbol).base_name
-
-            di_graph.add_edge(quote_name, base_name,
-                              weight=-math.log(multiplier * self.__get_price(symbol, self._sell_price)))
-            di_graph.add_edge(base_name, quote_name,
-                              weight=math.log(self.__get_price(symbol, self._buy_price) / multiplier))
-
-        balance = 0
-        for asset in self._total_balance:
-            if self._total_balance[asset]:
-                if asset == target:
-                    balance += self._total_balance[asset]
-                    continue
-                try:
-                    weight = nx.shortest_path_length(di_graph, asset, target, "weight")
-                except NetworkXNoPath:
-                    raise NotSupported("Not possible to convert all assets to the target asset. ")
-                balance += math.exp(-weight) * self._total_balance[asset]
-
-        return round(balance, _PREC)
+    def __conversion_rates(self, target: str, fee: bool) -> np.ndarray:
+        """
+        Rates of the most profitable way to convert every asset into target at the current time bar, computed once per
+        time bar and target.
+
+        Rates are found as by Dijkstra's algorithm from target, with products of prices instead of sums of weights:
+        the asset with the best rate is settled one at a time, and the rates of its trading pairs are updated at once.
+        A settled asset is never updated again, so an arbitrage cycle can't make a rate grow without bound.
+
+        Returns:
+            Array of rates ordered as in asset_names, 0 where there is no way to convert.
+        """
+        multiplier = 1.0 - self._fee_rate / 100.0 if fee else 1.0
+        key = (self.__time, target, multiplier, self._buy_price, self._sell_price, frozenset(self._symbols))
+        rates = self._rates.get(key)
+        if rates is not None:
+            return rates
+
+        # prices of all symbols at the current time bar in one row slice each
+        panel = self._panel
+        columns = np.array([panel.symbol_index[symbol] for symbol in self._symbols], dtype=np.intp)
+        quotes = np.array([self._asset_ids[panel.quote_names[column]] for column in columns], dtype=np.intp)
+        bases = np.array([self._asset_ids[panel.base_names[column]] for column in columns], dtype=np.intp)
+        # amount of base asset got by selling one quote asset, and of quote asset got by buying with one base asset
+        sell_rates = multiplier * panel.get_values(self.__time, self._sell_price.value)[columns]
+        buy_rates = multiplier / panel.get_values(self.__time, self._buy_price.value)[columns]
+
+        rates = np.zeros(len(self._asset_names))
+        rates[self._asset_ids[target]] = 1.0
+        settled = np.zeros(len(self._asset_names), dtype=bool)
+        while True:
+            best = np.where(settled, 0.0, rates)
+            asset = int(np.argmax(best))
+            if best[asset] == 0:
+                break
+            settled[asset] = True
+            # sell quote assets of pairs with this base, buy base assets of pairs with this quote
+            sell = (bases == asset) & ~settled[quotes]
+            np.maximum.at(rates, quotes[sell], sell_rates[sell] * rates[asset])
+            buy = (quotes == asset) & ~settled[bases]
+            np.maximum.at(rates, bases[buy], buy_rates[buy] * rates[asset])
+        # rates of past time bars are never asked again
+        self._rates.clear()
+        self._rates[key] = rates
+        return rates
 
     def fetch_ticker(self, symbol: str='') -> dict:
         """
@@ -261,7 +420,10 @@ class BackExchange(object):
         elif symbol not in self._symbols:
             raise NotSupported
         else:
-            return self._quotes.get_ticker(symbol).ohlcv(self.__time)
+            panel = self._panel
+            row, column = panel.row(self.__time), panel.symbol_index[symbol]
+            return {field.value: panel.data[field.value][row, column] for field in
+                    (TickerFields.Open, TickerFields.High, TickerFields.Low, TickerFields.Close, TickerFields.Volume)}
 
     def __execute_buy(self, order: Order, price: float, amount: float) -> bool:
         """
@@ -272,21 +434,27 @@ class BackExchange(object):
              A bool indicates whether the order is filled or not.
         """
         assert order.side is OrderSide.Buy
-        is_filled = order.execute_transaction(
-            order.generate_transaction(amount=amount, price=price, timestamp=self.__time))
-
-        quote_name = order.quote_name
-        base_name = order.base_name
-        fee = self._fee_rate / 100.0 * amount
-
-        self._total_balance[quote_name] += amount - fee
-        self._available_balance[quote_name] += amount - fee
-        self._total_balance[base_name] -= price * amount
-        # self._available_balance[base_name] -= price * amount
-        # (Stop)Limit buy order may be filled with lower price, in which case the in order price needs to be compensated
+        transaction = order.generate_transaction(amount=amount, price=price, timestamp=self.__time)
+        amount = transaction.amount
+        locked = self.__locked(order)
+        is_filled = order.execute_transaction(transaction)
+
+        quote, base = self._asset_ids[order.quote_name], self._asset_ids[order.base_name]
+        units = transaction.amount_units
+        fee = to_units(self._fee_rate / 100.0 * amount)
+        cost = to_units(price * amount)
+
+        self._total_balance[quote] += units - fee
+        self._available_balance[quote] += units - fee
+        self._total_balance[base] -= cost
+        # self._available_balance[base] -= cost
+        # (Stop)Limit buy order may be filled with lower price, in which case the in order balance released by the
+        # transaction is more than its cost
         if order.type is not OrderType.Market:
-            self._available_balance[base_name] += (order.price - price) * amount
-        order.pay_fee(quote_name, fee)
+            self._available_balance[base] += locked - self.__locked(order) - cost
+        order.pay_fee(order.quote_name, fee)
+        if self.on_fill is not None:
+            self.on_fill(order, price, amount, from_units(fee))
 
         return is_filled
 
@@ -299,76 +467,112 @@ class BackExchange(object):
              A bool indicates whether the order is filled or not.
         """
         assert order.side is OrderSide.Sell
-        is_filled = order.execute_transaction(
-            order.generate_transaction(amount=amount, price=price, timestamp=self.__time))
+        transaction = order.generate_transaction(amount=amount, price=price, timestamp=self.__time)
+        amount = transaction.amount
+        is_filled = order.execute_transaction(transaction)
+
+        quote, base = self._asset_ids[order.quote_name], self._asset_ids[order.base_name]
+        fee = to_units(self._fee_rate / 100.0 * price * amount)
+        proceeds = to_units(price * amount)
+
+        self._total_balance[quote] -= transaction.amount_units
+        # self._available_balance[quote] -= transaction.amount_units
+        self._total_balance[base] += proceeds - fee
+        self._available_balance[base] += proceeds - fee
+        order.pay_fee(order.base_name, fee)
+        if self.on_fill is not None:
+            self.on_fill(order, price, amount, from_units(fee))
 
-        quote_name = order.quote_name
-        base_name = order.base_name
-        fee = self._fee_rate / 100.0 * price * amount
+        return is_filled
 
-        self._total_balance[quote_name] -= amount
-        # self._available_balance[quote_name] -= amount
-        self._total_balance[base_name] += price * amount - fee
-        self._available_balance[base_name] += price * amount - fee
-        order.pay_fee(base_name, fee)
+    def __generate_txs(self, orders: list) -> dict:
+        """
+        Generate tentative transactions of orders in one call of the slippage model. Ticker prices and OHLCV of all
+        orders are gathered from the current row of the panel at once, instead of a ticker dictionary per order.
 
-        return is_filled
+        Returns:
+            Dictionary of form {order id: (price, amount)}.
+        """
+        if not orders:
+            return {}
+        panel = self._panel
+        row = panel.row(self.__time)
+        columns = np.array([panel.symbol_index[order.symbol] for order in orders])
+        sides = np.array([order.side for order in orders], dtype=object)
+        is_buy = sides == OrderSide.Buy
+        prices = np.where(is_buy, panel.data[self._buy_price.value.value][row, columns],
+                          panel.data[self._sell_price.value.value][row, columns])
+        tickers = {field.value: panel.data[field.value][row, columns] for field in
+                   (TickerFields.Open, TickerFields.High, TickerFields.Low, TickerFields.Close, TickerFields.Volume)}
+
+        prices, amounts = self._slippage_model.generate_txs(
+            prices=prices,
+            amounts=np.array([order.remaining for order in orders], dtype=np.float64),
+            order_types=np.array([order.type for order in orders], dtype=object),
+            order_sides=sides,
+            symbols=np.array([order.symbol for order in orders], dtype=object),
+            tickers=tickers,
+            timestamp=self.__time)
+        return {order.id: (prices[i], amounts[i]) for i, order in enumerate(orders)}
 
-    def __execute_market_order(self, order: Order) -> bool:
+    def __execute_market_order(self, order: Order, tx: tuple) -> bool:
         """
         This function does not check if the order is invalid / does not raise InvalidOrder exceptions. It only checks
         the validity of the slippage model and if the balance is sufficient.
 
+        Args:
+            order: Market order to execute.
+            tx: Tentative transaction (price, amount) generated by the slippage model.
+
         Returns:
              A bool indicates whether the order is filled or not.
         """
         assert order.type is OrderType.Market and order.remaining == order.amount
         assert order.status is not OrderStatus.Cancelled
 
-        price, amount = self._slippage_model.generate_tx(
-            price=self.__get_price(order.symbol, self._buy_price if order.side is OrderSide.Buy else self._sell_price),
-            amount=order.remaining,
-            order_type=order.type,
-            order_side=order.side,
-            symbol=order.symbol,
-            ticker=self.fetch_ticker(order.symbol),
-            timestamp=self.__time)
+        price, amount = tx
 
-        if price < 0 or amount != order.remaining:
+        if price < 0 or to_units(amount) != order.remaining_units:
             raise SlippageModelError
+        amount = order.remaining
 
         if order.side is OrderSide.Buy:
-            base_name = order.base_name
-            if price * amount > self._available_balance[base_name]:
+            base = self._asset_ids[order.base_name]
+            cost = to_units(price * amount)
+            if cost > self._available_balance[base]:
                 raise InsufficientFunds
             # self.__execute_buy assumes in order balance has already been deducted
-            self._available_balance[base_name] -= amount * price
+            self._available_balance[base] -= cost
             return self.__execute_buy(order, price, amount)
         elif order.side is OrderSide.Sell:
-            quote_name = order.quote_name
-            if order.remaining > self._available_balance[quote_name]:
+            quote = self._asset_ids[order.quote_name]
+            if order.remaining_units > self._available_balance[quote]:
                 raise InsufficientFunds
             # self.__execute_sell assumes in order balance has already been deducted
-            self._available_balance[quote_name] -= amount
+            self._available_balance[quote] -= order.remaining_units
             return self.__execute_sell(order, price, amount)
 
-    def __accept_market_order(self, order: Order):
+    def __accept_market_order(self, order: Order, tx: tuple):
         assert order.type is OrderType.Market
         if order.symbol not in self._symbols:
             # still need this, as a symbol may be delisted at this timestamp
             raise InvalidOrder
         else:
             # market order is never "open". if accepted, it is executed immediately
-            self.__execute_market_order(order)
+            self.__execute_market_order(order, tx)
             assert order.status is OrderStatus.Filled
-            self._closed_orders.insert_order(order)
-            print('[BackExchange] Market order {:s} accepted and executed. '.format(str(order.id)))
+            self.__close_order(order)
+            self.__log('[BackExchange] Market order {:s} accepted and executed. '.format(str(order.id)))
 
-    def __execute_limit_order(self, order: Order):
+    def __execute_limit_order(self, order: Order, tx: tuple):
         """
         This function does not check if the order is invalid / does not raise InvalidOrder exceptions. It does not check
         if the balance is sufficient neither. It only checks the validity of the slippage.
 
+        Args:
+            order: Open limit or stop limit order to execute.
+            tx: Tentative transaction (price, amount) generated by the slippage model.
+
         Returns:
              A bool indicates whether the order is filled or not.
         """
@@ -377,36 +581,30 @@ class BackExchange(object):
         assert order.status is not OrderStatus.Cancelled
 
         is_filled = False
-        price, amount = self._slippage_model.generate_tx(
-            price=self.__get_price(order.symbol, self._buy_price if order.side is OrderSide.Buy else self._sell_price),
-            amount=order.remaining,
-            order_type=order.type,
-            order_side=order.side,
-            symbol=order.symbol,
-            ticker=self.fetch_ticker(order.symbol),
-            timestamp=self.__time)
+        price, amount = tx
 
-        if price < 0 or amount > order.remaining:
+        if price < 0 or to_units(amount) > order.remaining_units:
             raise SlippageModelError
 
-        if order.side is OrderSide.Buy and price <= order.price + _ABS_TOL:  # _ABS_TOL is for float precision issue
+        # prices are compared in units, as amounts
+        if order.side is OrderSide.Buy and to_units(price) <= to_units(order.price):
             is_filled = self.__execute_buy(order, price, amount)
 
             if order.status is OrderStatus.Filled:
-                print('[BackExchange] {:s}Limit buy order {:s} filled. '
+                self.__log('[BackExchange] {:s}Limit buy order {:s} filled. '
                       .format('' if order.type is OrderType.Limit else 'Stop ', str(order.id)))
             else:
-                print('[BackExchange] {:s}Limit buy order {:s} partially filled to {:2}%. '
+                self.__log('[BackExchange] {:s}Limit buy order {:s} partially filled to {:2}%. '
                       .format('' if order.type is OrderType.Limit else 'Stop ', str(order.id), order.filled_percentage))
-        elif order.side is OrderSide.Sell and _ABS_TOL + price >= order.price:
+        elif order.side is OrderSide.Sell and to_units(price) >= to_units(order.price):
             # Limit sell order never executes above the order price, even if there is a buy order with higher price
             is_filled = self.__execute_sell(order, order.price, amount)
 
             if order.status is OrderStatus.Filled:
-                print('[BackExchange] {:s}Limit sell order {:s} filled. '
+                self.__log('[BackExchange] {:s}Limit sell order {:s} filled. '
                       .format('' if order.type is OrderType.Limit else 'Stop ', str(order.id)))
             else:
-                print('[BackExchange] {:s}Limit sell order {:s} partially filled to {:2}%. '
+                self.__log('[BackExchange] {:s}Limit sell order {:s} partially filled to {:2}%. '
                       .format('' if order.type is OrderType.Limit else 'Stop ', str(order.id), order.filled_percentage))
 
         return is_filled
@@ -416,42 +614,37 @@ class BackExchange(object):
         if order.symbol not in self._symbols:
             raise InvalidOrder
         elif order.status is OrderStatus.Cancelled:
-            self._closed_orders.insert_order(order)
+            self.__close_order(order)
         else:
-            if order.side is OrderSide.Buy:
-                base_name = order.base_name
-                if order.amount * order.price > self._available_balance[base_name]:
-                    raise InsufficientFunds
-                self._available_balance[base_name] -= order.amount * order.price
-            if order.side is OrderSide.Sell:
-                quote_name = order.quote_name
-                if order.amount > self._available_balance[quote_name]:
-                    raise InsufficientFunds
-                self._available_balance[quote_name] -= order.amount
+            balance = self._asset_ids[order.base_name if order.side is OrderSide.Buy else order.quote_name]
+            locked = self.__locked(order)
+            if locked > self._available_balance[balance]:
+                raise InsufficientFunds
+            self._available_balance[balance] -= locked
 
             if order.type is OrderType.Limit:
                 order.open()
                 self._open_orders.insert_order(order)
-                print('[BackExchange] Limit order {:s} accepted. '.format(str(order.id)))
+                self.__log('[BackExchange] Limit order {:s} accepted. '.format(str(order.id)))
             elif order.type is OrderType.StopLimit:
                 order.accept()
                 self._open_orders.insert_order(order)
-                print('[BackExchange] Stop Limit order {:s} accepted. '.format(str(order.id)))
+                self.__log('[BackExchange] Stop Limit order {:s} accepted. '.format(str(order.id)))
 
     def __accept_stop_limit_order(self, order: Order):
         self.__accept_limit_order(order)
 
     def __open_stop_limit_order(self, order: Order) -> bool:
         assert order.type is OrderType.StopLimit
-        if order.side is OrderSide.Buy and (self.__get_price(order.symbol, self._buy_price) + _ABS_TOL >=
-                                            order.stop_price):
+        if order.side is OrderSide.Buy and (to_units(self.__get_price(order.symbol, self._buy_price)) >=
+                                            to_units(order.stop_price)):
             order.open()
-            print('[BackExchange] Stop Limit buy order {:s} opened. '.format(str(order.id)))
+            self.__log('[BackExchange] Stop Limit buy order {:s} opened. '.format(str(order.id)))
             return True
-        elif order.side is OrderSide.Sell and self.__get_price(order.symbol, self._sell_price) <= (order.stop_price
-                                                                                                   + _ABS_TOL):
+        elif order.side is OrderSide.Sell and (to_units(self.__get_price(order.symbol, self._sell_price)) <=
+                                               to_units(order.stop_price)):
             order.open()
-            print('[BackExchange] Stop Limit sell order {:s} opened. '.format(str(order.id)))
+            self.__log('[BackExchange] Stop Limit sell order {:s} opened. '.format(str(order.id)))
             return True
         return False
 
@@ -481,11 +674,12 @@ class BackExchange(object):
         Returns:
             A dictionary contains the created order info.
         """
-        if symbol not in self._symbols or amount <= 0:
+        if symbol not in self._symbols or to_units(amount) <= 0:
             # even if the symbol is supported in the next timestamp, in principle you shouldn't be able to know it
             # at the current timestamp
             raise InvalidOrder
 
+        self.__add_order_event(symbol)
         order_id = self._submitted_orders.add_new_order(timestamp=self.__time,
                                                         order_type=order_type,
                                                         side=side,
@@ -496,6 +690,16 @@ class BackExchange(object):
                                                         stop_price=stop_price)
         return self.fetch_submitted_order(order_id)
 
+    def __add_order_event(self, symbol: str):
+        # with an event driven timer, make sure it stops where the order can be resolved
+        if not hasattr(self._timer, 'add_event'):
+            return
+        panel = self._panel
+        start = np.searchsorted(panel.timestamps, self.__time, side='right')
+        listed = np.flatnonzero(panel.listed[start:, panel.symbol_index[symbol]])
+        if len(listed):
+            self._timer.add_event(int(panel.timestamps[start + listed[0]]))
+
     def create_market_buy_order(self, symbol: str, amount: float):
         return self.__create_order(symbol=symbol, side=OrderSide.Buy, order_type=OrderType.Market, amount=amount)
 
@@ -568,13 +772,13 @@ class BackExchange(object):
         order.cancel()
         # order book management
         self._open_orders.remove_order(order)
-        self._closed_orders.insert_order(order)
+        self.__close_order(order)
         # in order balance refund
         if order.side is OrderSide.Buy:
-            self._available_balance[order.base_name] += order.remaining * order.price
+            self._available_balance[self._asset_ids[order.base_name]] += self.__locked(order)
         elif order.side is OrderSide.Sell:
-            self._available_balance[order.quote_name] += order.remaining
-        print("[BackExchange] Open order {:s} cancelled. ".format(str(order_id)))
+            self._available_balance[self._asset_ids[order.quote_name]] += self.__locked(order)
+        self.__log("[BackExchange] Open order {:s} cancelled. ".format(str(order_id)))
 
     def fetch_submitted_order(self, order_id: str) -> dict:
         return self._submitted_orders[order_id].info
@@ -600,27 +804,29 @@ class BackExchange(object):
 
     def __balance_consistency_check(self):
         # check asset list
-        assert self._assets == set(self._total_balance.keys()) == set(self._available_balance.keys())
+        for asset in set(self._asset_names) - self._assets:
+            i = self._asset_ids[asset]
+            assert self._total_balance[i] == self._available_balance[i] == 0
 
         in_order_balance, total_balance = {}, {}
         for asset in self._assets:
             in_order_balance[asset] = 0
 
-        # check in order balance
+        # check in order balance, balances are integers and have to match exactly
         for order in self._open_orders:
             if order.side is OrderSide.Buy:
-                in_order_balance[order.base_name] += order.remaining * order.price
+                in_order_balance[order.base_name] += self.__locked(order)
             elif order.side is OrderSide.Sell:
-                in_order_balance[order.quote_name] += order.remaining
+                in_order_balance[order.quote_name] += self.__locked(order)
         for asset in in_order_balance:
-            assert abs(self.__frozen_balance(asset) - in_order_balance[asset]) < _ABS_TOL
+            assert self.__frozen_balance(asset) == in_order_balance[asset]
 
         # check total balance
         # note that history transactions may include already delisted assets
         for deposit in self._deposit_history:
             if deposit['asset'] not in total_balance:
                 total_balance[deposit['asset']] = 0
-            total_balance[deposit['asset']] += deposit['amount']
+            total_balance[deposit['asset']] += to_units(deposit['amount'])
         for order in chain(self._closed_orders, self._open_orders):
             base_name = order.base_name
             quote_name = order.quote_name
@@ -631,33 +837,33 @@ class BackExchange(object):
 
             if order.side is OrderSide.Buy:
                 for tx in order.transactions:
-                    total_balance[base_name] -= tx.amount * tx.price
-                    total_balance[quote_name] += tx.amount
+                    total_balance[base_name] -= to_units(tx.amount * tx.price)
+                    total_balance[quote_name] += tx.amount_units
             elif order.side is OrderSide.Sell:
                 for tx in order.transactions:
-                    total_balance[base_name] += tx.amount * tx.price
-                    total_balance[quote_name] -= tx.amount
-            fee = order.fee
+                    total_balance[base_name] += to_units(tx.amount * tx.price)
+                    total_balance[quote_name] -= tx.amount_units
+            fee = order.fee_units
             for asset in fee:
                 total_balance[asset] -= fee[asset]
 
         for asset in self._assets:
             if asset not in total_balance:
-                assert self._total_balance[asset] == 0
+                assert self._total_balance[self._asset_ids[asset]] == 0
             else:
-                assert abs(self._total_balance[asset] - total_balance[asset]) < _ABS_TOL
+                assert self._total_balance[self._asset_ids[asset]] == total_balance[asset]
 
     def __list_asset(self, asset: str):
-        print('[BackExchange] Newly list: {}'.format(asset))
+        self.__log('[BackExchange] Newly list: {}'.format(asset))
 
         self._assets.add(asset)
 
         # add balance support
-        self._total_balance[asset] = 0
-        self._available_balance[asset] = 0
+        self._total_balance[self._asset_ids[asset]] = 0
+        self._available_balance[self._asset_ids[asset]] = 0
 
     def __delist_asset(self, asset: str):
-        print('[BackExchange] Delist: {}'.format(asset))
+        self.__log('[BackExchange] Delist: {}'.format(asset))
 
         # cancel all open orders
         for order_id in self._open_orders.get_orders():
@@ -667,9 +873,7 @@ class BackExchange(object):
 
         # delete balance support
         assert self.__frozen_balance(asset) == 0
-        self.withdraw(asset, self._total_balance[asset])
-        del self._total_balance[asset]
-        del self._available_balance[asset]
+        self.withdraw(asset, from_units(int(self._total_balance[self._asset_ids[asset]])))
 
         # this must be the final step, otherwise cannot withdraw balance
         self._assets.remove(asset)
@@ -684,48 +888,73 @@ class BackExchange(object):
 
         self._symbols.remove(symbol)
 
-    def _process(self):
-        print('[BackExchange] Current timestamp: {}'.format(self.__time))
+    def _process(self, panel: TickerPanel=None, listed: np.ndarray=None):
+        """
+        Process the current time bar. panel and listed, the panel of quotes and its listed mask at the current time,
+        are given when they are computed once for many exchanges on the same quotes and timer, see Portfolio.
+        """
+        if self.verbose:
+            print('[BackExchange] Current timestamp: {}'.format(self.__time))
         if self.__time == self._last_processed_timestamp:
             raise Exception("Same timestamp shouldn't be processed more than once. ")
-
-        # list and delist assets
-        symbols, assets = self.__current_supported()
-        # list
-        for asset in assets - self._assets:
-            self.__list_asset(asset)
-        # delist
-        for asset in self._assets - assets:
-            self.__delist_asset(asset)
-        for symbol in symbols - self._symbols:
-            self.__add_symbol(symbol)
-        for symbol in self._symbols - symbols:
-            self.__remove_symbol(symbol)
+        self._panel = panel if panel is not None else self._quotes.get_panel()
+
+        # list and delist assets, only where listed symbols changed
+        if listed is None:
+            listed = self._panel.get_listed(self.__time)
+        changed = self._listed_mask[0] is not self._panel or not np.array_equal(listed, self._listed_mask[1])
+        if changed:
+            symbols, assets = self.__current_supported()
+            # list
+            for asset in assets - self._assets:
+                self.__list_asset(asset)
+            # delist
+            for asset in self._assets - assets:
+                self.__delist_asset(asset)
+            for symbol in symbols - self._symbols:
+                self.__add_symbol(symbol)
+            for symbol in self._symbols - symbols:
+                self.__remove_symbol(symbol)
+            self._listed_mask = (self._panel, listed.copy())
 
         # resolve orders
-        # submitted orders
+        if self._submitted_orders or self._open_orders:
+            changed = True
+            self.__resolve_orders()
+
+        self._last_processed_timestamp = self.__time
+
+        # balances only change by listing, orders, deposits and cancellations
+        checked = (len(self._deposit_history), len(self._closed_orders))
+        if __debug__ and (changed or checked != self._checked):
+            # check if balance is consistent with order books
+            self.__balance_consistency_check()
+            self._checked = checked
+
+    def __resolve_orders(self):
+        # submitted orders, slippage of all market orders to execute is generated at once
+        submitted = [self._submitted_orders[order_id] for order_id in self._submitted_orders.get_orders()]
+        txs = self.__generate_txs([order for order in submitted if order.type is OrderType.Market and
+                                   order.status is not OrderStatus.Cancelled and order.symbol in self._symbols])
         while self._submitted_orders:
             order = self._submitted_orders.pop_order()
             if order.status is OrderStatus.Cancelled:
                 continue
             if order.type is OrderType.Market:
-                self.__accept_market_order(order)
+                self.__accept_market_order(order, txs.get(order.id))
             elif order.type is OrderType.Limit:
                 self.__accept_limit_order(order)
             elif order.type is OrderType.StopLimit:
                 self.__accept_stop_limit_order(order)
 
-        # open orders
-        for order_id in self._open_orders.get_orders():
-            order = self._open_orders[order_id]
+        # open orders, slippage of all open orders is generated at once
+        orders = [self._open_orders[order_id] for order_id in self._open_orders.get_orders()]
+        for order in orders:
             if order.type is OrderType.StopLimit and order.status is OrderStatus.Accepted:
                 self.__open_stop_limit_order(order)
-            if order.status is OrderStatus.Open and self.__execute_limit_order(order):
+        orders = [order for order in orders if order.status is OrderStatus.Open]
+        txs = self.__generate_txs(orders)
+        for order in orders:
+            if self.__execute_limit_order(order, txs[order.id]):
                 self._open_orders.remove_order(order)
-                self._closed_orders.insert_order(order)
-
-        self._last_processed_timestamp = self.__time
-
-        if __debug__:
-            # check if balance is consistent with order books
-            self.__balance_consistency_check()
+                self.__close_order(order)
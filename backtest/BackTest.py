@@ -5,8 +5,232 @@ It saves necessary data to eventually plot graphs and calculate analyzed statist
 """
 
 from backtest.BackExchange import BackExchange
+from backtest.Errors import NotSupported
+from backtest.Order import OrderSide, from_units
+from core.Timer import Timer
 
+import time
+import numpy as np
 
-class BackTestBase(object):
-    def __init___(self, algorithm, exchange: BackExchange):
-        pass
+
+FILL_DTYPE = np.dtype([('timestamp', np.int64), ('order_id', object), ('symbol', np.int32), ('side', np.int8),
+                       ('price', np.float64), ('amount', np.float64), ('fee', np.float64)])
+
+
+class BackTest(object):
+    def __init__(self, algorithm, exchange: BackExchange, timer: Timer, currency: str=None, verbose: bool=False,
+                 analyzers: list=()):
+        """
+        Run algorithm against exchange until timer ends. At every tick, the exchange processes orders, then
+        algorithm.execute is called, then the tick is recorded.
+
+        Equity, positions and fills are recorded into preallocated arrays, sized from the number of ticks left in timer
+        and grown by doubling if needed:
+
+        * timestamps: Array of ticks.
+        * equity: Array of portfolio value in currency at each tick, NaN if it can't be converted or currency is None.
+        * positions: Array of shape (tick, asset) of total balance, assets are ordered as in assets.
+        * fills: Structured array of every transaction, see FILL_DTYPE. symbol indexes symbols, side is 1 for buy and
+          -1 for sell. Fee is in quote asset for buys and in base asset for sells.
+
+        Args:
+            algorithm: Trading algorithm with initialize and execute methods. Optional methods on_start, on_pause and
+                       on_stop are added as hooks.
+            exchange: BackExchange driven by timer.
+            timer: Timer of exchange.
+            currency: Asset to value equity in, see BackExchange.fetch_balance_in. Defaults to None, i.e. no equity.
+            verbose: Print exchange logs. Defaults to False.
+            analyzers: List of AnalyzerBase updated at every tick and fill, see analysis. Equity based analyzers need
+                       currency. Defaults to ().
+        """
+        self.algorithm = algorithm
+        self.exchange = exchange
+        self.timer = timer
+        self.currency = currency
+        exchange.verbose = verbose
+
+        self.symbols = sorted(exchange._quotes.get_symbols())
+        self.assets = sorted(exchange._quotes.get_assets())
+        self._symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        # ids of assets in the balance arrays of exchange
+        self._asset_ids = np.array([exchange._asset_ids[asset] for asset in self.assets], dtype=np.intp)
+
+        capacity = timer.remaining() + 1
+        self._timestamps = np.zeros(capacity, dtype=np.int64)
+        self._equity = np.full(capacity, np.nan)
+        self._positions = np.zeros((capacity, len(self.assets)))
+        self._fills = np.zeros(max(capacity, 16), dtype=FILL_DTYPE)
+        self.ticks = 0
+        self.n_fills = 0
+        exchange.on_fill = self._record_fill
+        exchange.on_close = self._record_close
+
+        self.analyzers = list(analyzers)
+        # bound methods called at every tick, fill and closed order
+        self._on_tick = [analyzer.on_tick for analyzer in self.analyzers]
+        self._on_fill = [analyzer.on_fill for analyzer in self.analyzers]
+        self._on_close = [analyzer.on_close for analyzer in self.analyzers]
+
+        self.hooks = {'start': [], 'pause': [], 'stop': []}
+        for event in self.hooks:
+            hook = getattr(algorithm, 'on_' + event, None)
+            if hook is not None:
+                self.add_hook(event, hook)
+        # 'ready', 'running', 'paused' or 'stopped'
+        self.state = 'ready'
+
+        # wall time of the loop, and of the algorithm only
+        self.elapsed = 0.0
+        self.algorithm_time = 0.0
+
+    def add_hook(self, event: str, hook):
+        """
+        Call hook(backtest) on event, 'start', 'pause' or 'stop'.
+        """
+        self.hooks[event].append(hook)
+
+    def __fire(self, event: str):
+        for hook in self.hooks[event]:
+            hook(self)
+
+    def __grow(self):
+        capacity = 2 * len(self._timestamps)
+        self._timestamps = np.resize(self._timestamps, capacity)
+        self._equity = np.resize(self._equity, capacity)
+        positions = np.zeros((capacity, len(self.assets)))
+        positions[:self.ticks] = self._positions[:self.ticks]
+        self._positions = positions
+
+    def _record_fill(self, order, price: float, amount: float, fee: float):
+        if self.n_fills == len(self._fills):
+            self._fills = np.resize(self._fills, 2 * len(self._fills))
+        side = 1 if order.side is OrderSide.Buy else -1
+        self._fills[self.n_fills] = (self.timer.time, order.id, self._symbol_index[order.symbol], side, price, amount,
+                                     fee)
+        self.n_fills += 1
+        for on_fill in self._on_fill:
+            on_fill(self.timer.time, order.id, order.symbol, side, price, amount, fee)
+
+    def _record_close(self, order):
+        side = 1 if order.side is OrderSide.Buy else -1
+        for on_close in self._on_close:
+            on_close(self.timer.time, order.id, order.symbol, side)
+
+    def _record(self):
+        i = self.ticks
+        if i == len(self._timestamps):
+            self.__grow()
+        timestamp = self._timestamps[i] = self.timer.time
+        self._positions[i] = from_units(self.exchange._total_balance[self._asset_ids])
+        if self.currency is not None:
+            try:
+                self._equity[i] = self.exchange.fetch_balance_in(self.currency)
+            except NotSupported:
+                pass
+        self.ticks = i + 1
+        if self._on_tick:
+            equity = float(self._equity[i])
+            for on_tick in self._on_tick:
+                on_tick(timestamp, equity)
+
+    def _start(self):
+        if self.state == 'ready':
+            self.algorithm.initialize()
+            self.__fire('start')
+        self.state = 'running'
+
+    def run(self, max_ticks: int=None) -> bool:
+        """
+        Run the loop until timer ends, pause or stop is called, or max_ticks ticks are run. A paused backtest resumes
+        where it stopped when run is called again.
+
+        Returns:
+            bool: True if the backtest is finished, i.e. timer ended or stop was called.
+        """
+        if self.state == 'stopped':
+            return True
+        self._start()
+
+        # everything called at each tick is looked up once
+        process = self.exchange._process
+        execute = self.algorithm.execute
+        record = self._record
+        next_tick = self.timer.next
+        clock = time.perf_counter
+        limit = -1 if max_ticks is None else max_ticks
+
+        ticks, algorithm_time, finished = 0, 0.0, False
+        begin = clock()
+        while ticks != limit and self.state == 'running':
+            process()
+            start = clock()
+            execute()
+            algorithm_time += clock() - start
+            record()
+            ticks += 1
+            if next_tick():
+                finished = True
+                break
+        self.elapsed += clock() - begin
+        self.algorithm_time += algorithm_time
+
+        if finished:
+            self.stop()
+        else:
+            self.pause()
+        return self.state == 'stopped'
+
+    def pause(self):
+        """
+        Pause after the current tick, e.g. from algorithm.execute.
+        """
+        if self.state == 'running':
+            self.state = 'paused'
+            self.__fire('pause')
+
+    def stop(self):
+        """
+        Stop after the current tick. A stopped backtest can't be run again.
+        """
+        if self.state != 'stopped':
+            self.state = 'stopped'
+            self.exchange.on_fill = None
+            self.exchange.on_close = None
+            self.__fire('stop')
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[:self.ticks]
+
+    @property
+    def equity(self) -> np.ndarray:
+        return self._equity[:self.ticks]
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self._positions[:self.ticks]
+
+    @property
+    def fills(self) -> np.ndarray:
+        return self._fills[:self.n_fills]
+
+    def analysis(self) -> dict:
+        """
+        Returns:
+            Dictionary of form {analyzer name: result}, up to the last tick run.
+        """
+        return {analyzer.name: analyzer.result() for analyzer in self.analyzers}
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dictionary of ticks run, wall time, and wall time per tick of the whole loop, of the algorithm, and of
+            the framework, i.e. exchange and recording. Run a no-op algorithm to measure the framework overhead.
+        """
+        ticks = max(self.ticks, 1)
+        return {'ticks': self.ticks, 'elapsed': self.elapsed, 'time_per_tick': self.elapsed / ticks,
+                'algorithm_time_per_tick': self.algorithm_time / ticks,
+                'overhead_per_tick': (self.elapsed - self.algorithm_time) / ticks}
+
+
+BackTestBase = BackTest
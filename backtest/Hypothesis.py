@@ -0,0 +1,294 @@
+"""
+Hypothesis testing of trading strategies by resampling. Resamples of returns, signals or price paths are generated as
+NumPy batches of shape (sample, time), and strategies given as vectorized functions are evaluated on a whole batch at
+once. Path dependent strategies, which only run in a BackExchange, are backtested on resampled quotes in parallel
+processes instead.
+
+All tests are one-sided with the alternative that the strategy is better than the null, and p-values are computed as
+(1 + number of null statistics >= observed) / (1 + number of samples).
+"""
+
+from backtest.BackExchange import BackExchange
+from backtest.BackTest import BackTest
+from backtest.Analyzer import default_analyzers
+from backtest.Validation import fork_map
+from core.Ticker import Quotes, Quote
+from core.Timer import Timer
+
+import os
+import random
+import numpy as np
+import pandas as pd
+
+
+def mean_return(returns: np.ndarray, axis: int=-1):
+    return np.mean(returns, axis=axis)
+
+
+def sharpe_ratio(returns: np.ndarray, axis: int=-1):
+    """
+    Sharpe ratio per period, not annualized. 0 where returns are constant.
+    """
+    std = np.std(returns, axis=axis, ddof=1)
+    mean = np.mean(returns, axis=axis)
+    return np.divide(mean, std, out=np.zeros_like(mean, dtype=np.float64), where=std > 0)
+
+
+def block_bootstrap_indices(n: int, n_samples: int, block_size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Indices of circular block bootstrap, blocks of block_size consecutive indices starting at random.
+
+    Returns:
+        Array of shape (n_samples, n).
+    """
+    n_blocks = -(-n // block_size)
+    starts = rng.integers(0, n, size=(n_samples, n_blocks))
+    indices = (starts[:, :, None] + np.arange(block_size)) % n
+    return indices.reshape(n_samples, -1)[:, :n]
+
+
+def block_bootstrap(x: np.ndarray, n_samples: int, block_size: int, seed=None) -> np.ndarray:
+    """
+    Returns:
+        Array of shape (n_samples, len(x)) of circular block bootstrap resamples of x.
+    """
+    x = np.asarray(x)
+    return x[block_bootstrap_indices(len(x), n_samples, block_size, np.random.default_rng(seed))]
+
+
+def permutations(x: np.ndarray, n_samples: int, seed=None) -> np.ndarray:
+    """
+    Returns:
+        Array of shape (n_samples, len(x)) of random permutations of x.
+    """
+    return np.random.default_rng(seed).permuted(np.tile(np.asarray(x), (n_samples, 1)), axis=1)
+
+
+def strategy_returns(positions: np.ndarray, returns: np.ndarray, fee: float=0) -> np.ndarray:
+    """
+    Returns of holding positions, decided at each time and held over the next period.
+
+    Args:
+        positions: Array of shape (..., time) of exposure, e.g. 1 long, 0 flat, -1 short.
+        returns: Array of shape (..., time) of asset returns, returns[t] from time t - 1 to t.
+        fee: Fee rate per unit of turnover. Defaults to 0.
+
+    Returns:
+        Array of shape (..., time - 1).
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    turnover = np.abs(np.diff(positions, axis=-1, prepend=0))
+    return positions[..., :-1] * returns[..., 1:] - fee * turnover[..., :-1]
+
+
+def _price_returns(prices: np.ndarray) -> np.ndarray:
+    returns = np.zeros_like(prices, dtype=np.float64)
+    returns[..., 1:] = prices[..., 1:] / prices[..., :-1] - 1
+    return returns
+
+
+def _p_value(observed: float, null: np.ndarray) -> float:
+    return (1 + np.count_nonzero(null >= observed)) / (1 + len(null))
+
+
+def _batches(n_samples: int, batch_size: int):
+    for start in range(0, n_samples, batch_size):
+        yield min(batch_size, n_samples - start)
+
+
+def bootstrap_test(returns: np.ndarray, statistic=sharpe_ratio, n_samples: int=10000, block_size: int=20,
+                   seed=None, batch_size: int=1000) -> dict:
+    """
+    Test if the mean of strategy returns is positive. Returns are centered to mean 0 and block bootstrapped, which
+    keeps their autocorrelation up to block_size.
+
+    Args:
+        returns: Array of strategy returns per period.
+        statistic: Vectorized function of form statistic(returns, axis=-1). Defaults to sharpe_ratio.
+        n_samples: Number of resamples. Defaults to 10000.
+        block_size: Number of consecutive periods per block. Defaults to 20.
+        seed: Seed of the resamples. Defaults to None.
+        batch_size: Number of resamples generated at once. Defaults to 1000.
+
+    Returns:
+        Dictionary of form {'statistic': observed, 'p_value': p, 'null': array of null statistics}.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    observed = float(statistic(returns))
+    centered = returns - returns.mean()
+    rng = np.random.default_rng(seed)
+    null = np.concatenate([statistic(centered[block_bootstrap_indices(len(centered), size, block_size, rng)], axis=-1)
+                           for size in _batches(n_samples, batch_size)])
+    return {'statistic': observed, 'p_value': _p_value(observed, null), 'null': null}
+
+
+def permutation_test(positions: np.ndarray, returns: np.ndarray, statistic=mean_return, n_samples: int=10000,
+                     fee: float=0, seed=None, batch_size: int=1000) -> dict:
+    """
+    Test if a signal predicts returns, against the same signal shuffled in time.
+
+    Args:
+        positions: Array of positions of the strategy at each time.
+        returns: Array of asset returns, see strategy_returns.
+        statistic: Vectorized function of form statistic(returns, axis=-1). Defaults to mean_return.
+        n_samples: Number of permutations. Defaults to 10000.
+        fee: Fee rate per unit of turnover. Defaults to 0.
+        seed: Seed of the permutations. Defaults to None.
+        batch_size: Number of permutations generated at once. Defaults to 1000.
+
+    Returns:
+        Dictionary of form {'statistic': observed, 'p_value': p, 'null': array of null statistics}.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    returns = np.asarray(returns, dtype=np.float64)
+    observed = float(statistic(strategy_returns(positions, returns, fee)))
+    rng = np.random.default_rng(seed)
+    null = np.concatenate([statistic(strategy_returns(rng.permuted(np.tile(positions, (size, 1)), axis=1), returns,
+                                                      fee), axis=-1)
+                           for size in _batches(n_samples, batch_size)])
+    return {'statistic': observed, 'p_value': _p_value(observed, null), 'null': null}
+
+
+def price_path_test(make_positions, prices: np.ndarray, statistic=mean_return, n_samples: int=10000,
+                    block_size: int=20, fee: float=0, detrend: bool=True, seed=None, batch_size: int=1000) -> dict:
+    """
+    Test a strategy against resampled price paths, built from block bootstrapped log returns of prices.
+
+    Args:
+        make_positions: Vectorized strategy of form make_positions(prices) -> positions, both of shape
+                        (sample, time), where positions at time t only depend on prices up to t.
+        prices: Array of prices.
+        statistic: Vectorized function of form statistic(returns, axis=-1). Defaults to mean_return.
+        n_samples: Number of resampled paths. Defaults to 10000.
+        block_size: Number of consecutive periods per block. Defaults to 20.
+        fee: Fee rate per unit of turnover. Defaults to 0.
+        detrend: Remove the drift of prices from paths, so that the null has no trend to follow. Defaults to True.
+        seed: Seed of the resamples. Defaults to None.
+        batch_size: Number of paths generated at once. Defaults to 1000.
+
+    Returns:
+        Dictionary of form {'statistic': observed, 'p_value': p, 'null': array of null statistics}.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    observed = float(statistic(strategy_returns(make_positions(prices[None])[0], _price_returns(prices), fee)))
+
+    log_returns = np.diff(np.log(prices))
+    if detrend:
+        log_returns = log_returns - log_returns.mean()
+    rng = np.random.default_rng(seed)
+    null = []
+    for size in _batches(n_samples, batch_size):
+        indices = block_bootstrap_indices(len(log_returns), size, block_size, rng)
+        paths = prices[0] * np.exp(np.concatenate([np.zeros((size, 1)), np.cumsum(log_returns[indices], axis=1)],
+                                                  axis=1))
+        null.append(statistic(strategy_returns(make_positions(paths), _price_returns(paths), fee), axis=-1))
+    null = np.concatenate(null)
+    return {'statistic': observed, 'p_value': _p_value(observed, null), 'null': null}
+
+
+def resample_quotes(quotes: Quotes, symbols: list, start: int, end: int, rows: np.ndarray=None,
+                    detrend: bool=True) -> Quotes:
+    """
+    Quotes of symbols between start and end, with bars reordered by rows. Each bar is rescaled relative to the close of
+    the bar before it, so that the prices of resampled bars form a continuous path. All symbols take the same rows, to
+    keep their correlation.
+
+    Args:
+        quotes: Original quotes.
+        symbols: Symbols to resample, which have to have a bar at every timestamp between start and end.
+        start: First timestamp.
+        end: Last timestamp, inclusive.
+        rows: Array of bar indices of the resampled quotes. Defaults to None, i.e. original bars.
+        detrend: Remove the drift of each symbol from the resampled path. Ignored if rows is None. Defaults to True.
+    """
+    panel = quotes.get_panel()
+    first, last = np.searchsorted(panel.timestamps, [start, end], side='left')
+    last = last + 1 if last < len(panel.timestamps) and panel.timestamps[last] == end else last
+    timestamps = panel.timestamps[first:last]
+
+    resampled = Quotes()
+    for symbol in symbols:
+        column = panel.symbol_index[symbol]
+        bars = {field: panel.data[field][first:last, column] for field in ('open', 'high', 'low', 'close', 'volume')}
+        assert not np.isnan(bars['close']).any(), "Symbol {:s} has missing bars. ".format(symbol)
+        if rows is not None:
+            previous = np.concatenate(([bars['open'][0]], bars['close'][:-1]))
+            relative = {field: bars[field] / previous for field in ('open', 'high', 'low', 'close')}
+            drift = np.exp(np.mean(np.log(relative['close']))) if detrend else 1.0
+            relative = {field: relative[field][rows] / drift for field in relative}
+            closes = bars['open'][0] * np.cumprod(relative['close'])
+            previous = np.concatenate(([bars['open'][0]], closes[:-1]))
+            bars = {'open': previous * relative['open'], 'high': previous * relative['high'],
+                    'low': previous * relative['low'], 'close': closes, 'volume': bars['volume'][rows]}
+
+        quote = Quote(panel.quote_names[column], panel.base_names[column])
+        quote.read_from_pandas(pd.DataFrame(dict(timestamp=timestamps, **bars)))
+        resampled._tickers[symbol] = quote
+    return resampled
+
+
+def _run_sample(job, i: int) -> float:
+    if i == 0:
+        # the observed run
+        quotes = resample_quotes(job['quotes'], job['symbols'], job['start'], job['end'])
+    else:
+        rng = np.random.default_rng(job['seeds'][i])
+        rows = block_bootstrap_indices(job['n_rows'], 1, job['block_size'], rng)[0]
+        quotes = resample_quotes(job['quotes'], job['symbols'], job['start'], job['end'], rows, job['detrend'])
+    random.seed(job['seeds'][i])
+    np.random.seed(job['seeds'][i])
+
+    timer = Timer(job['start'], job['end'], job['step'])
+    exchange = BackExchange(timer=timer, quotes=quotes, verbose=False, **job['exchange_kwargs'])
+    for asset, amount in job['deposit'].items():
+        exchange.deposit(asset, amount)
+    backtest = BackTest(job['make_algorithm'](exchange), exchange, timer, currency=job['currency'],
+                        analyzers=job['make_analyzers']())
+    backtest.run()
+    return float(job['statistic'](backtest.analysis()))
+
+
+def backtest_test(quotes: Quotes, make_algorithm, symbols: list, start: int, end: int, step: int, deposit: dict,
+                  currency: str, statistic=lambda analysis: analysis['returns']['total_return'],
+                  n_samples: int=1000, block_size: int=20, detrend: bool=True, seed: int=0, processes: int=None,
+                  make_analyzers=default_analyzers, **exchange_kwargs) -> dict:
+    """
+    Test a path dependent strategy by backtesting it in BackExchange on quotes resampled by blocks of bars, see
+    resample_quotes. Backtests run in parallel processes forked from this one, see Validation.fork_map.
+
+    Args:
+        quotes: Original quotes.
+        make_algorithm: Function of form make_algorithm(exchange) -> algorithm.
+        symbols: Symbols to trade, with a bar at every timestamp between start and end.
+        start: First timestamp.
+        end: Last timestamp, inclusive.
+        step: Ticker size of the timer.
+        deposit: Dictionary of form {asset: amount} deposited at the beginning of every run.
+        currency: Asset to value equity in.
+        statistic: Function of form statistic(analysis) -> float, of the result of BackTest.analysis. Defaults to
+                   total return.
+        n_samples: Number of resampled runs. Defaults to 1000.
+        block_size: Number of consecutive bars per block. Defaults to 20.
+        detrend: Remove the drift of each symbol from resampled paths. Defaults to True.
+        seed: Seed of the resamples, random and numpy.random are seeded in every run. Defaults to 0.
+        processes: Number of worker processes. Defaults to None, i.e. number of CPUs.
+        make_analyzers: Function returning new analyzers of a run. Defaults to default_analyzers.
+        exchange_kwargs: Other arguments of BackExchange, e.g. fee_rate or slippage_model.
+
+    Returns:
+        Dictionary of form {'statistic': observed, 'p_value': p, 'null': array of null statistics}.
+    """
+    panel = quotes.get_panel()
+    n_rows = int(np.count_nonzero((panel.timestamps >= start) & (panel.timestamps <= end)))
+    seeds = [int(sequence.generate_state(1)[0]) for sequence in np.random.SeedSequence(seed).spawn(n_samples + 1)]
+    job = {'quotes': quotes, 'make_algorithm': make_algorithm, 'symbols': symbols, 'start': start, 'end': end,
+           'step': step, 'deposit': deposit, 'currency': currency, 'statistic': statistic, 'block_size': block_size,
+           'detrend': detrend, 'seeds': seeds, 'n_rows': n_rows, 'make_analyzers': make_analyzers,
+           'exchange_kwargs': exchange_kwargs}
+
+    processes = processes if processes is not None else os.cpu_count() or 1
+    print('[Hypothesis] Running {:d} backtests in up to {:d} processes'.format(n_samples + 1, processes))
+    results = fork_map(_run_sample, job, n_samples + 1, processes,
+                       chunksize=max(1, (n_samples + 1) // (4 * max(processes, 1))))
+    null = np.array(results[1:])
+    return {'statistic': results[0], 'p_value': _p_value(results[0], null), 'null': null}
@@ -8,6 +8,19 @@ import time
 
 _PREC = 8
 _PPREC = 2
+# amounts and balances are kept in integer units of 10 ** -_PREC, e.g. satoshis, so that sums of them are exact
+_SCALE = 10 ** _PREC
+
+
+def to_units(value: float) -> int:
+    """
+    Convert a value to the nearest number of integer units.
+    """
+    return int(round(value * _SCALE))
+
+
+def from_units(units: int) -> float:
+    return units / _SCALE
 
 
 class OrderSide(Enum):
@@ -38,7 +51,7 @@ class Transaction(object):
         self._quote_name = quote_name
         self._base_name = base_name
         self._symbol = quote_name + "/" + base_name
-        self._amount = amount
+        self._amount = to_units(amount)
         self._price = price
         self._id = self._generate_unique_id()
 
@@ -72,6 +85,10 @@ class Transaction(object):
 
     @property
     def amount(self) -> float:
+        return from_units(self._amount)
+
+    @property
+    def amount_units(self) -> int:
         return self._amount
 
     @property
@@ -85,13 +102,13 @@ class Transaction(object):
     @property
     def info(self) -> dict:
         return {'datetime': str(self.datetime), 'timestamp': self.timestamp, 'price': round(self.price, _PREC),
-                'amount': round(self.amount, _PREC)}
+                'amount': self.amount}
 
 
 class Order(Transaction):
     def __init__(self, timestamp: int, order_type: OrderType, side: OrderSide, quote_name: str, base_name: str,
                  amount: float, price: float, stop_price: float):
-        assert amount > 0
+        assert to_units(amount) > 0
         # follow the convention of ccxt
         if order_type is OrderType.Market:
             price = 0
@@ -118,7 +135,7 @@ class Order(Transaction):
 
     @property
     def filled(self) -> float:
-        return self._filled
+        return from_units(self._filled)
 
     @property
     def filled_percentage(self) -> float:
@@ -130,7 +147,11 @@ class Order(Transaction):
 
     @property
     def remaining(self) -> float:
-        return self.amount - self.filled
+        return from_units(self._amount - self._filled)
+
+    @property
+    def remaining_units(self) -> int:
+        return self._amount - self._filled
 
     @property
     def transactions(self) -> list:
@@ -138,6 +159,10 @@ class Order(Transaction):
 
     @property
     def fee(self) -> dict:
+        return {asset: from_units(units) for asset, units in self._fee.items()}
+
+    @property
+    def fee_units(self) -> dict:
         return self._fee
 
     @property
@@ -145,9 +170,8 @@ class Order(Transaction):
         return {'id': self.id, 'datetime': str(self.datetime), 'timestamp': self.timestamp, 'status': self.status.value,
                 'symbol': self.symbol, 'type': self.type.value, 'side': self.side.value,
                 'price': round(self.price, _PREC), 'stop_price': round(self.stop_price, _PREC),
-                'amount': round(self.amount, _PREC), 'filled': round(self.filled, _PREC),
-                'remaining': round(self.remaining, _PREC), 'transaction': [tx.info for tx in self._transactions],
-                'fee': {a: round(self.fee[a], _PREC) for a in self.fee}}
+                'amount': self.amount, 'filled': self.filled, 'remaining': self.remaining,
+                'transaction': [tx.info for tx in self._transactions], 'fee': self.fee}
 
     def open(self):
         assert self.type is not OrderType.Market
@@ -175,28 +199,29 @@ class Order(Transaction):
         """
         assert isinstance(transaction, Transaction), "type must be transaction"
 
-        if transaction.side == OrderSide.Buy:
-            self._filled += transaction.amount
-            self.transactions.append(transaction)
-        else:
-            self._filled += transaction.amount
-            self.transactions.append(transaction)
+        self._filled += transaction.amount_units
+        self.transactions.append(transaction)
 
-        assert self.amount - self.filled >= 0
+        assert self._amount - self._filled >= 0
 
-        if self.amount - self.filled == 0:
+        if self._amount - self._filled == 0:
             self._status = OrderStatus.Filled
             return True
         else:
             return False
 
-    def pay_fee(self, asset: str, amount: float):
-        if amount == 0:
+    def pay_fee(self, asset: str, units: int):
+        """
+        Args:
+            asset: Asset the fee is paid in.
+            units: Fee in integer units, see to_units.
+        """
+        if units == 0:
             return
-        if asset not in self.fee:
-            self._fee[asset] = amount
+        if asset not in self._fee:
+            self._fee[asset] = units
         else:
-            self._fee[asset] += amount
+            self._fee[asset] += units
 
 
 class OrderBookBase(object):
@@ -262,6 +287,25 @@ class OrderBook(OrderBookBase):
         else:
             self.symbol_dict[symbol][order_id] = order
 
+    def __getstate__(self):
+        # sorted indices have key functions, which can't be pickled, so they are rebuilt from the orders
+        return {'orders': list(self.book.values())}
+
+    def __setstate__(self, state: dict):
+        self.__init__()
+        for order in state['orders']:
+            self.insert_order(order)
+
+    def copy(self):
+        """
+        Returns:
+            New order book of the same orders, which are not copied.
+        """
+        book = OrderBook()
+        for order in self.book.values():
+            book.insert_order(order)
+        return book
+
     def remove_order(self, order: Order):
         del self.time_dict[order.id]
         del self.symbol_dict[order.symbol][order.id]
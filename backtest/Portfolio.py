@@ -0,0 +1,178 @@
+"""
+The portfolio runs many trading algorithms side by side on one timer and one set of quotes. Every algorithm trades in
+its own sub-account, an exchange with its own balances and order books, while the clock, the panel of quotes and the
+listed symbols of each tick are shared.
+"""
+
+from backtest.BackExchange import BackExchange
+from backtest.BackTest import BackTest
+from core.Ticker import Quotes
+from core.Timer import Timer
+
+import time
+import numpy as np
+
+
+class Portfolio(object):
+    def __init__(self, timer: Timer, quotes: Quotes, strategies: dict, deposit: dict, currency: str=None,
+                 make_analyzers=None, verbose: bool=False, **exchange_kwargs):
+        """
+        Run many algorithms against sub-accounts of the same quotes until timer ends. At every tick, the panel of
+        quotes and its listed symbols are computed once, every sub-account processes its orders on them, then every
+        algorithm is executed and its sub-account recorded. Prices, listed symbols and the conversion rates of equity
+        are shared, but order matching is still done per sub-account, so its cost grows with the number of strategies
+        that have open orders. Sub-accounts without orders skip order matching.
+
+        Every strategy gets a BackTest runner, see runners, which records its equity, positions and fills and updates
+        its analyzers. The runner is passed to the hooks of the algorithm as in BackTest.
+
+        Args:
+            timer: Timer shared by all sub-accounts, e.g. an EventTimer.
+            quotes: Quotes shared by all sub-accounts.
+            strategies: Dictionary of form {name: make_algorithm}, make_algorithm(exchange) -> algorithm, e.g. an
+                        algorithm class.
+            deposit: Dictionary of form {asset: amount} deposited into every sub-account.
+            currency: Asset to value equity in. Defaults to None.
+            make_analyzers: Function returning new analyzers of a strategy. Defaults to None, i.e. no analyzers.
+            verbose: Print exchange logs. Defaults to False.
+            exchange_kwargs: Other arguments of BackExchange, e.g. fee_rate or slippage_model. A slippage model is
+                             shared by all sub-accounts.
+        """
+        timeframe = exchange_kwargs.pop('timeframe', 0)
+        if timeframe:
+            # resampled once for all sub-accounts
+            quotes = quotes.resample(timeframe)
+        self.timer = timer
+        self.quotes = quotes
+        self.currency = currency
+
+        self.accounts = {}
+        self.runners = {}
+        # conversion rates of equity are computed once per tick for all sub-accounts
+        rates = {}
+        for name, make_algorithm in strategies.items():
+            exchange = BackExchange(timer=timer, quotes=quotes, verbose=verbose, **exchange_kwargs)
+            exchange._rates = rates
+            for asset, amount in deposit.items():
+                exchange.deposit(asset, amount)
+            algorithm = make_algorithm(exchange)
+            analyzers = make_analyzers() if make_analyzers is not None else ()
+            self.accounts[name] = exchange
+            self.runners[name] = BackTest(algorithm, exchange, timer, currency=currency, verbose=verbose,
+                                          analyzers=analyzers)
+        self.names = list(self.runners)
+
+        # 'ready', 'running', 'paused' or 'stopped'
+        self.state = 'ready'
+        self.ticks = 0
+        # wall time of the loop, and of the algorithms only
+        self.elapsed = 0.0
+        self.algorithm_time = 0.0
+
+    def run(self, max_ticks: int=None) -> bool:
+        """
+        Run the loop until timer ends, pause or stop is called, or max_ticks ticks are run. A strategy that pauses or
+        stops its own runner is not executed until run is called again, or at all if stopped, but its sub-account is
+        still processed and recorded.
+
+        Returns:
+            bool: True if the portfolio is finished, i.e. timer ended or stop was called.
+        """
+        if self.state == 'stopped':
+            return True
+        for runner in self.runners.values():
+            if runner.state != 'stopped':
+                runner._start()
+        self.state = 'running'
+
+        # everything called at each tick is looked up once
+        processes = [exchange._process for exchange in self.accounts.values()]
+        runners = list(self.runners.values())
+        get_panel = self.quotes.get_panel
+        timer = self.timer
+        clock = time.perf_counter
+        limit = -1 if max_ticks is None else max_ticks
+
+        algorithm_times = [runner.algorithm_time for runner in runners]
+        ticks, algorithm_time, finished = 0, 0.0, False
+        begin = clock()
+        while ticks != limit and self.state == 'running':
+            panel = get_panel()
+            listed = panel.get_listed(timer.time)
+            for process in processes:
+                process(panel, listed)
+            for runner in runners:
+                if runner.state == 'running':
+                    start = clock()
+                    runner.algorithm.execute()
+                    spent = clock() - start
+                    runner.algorithm_time += spent
+                    algorithm_time += spent
+                runner._record()
+            ticks += 1
+            if timer.next():
+                finished = True
+                break
+        elapsed = clock() - begin
+        self.elapsed += elapsed
+        self.algorithm_time += algorithm_time
+        self.ticks += ticks
+        # the shared part of the loop is split evenly between runners
+        shared = (elapsed - algorithm_time) / max(len(runners), 1)
+        for runner, before in zip(runners, algorithm_times):
+            runner.elapsed += runner.algorithm_time - before + shared
+
+        if finished:
+            self.stop()
+        else:
+            self.pause()
+            # the pause hooks of every strategy still running are fired here, once the tick is over
+            for runner in runners:
+                runner.pause()
+        return self.state == 'stopped'
+
+    def pause(self):
+        """
+        Pause all strategies after the current tick. The pause hooks of the strategies are fired when the tick is over.
+        """
+        if self.state == 'running':
+            self.state = 'paused'
+
+    def stop(self):
+        """
+        Stop all strategies after the current tick. A stopped portfolio can't be run again.
+        """
+        if self.state != 'stopped':
+            self.state = 'stopped'
+            for runner in self.runners.values():
+                runner.stop()
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.runners[self.names[0]].timestamps if self.names else np.zeros(0, dtype=np.int64)
+
+    @property
+    def equity(self) -> np.ndarray:
+        """
+        Array of shape (tick, strategy) of equity of every sub-account, strategies are ordered as in names.
+        """
+        return np.column_stack([self.runners[name].equity for name in self.names]) if self.names else \
+            np.zeros((self.ticks, 0))
+
+    def analysis(self) -> dict:
+        """
+        Returns:
+            Dictionary of form {name: {analyzer name: result}}, up to the last tick run.
+        """
+        return {name: runner.analysis() for name, runner in self.runners.items()}
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dictionary of ticks run, wall time, and wall time per tick of the whole loop, of all algorithms, and of
+            the framework, i.e. sub-accounts and recording.
+        """
+        ticks = max(self.ticks, 1)
+        return {'ticks': self.ticks, 'strategies': len(self.names), 'elapsed': self.elapsed,
+                'time_per_tick': self.elapsed / ticks, 'algorithm_time_per_tick': self.algorithm_time / ticks,
+                'overhead_per_tick': (self.elapsed - self.algorithm_time) / ticks}
@@ -1,6 +1,8 @@
-from core.Ticker import TickerFields, BidAsks
+from core.Ticker import BidAsks
 from backtest.Order import OrderType, OrderSide
 
+import numpy as np
+
 
 class SlippageBase(object):
     def __init__(self):
@@ -10,6 +12,32 @@ class SlippageBase(object):
                     ticker: dict, timestamp: int):
         return price, amount
 
+    def generate_txs(self, prices: np.ndarray, amounts: np.ndarray, order_types: np.ndarray, order_sides: np.ndarray,
+                     symbols: np.ndarray, tickers: dict, timestamp: int):
+        """
+        Generate tentative transactions of all orders matched at a tick. Defaults to calling generate_tx per order,
+        models should override it with a vectorized version.
+
+        Args:
+            prices: Ticker price of each order.
+            amounts: Remaining amount of each order.
+            order_types: OrderType of each order, as an object array.
+            order_sides: OrderSide of each order, as an object array.
+            symbols: Symbol of each order, as an object array.
+            tickers: Dictionary of form {'open': array, 'high': array, ...}, the ticker of the symbol of each order.
+            timestamp: Current timestamp.
+
+        Returns:
+            (array of transaction prices, array of transaction amounts).
+        """
+        txs = [self.generate_tx(prices[i], amounts[i], order_types[i], order_sides[i], symbols[i],
+                                {field: tickers[field][i] for field in tickers}, timestamp) for i in range(len(prices))]
+        return np.array([tx[0] for tx in txs], dtype=np.float64), np.array([tx[1] for tx in txs], dtype=np.float64)
+
+    @staticmethod
+    def _signs(order_sides: np.ndarray) -> np.ndarray:
+        return np.where(order_sides == OrderSide.Buy, 1.0, -1.0)
+
 
 class VolumeSlippage(SlippageBase):
     def __init__(self, tradable_rate: float=2.5):
@@ -23,30 +51,73 @@ class VolumeSlippage(SlippageBase):
         else:
             return price, amount
 
+    def generate_txs(self, prices: np.ndarray, amounts: np.ndarray, order_types: np.ndarray, order_sides: np.ndarray,
+                     symbols: np.ndarray, tickers: dict, timestamp: int):
+        return prices, np.where(order_types == OrderType.Market, amounts,
+                                np.minimum(amounts, tickers['volume'] * self._rate / 100.0))
+
+
+class _SpreadCache(object):
+    def __init__(self, bidask: BidAsks):
+        """
+        Spread of each symbol at the current tick, resolved once per symbol and tick however many orders ask for it.
+        Spreads are looked up in the spread series precomputed by BidAsk.
+        """
+        self._bidask = bidask
+        self._timestamp = None
+        self._spreads = {}
+
+    def get(self, symbol: str, timestamp: int) -> float:
+        """
+        Returns:
+            Ask minus bid at the closest timestamp, NaN if there is no bid-ask data for symbol.
+        """
+        if timestamp != self._timestamp:
+            self._timestamp = timestamp
+            self._spreads = {}
+        if symbol not in self._spreads:
+            try:
+                self._spreads[symbol] = self._bidask.get_ticker(symbol).get_closet_spread(timestamp)
+            except KeyError:
+                self._spreads[symbol] = np.nan
+        return self._spreads[symbol]
+
+    def get_many(self, symbols: np.ndarray, timestamp: int) -> np.ndarray:
+        spreads = np.empty(len(symbols))
+        for symbol in set(symbols):
+            spreads[symbols == symbol] = self.get(symbol, timestamp)
+        return spreads
+
 
 class SpreadSlippage(SlippageBase):
     def __init__(self, bidask: BidAsks, spread_rate: float=50):
         super(SpreadSlippage, self).__init__()
         self._bidask = bidask
+        self._spreads = _SpreadCache(bidask)
         self._rate = spread_rate
 
     def generate_tx(self, price: float, amount: float, order_type: OrderType, order_side: OrderSide, symbol: str,
                     ticker: dict, timestamp: int):
-        try:
-            bid = self._bidask.get_ticker(symbol).get_closet_value(timestamp, TickerFields.Bid)
-            ask = self._bidask.get_ticker(symbol).get_closet_value(timestamp, TickerFields.Ask)
-        except KeyError:
+        spread = self._spreads.get(symbol, timestamp)
+        if np.isnan(spread):
             return price, amount
         if order_side is OrderSide.Buy:
-            return price + (ask - bid) * self._rate / 100.0, amount
+            return price + spread * self._rate / 100.0, amount
         elif order_side is OrderSide.Sell:
-            return price - (ask - bid) * self._rate / 100.0, amount
+            return price - spread * self._rate / 100.0, amount
+
+    def generate_txs(self, prices: np.ndarray, amounts: np.ndarray, order_types: np.ndarray, order_sides: np.ndarray,
+                     symbols: np.ndarray, tickers: dict, timestamp: int):
+        spreads = self._spreads.get_many(symbols, timestamp)
+        return np.where(np.isnan(spreads), prices, prices + self._signs(order_sides) * spreads * self._rate / 100.0), \
+            amounts
 
 
 class SpreadVolumeSlippage(SlippageBase):
     def __init__(self, bidask: BidAsks, spread_rate: float=0.5, tradable_rate: float=2.5):
         super(SpreadVolumeSlippage, self).__init__()
         self._bidask = bidask
+        self._spreads = _SpreadCache(bidask)
         self._srate = spread_rate
         self._vrate = tradable_rate
 
@@ -55,14 +126,157 @@ class SpreadVolumeSlippage(SlippageBase):
         if order_type is not OrderType.Market:
             amount = min(amount, ticker['volume'] * self._vrate / 100.0)
 
-        # assuming ticker has 'symbol' as key
-        try:
-            bid = self._bidask.get_ticker(ticker['symbol']).get_closet_value(timestamp, TickerFields.Bid)
-            ask = self._bidask.get_ticker(ticker['symbol']).get_closet_value(timestamp, TickerFields.Ask)
-        except KeyError:
+        spread = self._spreads.get(symbol, timestamp)
+        if np.isnan(spread):
             return price, amount
         # use _srate in place of _rate
         if order_side is OrderSide.Buy:
-            return price + (ask - bid) * self._srate / 100.0, amount
+            return price + spread * self._srate / 100.0, amount
+        elif order_side is OrderSide.Sell:
+            return price - spread * self._srate / 100.0, amount
+
+    def generate_txs(self, prices: np.ndarray, amounts: np.ndarray, order_types: np.ndarray, order_sides: np.ndarray,
+                     symbols: np.ndarray, tickers: dict, timestamp: int):
+        amounts = np.where(order_types == OrderType.Market, amounts,
+                           np.minimum(amounts, tickers['volume'] * self._vrate / 100.0))
+        spreads = self._spreads.get_many(symbols, timestamp)
+        return np.where(np.isnan(spreads), prices, prices + self._signs(order_sides) * spreads * self._srate / 100.0), \
+            amounts
+
+
+class DepthSlippage(SlippageBase):
+    def __init__(self, storage=None, symbols: list=(), start: int=None, end: int=None):
+        """
+        Fill orders by walking recorded order book snapshots. The last snapshot at or before the current timestamp is
+        used, and the order is charged the difference between its volume weighted price in the book and the best price,
+        on top of the ticker price. Market orders deeper than the recorded book fill the rest at the deepest price.
+        Limit orders fill at most the recorded depth per tick, the rest is processed at next tick.
+
+        Each side of a snapshot is kept as cumulative size and notional arrays, so a fill is a binary search over
+        levels.
+
+        Args:
+            storage: Order book storage with a read(symbol, start, end) method, e.g. api.storage.OrderBookStorage.
+                     Defaults to None, order books can then be added by add_order_book.
+            symbols: Symbols to load from storage. Defaults to ().
+            start: Earliest snapshot timestamp to load. Defaults to None, i.e. no lower bound.
+            end: Latest snapshot timestamp to load. Defaults to None, i.e. no upper bound.
+        """
+        super(DepthSlippage, self).__init__()
+        self._books = {}
+        for symbol in symbols:
+            self.add_order_book(symbol, *storage.read(symbol, start, end))
+
+    @staticmethod
+    def _side(levels: np.ndarray) -> tuple:
+        prices = levels[:, :, 0]
+        sizes = np.where(np.isnan(prices), 0, np.nan_to_num(levels[:, :, 1]))
+        return prices, np.cumsum(sizes, axis=1), np.cumsum(sizes * np.nan_to_num(prices), axis=1), \
+            np.count_nonzero(~np.isnan(prices), axis=1)
+
+    def add_order_book(self, symbol: str, timestamps: np.ndarray, asks: np.ndarray, bids: np.ndarray):
+        """
+        Add order book snapshots of a symbol.
+
+        Args:
+            symbol: Trading pair symbol.
+            timestamps: Sorted snapshot timestamps of shape (n,).
+            asks: Ask levels of shape (n, depth, 2), (price, size) from the best price, padded with NaN.
+            bids: Bid levels of shape (n, depth, 2), (price, size) from the best price, padded with NaN.
+        """
+        self._books[symbol] = (np.asarray(timestamps, dtype=np.int64),
+                               self._side(np.asarray(asks, dtype=np.float64)),
+                               self._side(np.asarray(bids, dtype=np.float64)))
+
+    def walk(self, symbol: str, timestamp: int, order_side: OrderSide, amount: float, partial: bool=False):
+        """
+        Walk the book for amount.
+
+        Args:
+            symbol: Trading pair symbol.
+            timestamp: Current timestamp.
+            order_side: Buy walks asks, sell walks bids.
+            amount: Amount to fill.
+            partial: Fill at most the recorded depth. Defaults to False.
+
+        Returns:
+            (volume weighted price, best price, filled amount), or None if there is no snapshot.
+        """
+        if symbol not in self._books:
+            return None
+        timestamps, asks, bids = self._books[symbol]
+        row = int(np.searchsorted(timestamps, timestamp, side='right')) - 1
+        if row < 0:
+            return None
+        prices, cum_size, cum_notional, n_levels = asks if order_side is OrderSide.Buy else bids
+        n = n_levels[row]
+        if n == 0:
+            return None
+
+        sizes = cum_size[row, :n]
+        filled = min(amount, sizes[-1]) if partial else amount
+        if filled <= 0:
+            return float(prices[row, 0]), float(prices[row, 0]), 0.0
+        level = min(int(np.searchsorted(sizes, filled)), n - 1)
+        notional = cum_notional[row, level - 1] if level else 0.0
+        notional += (filled - (sizes[level - 1] if level else 0.0)) * prices[row, level]
+        return float(notional / filled), float(prices[row, 0]), float(filled)
+
+    def walk_many(self, symbol: str, timestamp: int, order_side: OrderSide, amounts: np.ndarray, partial: np.ndarray):
+        """
+        Vectorized walk of many orders on the same side of the book of a symbol, each walking the book alone.
+
+        Returns:
+            (array of volume weighted prices, best price, array of filled amounts), or None if there is no snapshot.
+        """
+        if symbol not in self._books:
+            return None
+        timestamps, asks, bids = self._books[symbol]
+        row = int(np.searchsorted(timestamps, timestamp, side='right')) - 1
+        if row < 0:
+            return None
+        prices, cum_size, cum_notional, n_levels = asks if order_side is OrderSide.Buy else bids
+        n = n_levels[row]
+        if n == 0:
+            return None
+
+        sizes, notionals = cum_size[row, :n], cum_notional[row, :n]
+        filled = np.where(partial, np.minimum(amounts, sizes[-1]), amounts)
+        level = np.minimum(np.searchsorted(sizes, filled), n - 1)
+        before = level - 1
+        notional = np.where(level > 0, notionals[before], 0.0)
+        notional += (filled - np.where(level > 0, sizes[before], 0.0)) * prices[row, level]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vwap = np.where(filled > 0, notional / filled, prices[row, 0])
+        return vwap, prices[row, 0], filled
+
+    def generate_txs(self, prices: np.ndarray, amounts: np.ndarray, order_types: np.ndarray, order_sides: np.ndarray,
+                     symbols: np.ndarray, tickers: dict, timestamp: int):
+        prices, amounts = np.array(prices, dtype=np.float64), np.array(amounts, dtype=np.float64)
+        is_buy = order_sides == OrderSide.Buy
+        partial = order_types != OrderType.Market
+        for symbol in set(symbols):
+            for side, mask in ((OrderSide.Buy, is_buy), (OrderSide.Sell, ~is_buy)):
+                mask = (symbols == symbol) & mask
+                if not mask.any():
+                    continue
+                fill = self.walk_many(symbol, timestamp, side, amounts[mask], partial[mask])
+                if fill is None:
+                    continue
+                vwap, best, amounts[mask] = fill
+                if side is OrderSide.Buy:
+                    prices[mask] += vwap - best
+                else:
+                    prices[mask] = np.maximum(prices[mask] - (best - vwap), 0)
+        return prices, amounts
+
+    def generate_tx(self, price: float, amount: float, order_type: OrderType, order_side: OrderSide, symbol: str,
+                    ticker: dict, timestamp: int):
+        fill = self.walk(symbol, timestamp, order_side, amount, partial=order_type is not OrderType.Market)
+        if fill is None:
+            return price, amount
+        vwap, best, amount = fill
+        if order_side is OrderSide.Buy:
+            return price + vwap - best, amount
         elif order_side is OrderSide.Sell:
-            return price - (ask - bid) * self._srate / 100.0, amount
+            return max(price - (best - vwap), 0), amount
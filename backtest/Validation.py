@@ -0,0 +1,201 @@
+"""
+Walk-forward and cross-validation of trading algorithms. A time range of quotes is split into folds, and the algorithm
+is backtested on the test segment of every fold, in parallel processes.
+"""
+
+from backtest.BackExchange import BackExchange
+from backtest.BackTest import BackTest
+from backtest.Analyzer import default_analyzers
+from core.Ticker import Quotes
+from core.Timer import Timer
+
+import os
+import random
+import multiprocessing
+import numpy as np
+
+
+def walk_forward_splits(start: int, end: int, train: int, test: int, step: int, anchored: bool=False) -> list:
+    """
+    Split [start, end] into consecutive test segments of length test, each preceded by a train segment.
+
+    Args:
+        start: First timestamp.
+        end: Last timestamp, inclusive.
+        train: Length of train segments.
+        test: Length of test segments.
+        step: Ticker size, all segments are aligned to start + k * step.
+        anchored: Train segments all begin at start and grow, instead of sliding. Defaults to False.
+
+    Returns:
+        List of form [([(train start, train end)], (test start, test end))], ends inclusive.
+    """
+    train, test = train // step * step, test // step * step
+    assert train > 0 and test > 0, "train and test should be at least one step. "
+    splits = []
+    test_start = start + train
+    while test_start + test - step <= end:
+        train_start = start if anchored else test_start - train
+        splits.append(([(train_start, test_start - step)], (test_start, test_start + test - step)))
+        test_start += test
+    return splits
+
+
+def purged_kfold_splits(start: int, end: int, k: int, step: int, purge: int=0, embargo: int=0) -> list:
+    """
+    Split [start, end] into k test segments. The train set of a fold is everything else, except purge before the test
+    segment and embargo after it, so that train data doesn't overlap with what the test segment depends on.
+
+    Args:
+        start: First timestamp.
+        end: Last timestamp, inclusive.
+        k: Number of folds.
+        step: Ticker size, all segments are aligned to start + k * step.
+        purge: Length removed from train before each test segment. Defaults to 0.
+        embargo: Length removed from train after each test segment. Defaults to 0.
+
+    Returns:
+        List of form [([(train start, train end)], (test start, test end))], ends inclusive.
+    """
+    n = (end - start) // step + 1
+    assert n >= k, "Less steps than folds. "
+    bounds = [start + (n * i // k) * step for i in range(k + 1)]
+    splits = []
+    for i in range(k):
+        test_start, test_end = bounds[i], bounds[i + 1] - step
+        train = []
+        before = test_start - purge - step
+        if before >= start:
+            train.append((start, before))
+        after = bounds[i + 1] + embargo
+        if after <= end:
+            train.append((after, end))
+        splits.append((train, (test_start, test_end)))
+    return splits
+
+
+# state of the running job, inherited by forked workers instead of being pickled
+_job = None
+
+
+def _call(i: int):
+    return _job[0](_job[1], i)
+
+
+def fork_map(fun, job, n: int, processes: int, chunksize: int=1) -> list:
+    """
+    Compute [fun(job, i) for i in range(n)] in worker processes forked from this one. job is inherited by workers as
+    it is, e.g. with large arrays, and only i and the results are pickled. Where fork isn't available, or processes is
+    1, items are computed one after another in this process.
+    """
+    global _job
+    processes = min(processes, n)
+    _job = (fun, job)
+    try:
+        if processes <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            return [fun(job, i) for i in range(n)]
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            return pool.map(_call, range(n), chunksize=chunksize)
+    finally:
+        _job = None
+
+
+def _run_branch(job, i: int):
+    exchange, attached = job['exchange'].fork(*job['attached'])
+    return job['fun'](job['variants'][i], exchange, *attached)
+
+
+def run_branches(exchange: BackExchange, variants: list, fun, attached: tuple=(), processes: int=1) -> list:
+    """
+    Explore what-if branches of a running exchange from its current state, see BackExchange.fork. Each variant gets
+    its own branch, in this process or in worker processes forked from it, and the exchange itself is left as it is.
+
+    Args:
+        exchange: Running exchange.
+        variants: List of variants, e.g. orders to place.
+        fun: Function of form fun(variant, branched exchange, *branched attached objects) -> result, e.g. placing an
+             order and running the branch to the end.
+        attached: Objects to branch along with the exchange, e.g. the algorithm or a BackTest runner. Defaults to ().
+        processes: Number of worker processes. Defaults to 1.
+
+    Returns:
+        List of results, in the order of variants.
+    """
+    job = {'exchange': exchange, 'attached': tuple(attached), 'variants': list(variants), 'fun': fun}
+    return fork_map(_run_branch, job, len(job['variants']), processes,
+                    chunksize=max(1, len(job['variants']) // (4 * max(processes, 1))))
+
+
+def _run_fold(job, i: int) -> dict:
+    train, (test_start, test_end) = job.splits[i]
+    seed = job.seeds[i]
+    random.seed(seed)
+    np.random.seed(seed)
+
+    fold = {'fold': i, 'train': train, 'test': (test_start, test_end), 'seed': seed}
+    timer = Timer(test_start, test_end, job.step)
+    exchange = BackExchange(timer=timer, quotes=job.quotes, verbose=False, **job.exchange_kwargs)
+    for asset, amount in job.deposit.items():
+        exchange.deposit(asset, amount)
+    algorithm = job.make_algorithm(exchange, fold)
+    backtest = BackTest(algorithm, exchange, timer, currency=job.currency, analyzers=job.make_analyzers())
+    backtest.run()
+
+    fold['analysis'] = backtest.analysis()
+    fold['stats'] = backtest.stats()
+    return fold
+
+
+class Validation(object):
+    def __init__(self, quotes: Quotes, make_algorithm, step: int, deposit: dict, currency: str=None,
+                 make_analyzers=default_analyzers, seed: int=0, processes: int=None, **exchange_kwargs):
+        """
+        Backtest an algorithm on the test segment of every fold of a split, see walk_forward_splits and
+        purged_kfold_splits. Every fold gets a new Timer, BackExchange and algorithm.
+
+        Folds run in worker processes forked from this one. The aligned panel of quotes is built once before forking,
+        so workers read the same price arrays without copying or pickling them. Where fork isn't available, or
+        processes is 1, folds run one after another in this process.
+
+        Args:
+            quotes: Quotes of the whole time range.
+            make_algorithm: Function of form make_algorithm(exchange, fold) -> algorithm, fold is a dictionary with
+                            'fold', 'train', 'test' and 'seed', e.g. to fit the algorithm on the train segments.
+            step: Ticker size of the timers.
+            deposit: Dictionary of form {asset: amount} deposited at the beginning of every fold.
+            currency: Asset to value equity in. Defaults to None.
+            make_analyzers: Function returning new analyzers of a fold. Defaults to default_analyzers.
+            seed: Seed of the seeds of the folds, random and numpy.random are seeded in every fold. Defaults to 0.
+            processes: Number of worker processes. Defaults to None, i.e. number of CPUs.
+            exchange_kwargs: Other arguments of BackExchange, e.g. fee_rate or slippage_model.
+        """
+        self.quotes = quotes
+        self.make_algorithm = make_algorithm
+        self.step = step
+        self.deposit = deposit
+        self.currency = currency
+        self.make_analyzers = make_analyzers
+        self.seed = seed
+        self.processes = processes if processes is not None else os.cpu_count() or 1
+        self.exchange_kwargs = exchange_kwargs
+
+        self.splits = []
+        self.seeds = []
+
+    def run(self, splits: list) -> list:
+        """
+        Args:
+            splits: List of folds, see walk_forward_splits and purged_kfold_splits.
+
+        Returns:
+            List of dictionaries per fold, with 'fold', 'train', 'test', 'seed', 'analysis' of analyzer results and
+            'stats' of BackTest.stats, in fold order.
+        """
+        self.splits = list(splits)
+        self.seeds = [int(sequence.generate_state(1)[0])
+                      for sequence in np.random.SeedSequence(self.seed).spawn(len(self.splits))]
+        # built and cached before forking, shared by all workers
+        self.quotes.get_panel()
+
+        print('[Validation] Running {:d} folds in up to {:d} processes'.format(len(self.splits), self.processes))
+        return fork_map(_run_fold, self, len(self.splits), self.processes)
@@ -1,5 +1,7 @@
 import os
+import io
 import csv
+import numpy as np
 import pandas as pd
 import re
 import ccxt
@@ -11,7 +13,19 @@ from enum import Enum
 # from decimal import *
 # getcontext().prec = 8
 
-from ccxt.base.errors import ExchangeNotAvailable, ExchangeError, RequestTimeout, DDoSProtection
+from ccxt.base.errors import ExchangeNotAvailable, ExchangeError, RequestTimeout, DDoSProtection, NetworkError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import requests
+except ImportError:
+    requests = None
 
 
 class TickerFields(Enum):
@@ -26,12 +40,129 @@ class TickerFields(Enum):
     Last = "last"
 
 
+def _iter_lines(chunks):
+    """
+    Split an iterable of byte chunks into lines, each including its line terminator, so that the number of bytes
+    consumed is exactly the total length of the lines. A trailing line without terminator may still be being written
+    and is not yielded.
+    """
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+
+
+class _ColumnStore(object):
+    def __init__(self, timestamps: np.ndarray, columns: dict):
+        """
+        Growable column arrays sorted by timestamp. Capacity doubles whenever it runs out, so that appending n rows
+        costs amortized O(n) regardless of the number of rows already stored.
+        """
+        self.size = len(timestamps)
+        capacity = max(self.size, 16)
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.timestamps[:self.size] = timestamps
+        self.columns = {}
+        for field in columns:
+            values = np.asarray(columns[field])
+            kind = values.dtype.kind
+            dtype = values.dtype if kind == 'f' else np.float64 if kind in 'biu' else object
+            self.columns[field] = np.empty(capacity, dtype=dtype)
+            self.columns[field][:self.size] = values
+
+    @classmethod
+    def from_frame(cls, data_frame: pd.DataFrame):
+        return cls(data_frame.index.values, {field: data_frame[field].to_numpy() for field in data_frame.columns})
+
+    @property
+    def last_timestamp(self):
+        return int(self.timestamps[self.size - 1]) if self.size else None
+
+    def find(self, timestamp: int) -> int:
+        idx = np.searchsorted(self.timestamps[:self.size], timestamp)
+        if idx < self.size and self.timestamps[idx] == timestamp:
+            return int(idx)
+        return -1
+
+    def append(self, timestamps: np.ndarray, columns: dict) -> int:
+        """
+        Append rows later than the last stored timestamp, and ignore the others.
+
+        Returns:
+            Number of appended rows.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if self.size:
+            keep = timestamps > self.timestamps[self.size - 1]
+            if not keep.all():
+                timestamps = timestamps[keep]
+                columns = {field: np.asarray(columns[field])[keep] for field in columns}
+        n = len(timestamps)
+        if n == 0:
+            return 0
+
+        if self.size + n > len(self.timestamps):
+            capacity = max(2 * len(self.timestamps), self.size + n)
+            self.timestamps = np.resize(self.timestamps, capacity)
+            for field in self.columns:
+                self.columns[field] = np.resize(self.columns[field], capacity)
+
+        self.timestamps[self.size:self.size + n] = timestamps
+        for field in self.columns:
+            if field in columns:
+                self.columns[field][self.size:self.size + n] = columns[field]
+            else:
+                self.columns[field][self.size:self.size + n] = np.nan if self.columns[field].dtype.kind == 'f' else None
+        self.size += n
+        return n
+
+    def frame(self) -> pd.DataFrame:
+        # views on the filled part of the buffers, rows appended later are not visible through this frame
+        return pd.DataFrame({field: self.columns[field][:self.size] for field in self.columns},
+                            index=pd.Index(self.timestamps[:self.size], name="timestamp"), copy=False)
+
+
 class TickerBase(object):
     def __init__(self, quote_name: str, base_name: str):
         self._quote_name = quote_name
         self._base_name = base_name
         self._symbol = quote_name + "/" + base_name
-        self._data = None
+        self._frame = None
+        self._store = None
+        # bumped on every change of data, so that caches built on top of the ticker know when to rebuild
+        self._version = 0
+        # {url: (number of bytes already read, column index of each field)}, see read_from_url
+        self._url_state = {}
+        # (number of bytes already read, column index of each field) of the csv file, see read_from_csv
+        self._csv_state = None
+        # (source type, file path / url / api_fun, field_name) of the last read, see refresh
+        self._source = None
+
+    @property
+    def _data(self) -> pd.DataFrame:
+        if self._frame is None and self._store is not None:
+            self._frame = self._store.frame()
+        return self._frame
+
+    @_data.setter
+    def _data(self, data_frame: pd.DataFrame):
+        if data_frame is not None and not data_frame.index.is_monotonic_increasing:
+            data_frame = data_frame.sort_index(kind="stable")
+        self._frame = data_frame
+        self._store = None
+        self._source = None
+        self._version += 1
+
+    def _get_store(self) -> _ColumnStore:
+        if self._store is None and self._frame is not None:
+            self._store = _ColumnStore.from_frame(self._frame)
+        return self._store
+
+    @property
+    def version(self) -> int:
+        return self._version
 
     @property
     def quote_name(self):
@@ -59,6 +190,9 @@ class TickerBase(object):
         assert "timestamp" in field_name
 
         pd_data = None
+        # the file may be appended while being read. rows beyond this offset are read again by refresh, and dropped
+        # there if already loaded
+        offset = os.path.getsize(file_path)
 
         with open(file_path) as input_file:
             reader = csv.reader(input_file)
@@ -74,9 +208,117 @@ class TickerBase(object):
             raise ValueError
         # use timestamp as primary key
         self._data = pd_data.set_index("timestamp")
+        self._csv_state = (self.__line_start(file_path, offset), self._parse_header(header, field_name)[0])
+        self._source = ('csv', file_path, field_name)
+
+        print("[Ticker] Read {:d} lines of ticker data for {:s}".format(self._data.shape[0], self._symbol))
+
+    @staticmethod
+    def __line_start(file_path: str, offset: int) -> int:
+        """
+        Returns:
+            Offset of the start of the line containing byte offset, i.e. offset itself if it is at a line start.
+        """
+        with open(file_path, 'rb') as file:
+            while offset > 0:
+                start = max(offset - 4096, 0)
+                file.seek(start)
+                block = file.read(offset - start)
+                eol = block.rfind(b"\n")
+                if eol >= 0:
+                    return start + eol + 1
+                offset = start
+        return 0
+
+    def refresh(self) -> int:
+        """
+        Load rows appended to the source of the last read since then, without reloading what is already loaded. For
+        a csv file, only the bytes after the remembered offset are parsed, and only complete lines are consumed, so
+        that a row being written is picked up by the next refresh. For a url the remaining bytes are requested, and
+        for an API callable it is called with the last loaded timestamp. Rows not later than the last loaded timestamp
+        are ignored.
+
+        Returns:
+            Number of appended rows.
+        """
+        if self._source is None:
+            return 0
+        source_type, source, field_name = self._source
+        if source_type == 'url':
+            return self.read_from_url(source, field_name, append=True)
+        elif source_type == 'api':
+            return self.read_from_api(source, field_name, append=True)
+
+        offset, columns = self._csv_state
+        size = os.path.getsize(source)
+        if size < offset:
+            # the file has been truncated or replaced
+            print("[Ticker] {:s} shrank, reload. ".format(source))
+            self.read_from_csv(source, field_name)
+            return self._data.shape[0]
+        if size == offset:
+            return 0
+
+        with open(source, 'rb') as file:
+            file.seek(offset)
+            content = file.read(size - offset)
+        end = content.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+        self._csv_state = (offset + end, columns)
+
+        table = [[row[i] for i in columns] for row in csv.reader(content[:end].decode().splitlines()) if row]
+        return self.append_from_table(table, field_name)
+
+    def read_from_parquet(self, file_path: str, field_name: set, start: int=None, end: int=None):
+        """
+        Read fields given by field_name from a parquet file, or a directory of parquet files, file_path. Only columns
+        in field_name are read from disk. If start or end is given, row groups whose timestamp statistics lie entirely
+        outside of [start, end] are skipped without being decoded.
+
+        Args:
+            file_path: Path to parquet file or directory of parquet files.
+            field_name: List of field names to import.
+            start: Earliest timestamp to import. Defaults to None, i.e. no lower bound.
+            end: Latest timestamp to import. Defaults to None, i.e. no upper bound.
+        """
+        if pq is None:
+            raise ImportError("pyarrow is required to read parquet files. ")
+        assert os.path.exists(file_path)
+        assert "timestamp" in field_name
+
+        filters = []
+        if start is not None:
+            filters.append(("timestamp", ">=", start))
+        if end is not None:
+            filters.append(("timestamp", "<=", end))
+
+        table = pq.read_table(file_path, columns=list(field_name), filters=filters if filters else None)
+        # use timestamp as primary key
+        self._data = table.to_pandas().set_index("timestamp").sort_index()
 
         print("[Ticker] Read {:d} lines of ticker data for {:s}".format(self._data.shape[0], self._symbol))
 
+    def write_parquet(self, file_path: str, row_group_size: int=100000, compression: str='snappy'):
+        """
+        Write all fields to a parquet file file_path, sorted by timestamp. Each row group then covers a contiguous
+        timestamp range, which is what allows read_from_parquet to skip row groups by timestamp.
+
+        Args:
+            file_path: Path to parquet file.
+            row_group_size: Maximum number of rows per row group. Defaults to 100000.
+            compression: Compression codec. Defaults to 'snappy'.
+        """
+        if pq is None:
+            raise ImportError("pyarrow is required to write parquet files. ")
+        if self._data is None:
+            raise ValueError
+
+        table = pa.Table.from_pandas(self._data.sort_index().reset_index(), preserve_index=False)
+        pq.write_table(table, file_path, row_group_size=row_group_size, compression=compression)
+
+        print("[Ticker] Wrote {:d} lines of ticker data for {:s}".format(self._data.shape[0], self._symbol))
+
     def read_from_table(self, table: list, field_name: set):
         pd_data = pd.DataFrame(table, columns=field_name)
         # use timestamp as primary key
@@ -88,38 +330,197 @@ class TickerBase(object):
             raise TypeError
         self._data = data_frame.set_index("timestamp")
 
-    def read_from_url(self, url: str):
-        raise NotImplementedError
+    def append_from_table(self, table: list, field_name: set) -> int:
+        """
+        Append rows in table to the ticker data in place. Rows not later than the last timestamp already loaded are
+        ignored, so that overlapping batches can be appended safely.
 
-    def read_from_api(self, api_fun):
-        raise NotImplementedError
+        Args:
+            table: List of rows, each ordered as field_name.
+            field_name: List of field names of the rows.
+
+        Returns:
+            Number of appended rows.
+        """
+        assert "timestamp" in field_name
+        if not len(table):
+            return 0
+
+        field_name = list(field_name)
+        ts_column = field_name.index("timestamp")
+        timestamps = np.array([row[ts_column] for row in table], dtype=np.int64)
+        columns = {}
+        for i, field in enumerate(field_name):
+            if i != ts_column:
+                column = [row[i] for row in table]
+                try:
+                    columns[field] = np.array(column, dtype=np.float64)
+                except (TypeError, ValueError):
+                    columns[field] = np.array(column, dtype=object)
+        if len(timestamps) > 1 and (np.diff(timestamps) < 0).any():
+            order = np.argsort(timestamps, kind="stable")
+            timestamps = timestamps[order]
+            columns = {field: columns[field][order] for field in columns}
+
+        store = self._get_store()
+        if store is None:
+            self._store = _ColumnStore(np.empty(0, dtype=np.int64), {field: columns[field][:0] for field in columns})
+            store = self._store
+        appended = store.append(timestamps, columns)
+        if appended:
+            self._frame = None
+            self._version += 1
+        return appended
+
+    def read_from_url(self, url: str, field_name: set, params=None, append: bool=False, batch_size: int=10000,
+                      session=None, timeout: float=30):
+        """
+        Stream CSV ticker data from url. The response body is parsed line by line and appended to the ticker data in
+        batches of batch_size rows, so that the body is never held in memory as a whole. Header handling is the same
+        as in read_from_csv. Only complete lines are consumed, so that a row being written is picked up by the next
+        read.
+
+        If params is a list of dictionaries, one request is sent per item, e.g. one per page of a paginated endpoint,
+        and all pages are appended in order.
+
+        If append is True, existing data is kept and only rows later than the last loaded timestamp are appended.
+        The number of bytes read from url is remembered, and the next appending read of the same url asks the server
+        for the remaining bytes only, through an HTTP range request. If the server doesn't support range requests,
+        the full body is streamed and already loaded rows are skipped.
+
+        Args:
+            url: URL of the CSV data.
+            field_name: List of field names to import.
+            params: Query parameters, or list of query parameters for paginated requests. Defaults to None.
+            append: Append to existing data instead of replacing it. Defaults to False.
+            batch_size: Number of rows parsed before they are appended. Defaults to 10000.
+            session: requests session to reuse connections. Defaults to None, i.e. a new session.
+            timeout: Timeout in seconds of each request. Defaults to 30.
+
+        Returns:
+            Number of appended rows.
+        """
+        if requests is None:
+            raise ImportError("requests is required to read from urls. ")
+        assert "timestamp" in field_name
+        if not append:
+            self._data = None
+            self._url_state.pop(url, None)
+        if session is None:
+            session = requests.Session()
+        pages = params if isinstance(params, list) else [params]
+
+        appended = 0
+        for page in pages:
+            # only a url without query parameters is read incrementally
+            offset, columns = self._url_state.get(url, (0, None)) if page is None else (0, None)
+            headers = {'Range': 'bytes={:d}-'.format(offset)} if offset else {}
+            with session.get(url, params=page, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 416:
+                    # nothing new since the last read
+                    continue
+                response.raise_for_status()
+                if response.status_code != 206:
+                    # full body is sent, starting from the header line
+                    offset, columns = 0, None
+
+                batch = []
+                for line in _iter_lines(response.iter_content(chunk_size=1 << 16)):
+                    offset += len(line)
+                    line = line.rstrip(b"\r\n")
+                    if not line:
+                        continue
+                    row = next(csv.reader([line.decode()]))
+                    if columns is None:
+                        columns, is_header = self._parse_header(row, field_name)
+                        if is_header:
+                            continue
+                    batch.append([row[i] for i in columns])
+                    if len(batch) >= batch_size:
+                        appended += self.append_from_table(batch, field_name)
+                        batch = []
+                appended += self.append_from_table(batch, field_name)
+
+                if page is None:
+                    self._url_state[url] = (offset, columns)
+                    self._source = ('url', url, field_name)
+
+        print("[Ticker] Read {:d} lines of ticker data for {:s} from {:s}".format(appended, self._symbol, url))
+        return appended
+
+    @staticmethod
+    def _parse_header(row: list, field_name: set):
+        """
+        Returns:
+            (Column index of each field in field_name, whether row is a header).
+        """
+        if set(field_name) <= set(row):
+            return [row.index(field) for field in field_name], True
+        elif len(row) == len(field_name):
+            return list(range(len(field_name))), False
+        else:
+            raise ValueError
+
+    def read_from_api(self, api_fun, field_name: set, append: bool=False) -> int:
+        """
+        Load ticker data from an API callable. api_fun is called with the last loaded timestamp (None if no data is
+        loaded) and returns an iterable of batches, each a list of rows ordered as field_name. Every batch is appended
+        in place as soon as it is produced, e.g. api_fun can be a generator paging through an exchange API.
+
+        Args:
+            api_fun: Callable of form api_fun(since) -> iterable of batches of rows.
+            field_name: List of field names of the rows.
+            append: Append to existing data instead of replacing it. Defaults to False.
+
+        Returns:
+            Number of appended rows.
+        """
+        if not append:
+            self._data = None
+        self._source = ('api', api_fun, field_name)
+        store = self._get_store()
+        since = store.last_timestamp if store is not None else None
+
+        appended = 0
+        for batch in api_fun(since):
+            appended += self.append_from_table(batch, field_name)
+
+        print("[Ticker] Read {:d} lines of ticker data for {:s} from API".format(appended, self._symbol))
+        return appended
 
     def get_value(self, timestamp: int, field: TickerFields):
         assert isinstance(field, TickerFields)
 
-        if self._data is None:
+        store = self._get_store()
+        if store is None:
             raise ValueError
-        try:
-            return self._data.loc[timestamp, field.value]
-        except Exception:
+        idx = store.find(timestamp)
+        if idx < 0 or field.value not in store.columns:
             raise KeyError
+        return store.columns[field.value][idx]
 
     def get_closet_value(self, timestamp: int, field: TickerFields):
         # It can actually be optimized further by shrinking search range, since time never travels back
         assert isinstance(field, TickerFields)
 
-        idx = self._data.index.searchsorted(timestamp)
-        if idx == len(self._data.index):
+        store = self._get_store()
+        if store is None or store.size == 0:
+            raise ValueError
+        timestamps = store.timestamps[:store.size]
+        idx = timestamps.searchsorted(timestamp)
+        if idx == store.size:
             idx -= 1
         elif idx > 0:
-            if self._data.index[idx] - timestamp > timestamp - self._data.index[idx - 1]:
+            if timestamps[idx] - timestamp > timestamp - timestamps[idx - 1]:
                 idx -= 1
-        return self._data.iloc[idx][field.value]
+        return store.columns[field.value][idx]
 
 
 class Quote(TickerBase):
     def __init__(self, quote_name: str, base_name: str):
         super(Quote, self).__init__(quote_name, base_name)
+        # {(interval, origin): (version of data resampled, resampled quote)}
+        self._resampled = {}
 
     def price_high(self, timestamp: int):
         return self.get_value(timestamp, TickerFields.High)
@@ -141,22 +542,102 @@ class Quote(TickerBase):
                 'low': self.price_low(timestamp), 'close': self.price_close(timestamp),
                 'volume': self.volume(timestamp)}
 
+    def resample(self, interval: int, origin: int=0):
+        """
+        Aggregate bars into bars of interval milliseconds: open of the first bar, highest high, lowest low, close of
+        the last bar and total volume. Bars are aligned to origin + k * interval and labeled by their start time.
+        The result is computed in one vectorized pass and cached per timeframe until the data changes.
+
+        Args:
+            interval: Length of resampled bars in millisecond. Must be a multiple of the base interval of the data.
+            origin: Timestamp that bar boundaries are aligned to. Defaults to 0, i.e. the epoch.
+
+        Returns:
+            A new Quote of resampled bars.
+        """
+        cached = self._resampled.get((interval, origin))
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
+        store = self._get_store()
+        if store is None or store.size == 0:
+            raise ValueError
+        n = store.size
+        timestamps = store.timestamps[:n]
+        if n > 1:
+            base_interval = int(np.diff(timestamps).min())
+            if base_interval <= 0 or interval % base_interval != 0:
+                raise ValueError("Interval {:d} is not a multiple of the base interval {:d}. ".format(interval,
+                                                                                                   base_interval))
+
+        # first row of each bar
+        buckets = (timestamps - origin) // interval
+        starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        ends = np.concatenate((starts[1:], [n])) - 1
+
+        columns = store.columns
+        resampled = {'open': columns['open'][starts],
+                     'high': np.fmax.reduceat(columns['high'][:n], starts),
+                     'low': np.fmin.reduceat(columns['low'][:n], starts),
+                     'close': columns['close'][ends],
+                     'volume': np.add.reduceat(columns['volume'][:n], starts)}
+
+        quote = Quote(self._quote_name, self._base_name)
+        quote._store = _ColumnStore(buckets[starts] * interval + origin, resampled)
+        self._resampled[(interval, origin)] = (self._version, quote)
+        return quote
+
     def read_from_csv(self, file_path: str, field_name=('timestamp', 'open', 'high', 'low', 'close', 'volume')):
         super(Quote, self).read_from_csv(file_path, field_name)
 
+    def read_from_parquet(self, file_path: str, field_name=('timestamp', 'open', 'high', 'low', 'close', 'volume'),
+                          start: int=None, end: int=None):
+        super(Quote, self).read_from_parquet(file_path, field_name, start, end)
+
     def read_from_table(self, table: list, field_name=('timestamp', 'open', 'high', 'low', 'close', 'volume')):
         super(Quote, self).read_from_table(table, field_name)
 
-    def read_from_url(self, url: str):
-        raise NotImplementedError
+    def read_from_url(self, url: str, field_name=('timestamp', 'open', 'high', 'low', 'close', 'volume'), **kwargs):
+        return super(Quote, self).read_from_url(url, field_name, **kwargs)
 
-    def read_from_api(self, api_fun):
-        raise NotImplementedError
+    def read_from_api(self, api_fun, field_name=('timestamp', 'open', 'high', 'low', 'close', 'volume'),
+                      append: bool=False):
+        return super(Quote, self).read_from_api(api_fun, field_name, append)
 
 
 class BidAsk(TickerBase):
     def __init__(self, quote_name: str, base_name: str):
         super(BidAsk, self).__init__(quote_name, base_name)
+        # (version of data, timestamps, ask minus bid)
+        self._spreads = None
+
+    def get_spreads(self):
+        """
+        Returns:
+            (timestamps, ask minus bid) as arrays, computed once per version of data.
+        """
+        if self._spreads is None or self._spreads[0] != self._version:
+            store = self._get_store()
+            self._spreads = (self._version, store.timestamps[:store.size].copy(),
+                             store.columns[TickerFields.Ask.value][:store.size] -
+                             store.columns[TickerFields.Bid.value][:store.size])
+        return self._spreads[1], self._spreads[2]
+
+    def get_closet_spread(self, timestamp: int) -> float:
+        """
+        Returns:
+            Ask minus bid at the closest timestamp, as get_closet_value.
+        """
+        timestamps, spreads = self.get_spreads()
+        if len(timestamps) == 0:
+            raise KeyError
+        idx = timestamps.searchsorted(timestamp)
+        if idx == len(timestamps):
+            idx -= 1
+        elif idx > 0:
+            if timestamps[idx] - timestamp > timestamp - timestamps[idx - 1]:
+                idx -= 1
+        return spreads[idx]
 
     def price_bid(self, timestamp: int):
         return self.get_value(timestamp, TickerFields.Bid)
@@ -170,17 +651,171 @@ class BidAsk(TickerBase):
     def read_from_csv(self, file_path: str, field_name=('timestamp', 'bid', 'ask', 'last')):
         super(BidAsk, self).read_from_csv(file_path, field_name)
 
-    def read_from_url(self, url: str):
-        raise NotImplementedError
+    def read_from_parquet(self, file_path: str, field_name=('timestamp', 'bid', 'ask', 'last'), start: int=None,
+                          end: int=None):
+        super(BidAsk, self).read_from_parquet(file_path, field_name, start, end)
+
+    def read_from_url(self, url: str, field_name=('timestamp', 'bid', 'ask', 'last'), **kwargs):
+        return super(BidAsk, self).read_from_url(url, field_name, **kwargs)
 
-    def read_from_api(self, api_fun):
-        raise NotImplementedError
+    def read_from_api(self, api_fun, field_name=('timestamp', 'bid', 'ask', 'last'), append: bool=False):
+        return super(BidAsk, self).read_from_api(api_fun, field_name, append)
+
+
+class TickerPanel(object):
+    def __init__(self, tickers: dict):
+        """
+        All tickers aligned onto one shared timestamp axis, which is the union of timestamps of every ticker. Each field
+        is stored as a 2-D array of shape (timestamp, symbol). Where a symbol has no data at a timestamp, i.e. it is not
+        listed at that time, the value is NaN and the listed mask is False.
+
+        Args:
+            tickers: Dictionary of form {symbol: ticker}.
+        """
+        self.symbols = sorted(tickers)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.quote_names = [tickers[symbol].quote_name for symbol in self.symbols]
+        self.base_names = [tickers[symbol].base_name for symbol in self.symbols]
+        self.versions = {}
+        # {symbol: (column store, number of its rows already in the panel)}
+        self._loaded = {}
+
+        stores = [tickers[symbol]._get_store() for symbol in self.symbols]
+        timestamps = [store.timestamps[:store.size] for store in stores if store is not None]
+        timestamps = np.unique(np.concatenate(timestamps)) if timestamps else np.empty(0, dtype=np.int64)
+
+        fields = []
+        for store in stores:
+            if store is not None:
+                fields += [field for field in store.columns if field not in fields]
+
+        self._size = 0
+        self._timestamps = np.empty(0, dtype=np.int64)
+        self._listed = np.zeros((0, len(self.symbols)), dtype=bool)
+        self._data = {field: np.full((0, len(self.symbols)), np.nan) for field in fields}
+        self.__append_rows(timestamps)
+
+        for column, symbol in enumerate(self.symbols):
+            self.__fill(column, stores[column], 0)
+            self.versions[symbol] = tickers[symbol].version
+
+    def __append_rows(self, timestamps: np.ndarray):
+        n = len(timestamps)
+        if self._size + n > len(self._timestamps):
+            capacity = max(2 * len(self._timestamps), self._size + n, 16)
+            self._timestamps = np.resize(self._timestamps, capacity)
+            listed = np.zeros((capacity, len(self.symbols)), dtype=bool)
+            listed[:self._size] = self._listed[:self._size]
+            self._listed = listed
+            for field in self._data:
+                values = np.full((capacity, len(self.symbols)), np.nan)
+                values[:self._size] = self._data[field][:self._size]
+                self._data[field] = values
+        self._timestamps[self._size:self._size + n] = timestamps
+        self._size += n
+
+        # public views on the filled rows
+        self.timestamps = self._timestamps[:self._size]
+        self.listed = self._listed[:self._size]
+        self.data = {field: self._data[field][:self._size] for field in self._data}
+
+    def __fill(self, column: int, store, start: int):
+        if store is None:
+            self._loaded[self.symbols[column]] = (None, 0)
+            return
+        rows = np.searchsorted(self.timestamps, store.timestamps[start:store.size])
+        self.listed[rows, column] = True
+        for field in store.columns:
+            if field in self.data and store.columns[field].dtype.kind == 'f':
+                self.data[field][rows, column] = store.columns[field][start:store.size]
+        self._loaded[self.symbols[column]] = (store, store.size)
+
+    def extend(self, tickers: dict) -> bool:
+        """
+        Append rows that tickers got appended since the panel was built, in O(new rows). This is only possible if the
+        symbols are the same, ticker data was only appended to, and all new rows are later than the last timestamp of
+        the panel.
+
+        Returns:
+            True if the panel is extended, False if it has to be rebuilt instead.
+        """
+        if sorted(tickers) != self.symbols:
+            return False
+
+        new_timestamps = []
+        changed = []
+        for column, symbol in enumerate(self.symbols):
+            if tickers[symbol].version == self.versions[symbol]:
+                continue
+            store, loaded = self._loaded[symbol]
+            if store is None or tickers[symbol]._get_store() is not store:
+                return False
+            if any(field not in self._data for field in store.columns):
+                return False
+            timestamps = store.timestamps[loaded:store.size]
+            if len(timestamps) and self._size and timestamps[0] <= self._timestamps[self._size - 1]:
+                return False
+            new_timestamps.append(timestamps)
+            changed.append((column, store, loaded))
+
+        if new_timestamps:
+            self.__append_rows(np.unique(np.concatenate(new_timestamps)))
+        for column, store, loaded in changed:
+            self.__fill(column, store, loaded)
+            self.versions[self.symbols[column]] = tickers[self.symbols[column]].version
+        return True
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def row(self, timestamp: int) -> int:
+        """
+        Returns:
+            Row index of timestamp on the shared axis, or -1 if no symbol has data at timestamp.
+        """
+        idx = np.searchsorted(self.timestamps, timestamp)
+        if idx < len(self.timestamps) and self.timestamps[idx] == timestamp:
+            return int(idx)
+        return -1
+
+    def get_listed(self, timestamp: int) -> np.ndarray:
+        """
+        Returns:
+            Boolean array over symbols, True if the symbol has data at timestamp.
+        """
+        idx = self.row(timestamp)
+        if idx < 0:
+            return np.zeros(len(self.symbols), dtype=bool)
+        return self.listed[idx]
+
+    def get_values(self, timestamp: int, field: TickerFields) -> np.ndarray:
+        """
+        Returns:
+            Array over symbols of field at timestamp, NaN for symbols without data.
+        """
+        assert isinstance(field, TickerFields)
+        idx = self.row(timestamp)
+        if idx < 0:
+            return np.full(len(self.symbols), np.nan)
+        return self.data[field.value][idx]
+
+    def get_value(self, timestamp: int, symbol: str, field: TickerFields):
+        """
+        Same as TickerBase.get_value of the ticker of symbol. KeyError is raised if there is no data.
+        """
+        assert isinstance(field, TickerFields)
+        idx = self.row(timestamp)
+        column = self.symbol_index[symbol]
+        if idx < 0 or not self.listed[idx, column] or field.value not in self.data:
+            raise KeyError
+        return self.data[field.value][idx, column]
 
 
 class TickersBase(object):
     def __init__(self, ticker_type: str):
         self._tickers = {}
         self._ticker_type = ticker_type
+        self._panel = None
         
     def __getitem__(self, name: str):
         return self.get_ticker(name)
@@ -200,6 +835,33 @@ class TickersBase(object):
     def get_symbols(self):
         return self._tickers.keys()
 
+    def refresh(self) -> int:
+        """
+        Refresh every ticker from its source, see TickerBase.refresh. A cached panel is extended in place with the new
+        rows where possible.
+
+        Returns:
+            Total number of appended rows.
+        """
+        appended = 0
+        for symbol in self._tickers:
+            appended += self._tickers[symbol].refresh()
+        return appended
+
+    def get_panel(self) -> TickerPanel:
+        """
+        Returns:
+            All tickers aligned as a TickerPanel. The panel is built once and cached until tickers are added or the
+            data of any ticker changes.
+        """
+        if self._panel is not None and any(self._panel.versions.get(symbol) != self._tickers[symbol].version
+                                           for symbol in self._tickers):
+            if not self._panel.extend(self._tickers):
+                self._panel = None
+        if self._panel is None:
+            self._panel = TickerPanel(self._tickers)
+        return self._panel
+
     def get_assets(self):
         assets = set()
         for quote in self._tickers:
@@ -208,6 +870,18 @@ class TickersBase(object):
         return assets
 
     def add_tickers_csv(self, directory_name: str, pattern: str='(\w+)[-.,_](\w+).csv'):
+        self.__add_tickers_file(directory_name, pattern, lambda ticker, file_path: ticker.read_from_csv(file_path))
+
+    def add_tickers_parquet(self, directory_name: str, pattern: str='(\w+)[-.,_](\w+).parquet', start: int=None,
+                            end: int=None):
+        """
+        Add tickers from parquet files (or directories of parquet files) in directory_name whose names match pattern.
+        Only rows with timestamp in [start, end] are loaded.
+        """
+        self.__add_tickers_file(directory_name, pattern,
+                                lambda ticker, file_path: ticker.read_from_parquet(file_path, start=start, end=end))
+
+    def __add_tickers_file(self, directory_name: str, pattern: str, read):
         for file in os.listdir(directory_name):
             match_obj = re.match(pattern, file)
             if match_obj:
@@ -218,22 +892,65 @@ class TickersBase(object):
                     print("[Tickers] Asset {:s} has been already added, now overwritten. ".format(symbol))
                 # extra_info has to be a file path for CSVs
                 self._tickers[symbol] = globals()[self._ticker_type](quote_name, base_name)
-                self._tickers[symbol].read_from_csv(directory_name + file)
+                read(self._tickers[symbol], directory_name + file)
+                self._panel = None
             else:
                 print("[Ticker] Not able to parse " + file)
 
+    def write_tickers_parquet(self, directory_name: str):
+        """
+        Write every ticker to directory_name as QUOTE-BASE.parquet, which can be read back by add_tickers_parquet.
+        """
+        if not os.path.exists(directory_name):
+            os.makedirs(directory_name)
+        for symbol in self._tickers:
+            ticker = self._tickers[symbol]
+            ticker.write_parquet(os.path.join(directory_name, ticker.quote_name + '-' + ticker.base_name + '.parquet'))
+
 
 class Quotes(TickersBase):
     def __init__(self):
         super(Quotes, self).__init__("Quote")
+        # {(interval, origin): resampled quotes}
+        self._resampled = {}
+
+    def resample(self, interval: int, origin: int=0):
+        """
+        Resample every quote to bars of interval milliseconds, see Quote.resample. The result is cached per timeframe,
+        and quotes are only recomputed for tickers whose data changed.
 
-    def add_tickers_exchange(self, exchange_name: str, timeframe: str='1d', pattern: str='(\w+)/(\w+)', path: str=''):
+        Returns:
+            A new Quotes of resampled bars.
+        """
+        quotes = self._resampled.get((interval, origin))
+        if quotes is None or set(quotes._tickers) != set(self._tickers):
+            quotes = Quotes()
+            self._resampled[(interval, origin)] = quotes
+        for symbol in self._tickers:
+            ticker = self._tickers[symbol].resample(interval, origin)
+            if quotes._tickers.get(symbol) is not ticker:
+                quotes._tickers[symbol] = ticker
+                quotes._panel = None
+        return quotes
+
+    def add_tickers_exchange(self, exchange_name: str, timeframe: str='1d', pattern: str='(\w+)/(\w+)', path: str='',
+                             markets=None):
         exchange = getattr(ccxt, exchange_name)()
         if not exchange.has['fetchOHLCV']:
             print("Exchange doesn't support fetching OHLCV! ")
             return
 
-        markets = exchange.loadMarkets()
+        if markets is None:
+            exchange.loadMarkets()
+        # a market cache, e.g. api.markets.shared_cache(path), requests markets once per ttl for all data pipelines
+        elif not markets.load(exchange):
+            try:
+                markets.fetch(exchange)
+            except (ExchangeError, NetworkError):
+                if not markets.load(exchange, stale=True):
+                    raise
+                print("[Tickers] Fail to load markets, use markets cached {:.0f}s ago".format(markets.age(exchange.id)))
+        markets = exchange.markets
         directory = ''
         if path != '':
             directory = path + exchange_name + '/'
@@ -250,6 +967,7 @@ class Quotes(TickersBase):
                     print("[Tickers] Asset {:s} has been already added, now overwritten. ".format(symbol))
                 # extra_info has to be a file path for CSVs
                 self._tickers[symbol] = Quote(quote_name, base_name)
+                self._panel = None
 
                 for attempt in range(N_RETRY):
                     try:
@@ -260,7 +978,7 @@ class Quotes(TickersBase):
                             filename = directory + symbol.translate({ord(c): '-' for c in '!@#$/'}) + '.csv'
                             with open(filename, 'a+', newline='') as file:
                                 writer = csv.writer(file)
-                                writer.writerow(['timestamp', 'open', 'high', 'low', 'closing', 'volume'])
+                                writer.writerow(['timestamp', 'open', 'high', 'low', 'close', 'volume'])
 
                             with open(filename, 'a+', newline='') as file:
                                 writer = csv.writer(file)
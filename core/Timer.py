@@ -1,5 +1,9 @@
 # to do: pytz support
 
+import copy
+import heapq
+import numpy as np
+
 
 class Timer(object):
     def __init__(self, start_time: int, end_time: int, ticker_size: int):
@@ -12,9 +16,96 @@ class Timer(object):
     def time(self):
         return self._current_time
 
+    def remaining(self) -> int:
+        """
+        Returns:
+            Number of steps left before the end.
+        """
+        return max((self._end_time - self._current_time) // self._step, 0)
+
     def next(self) -> bool:
         self._current_time += self._step
         if self._current_time > self._end_time:
             return True
         else:
             return False
+
+
+class EventTimer(Timer):
+    def __init__(self, start_time: int, end_time: int, timestamps=(), ticker_size: int=0):
+        """
+        Timer that jumps straight to the next timestamp where something can happen, instead of stepping through
+        intervals without data. Events are data timestamps, e.g. the union of timestamps of all tickers, plus events
+        added while running, e.g. by pending orders.
+
+        Args:
+            start_time: Time before the first step.
+            end_time: Last time, inclusive.
+            timestamps: Iterable of event timestamps, in any order and with duplicates.
+            ticker_size: Max step. Defaults to 0, i.e. steps only to events.
+        """
+        super(EventTimer, self).__init__(start_time, end_time, ticker_size)
+        timestamps = np.unique(np.asarray(list(timestamps) if not isinstance(timestamps, np.ndarray) else timestamps,
+                                          dtype=np.int64))
+        self._events = timestamps[(timestamps > start_time) & (timestamps <= end_time)]
+        self._cursor = 0
+        # events added after the timer is built
+        self._added = []
+
+    def __deepcopy__(self, memo: dict):
+        # events are never modified, copies share them
+        timer = copy.copy(self)
+        timer._added = list(self._added)
+        memo[id(self)] = timer
+        return timer
+
+    @classmethod
+    def from_tickers(cls, start_time: int, end_time: int, *tickers, ticker_size: int=0):
+        """
+        Timer over the union of timestamps of tickers, e.g. Quotes and BidAsks.
+        """
+        timestamps = [tickers_.get_panel().timestamps for tickers_ in tickers]
+        timestamps = np.concatenate(timestamps) if timestamps else np.empty(0, dtype=np.int64)
+        return cls(start_time, end_time, timestamps, ticker_size)
+
+    def add_event(self, timestamp: int):
+        """
+        Make the timer stop at timestamp. Events not later than the current time or after end time are ignored.
+        """
+        if self._current_time < timestamp <= self._end_time:
+            heapq.heappush(self._added, int(timestamp))
+
+    def peek(self):
+        """
+        Returns:
+            Time of the next step, or None if there is none.
+        """
+        candidates = []
+        if self._cursor < len(self._events):
+            candidates.append(int(self._events[self._cursor]))
+        if self._added:
+            candidates.append(self._added[0])
+        if self._step and self._current_time + self._step <= self._end_time:
+            candidates.append(self._current_time + self._step)
+        return min(candidates) if candidates else None
+
+    def remaining(self) -> int:
+        """
+        Returns:
+            Number of events left before the end, steps capped by ticker_size excluded.
+        """
+        return len(self._events) - self._cursor + len(self._added)
+
+    def next(self) -> bool:
+        next_time = self.peek()
+        if next_time is None:
+            # past the end, as Timer
+            self._current_time = self._end_time + max(self._step, 1)
+            return True
+
+        self._current_time = next_time
+        while self._cursor < len(self._events) and self._events[self._cursor] <= next_time:
+            self._cursor += 1
+        while self._added and self._added[0] <= next_time:
+            heapq.heappop(self._added)
+        return False
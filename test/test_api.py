@@ -0,0 +1,649 @@
+import unittest
+import tempfile
+import os
+import threading
+import time
+import numpy as np
+
+from ccxt.base.errors import DDoSProtection, RequestTimeout, ExchangeNotAvailable, NetworkError
+
+import pyarrow.parquet as pq
+
+from api.storage import CsvStorage, ParquetStorage, OrderBookStorage
+from api.binance import Binance
+from api.pool import TokenBucket, FetchPool
+from api.backfill import Backfill, find_gaps
+from api.coinmarketcap import CoinMarketCap
+from api.daemon import Collector, make_collector
+from api.markets import MarketCache
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import hashlib
+import json
+from api.errors import TimestampError, FetchError
+from core.Ticker import Quote, BidAsk, TickerFields
+
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name + '/'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_csv_storage(self):
+        storage = CsvStorage(self.path)
+        fieldnames = ['timestamp', 'bid', 'ask', 'last']
+        self.assertIsNone(storage.last_timestamp('XRP/ETH'))
+
+        storage.append('XRP/ETH', fieldnames, [[1000, 1.0, 1.1, 1.05]])
+        storage.append('XRP/ETH', fieldnames, [[2000, 1.1, 1.2, 1.15], [3000, 1.2, 1.3, 1.25]])
+        self.assertEqual(storage.last_timestamp('XRP/ETH'), 3000)
+        storage.flush()
+
+        bidask = BidAsk('XRP', 'ETH')
+        bidask.read_from_csv(storage.filename('XRP/ETH'))
+        self.assertEqual(bidask.price_ask(2000), 1.2)
+
+    def test_parquet_storage(self):
+        storage = ParquetStorage(self.path)
+        fieldnames = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+        self.assertIsNone(storage.last_timestamp('XRP/ETH'))
+
+        storage.append('XRP/ETH', fieldnames, [[1000, 1, 2, 0.5, 1.5, 10], [2000, 1.5, 2.5, 1, 2, 20]])
+        storage.append('XRP/ETH', fieldnames, [[3000, 2, 3, 1.5, 2.5, 30]])
+        self.assertEqual(storage.last_timestamp('XRP/ETH'), 3000)
+        self.assertRaises(TimestampError, storage.append, 'XRP/ETH', fieldnames, [[3000, 2, 3, 1.5, 2.5, 30]])
+        storage.flush()
+
+        quote = Quote('XRP', 'ETH')
+        quote.read_from_parquet(storage.filename('XRP/ETH'), start=2000)
+        self.assertEqual(quote.price_close(3000), 2.5)
+        self.assertRaises(KeyError, quote.get_value, 1000, TickerFields.Close)
+
+    def test_buffered_writes(self):
+        fieldnames = ['timestamp', 'bid', 'ask', 'last']
+        with CsvStorage(self.path, buffer_size=4, max_open=2) as storage:
+            for symbol in ('A/BTC', 'B/BTC', 'C/BTC'):
+                storage.append(symbol, fieldnames, [[1000, 1.0, 1.1, 1.05]])
+            self.assertFalse(os.path.exists(storage.filename('A/BTC')))
+            self.assertTrue(storage.exists('A/BTC'))
+
+            # the fourth row triggers a flush, and only max_open handles stay open
+            storage.append('A/BTC', fieldnames, [[2000, 1.1, 1.2, 1.15]])
+            self.assertEqual(len(storage._files), 2)
+            self.assertEqual(storage.timestamps('A/BTC').tolist(), [1000, 2000])
+
+            storage.append('A/BTC', fieldnames, [[3000, 1.2, 1.3, 1.25]])
+            self.assertEqual(storage.last_timestamp('A/BTC'), 3000)
+        self.assertEqual(storage._files, {})
+
+        # a new storage reads the last timestamp from disk
+        self.assertEqual(CsvStorage(self.path).last_timestamp('A/BTC'), 3000)
+        bidask = BidAsk('A', 'BTC')
+        bidask.read_from_csv(storage.filename('A/BTC'))
+        self.assertEqual(bidask.price_ask(3000), 1.3)
+
+        storage = ParquetStorage(self.path, buffer_size=100)
+        for t in range(10):
+            storage.append('A/BTC', fieldnames, [[t, 1.0, 1.1, 1.05]])
+        storage.close()
+        self.assertEqual(len(os.listdir(storage.filename('A/BTC'))), 1)
+
+    def snapshots(self, n):
+        books = []
+        for t in range(n):
+            asks = [[1.0 + 0.01 * (i + t % 3), 5.0 + i] for i in range(4 + t % 2)]
+            bids = [[0.99 - 0.01 * i, 2.0 + t] for i in range(3)]
+            books.append([1000 * (t + 1), asks, bids])
+        return books
+
+    def check_books(self, storage, books, start=None, end=None):
+        timestamps, asks, bids = storage.read('XRP/ETH', start, end)
+        books = [book for book in books if (start is None or book[0] >= start) and (end is None or book[0] <= end)]
+        self.assertEqual(timestamps.tolist(), [book[0] for book in books])
+        for i, book in enumerate(books):
+            np.testing.assert_array_equal(asks[i, :len(book[1])], book[1])
+            np.testing.assert_array_equal(bids[i, :len(book[2])], book[2])
+            self.assertTrue(np.isnan(asks[i, len(book[1]):]).all())
+
+    def test_binary_order_book(self):
+        books = self.snapshots(20)
+        storage = OrderBookStorage(self.path, depth=5, keyframe_interval=3)
+        for book in books[:15]:
+            storage.append('XRP/ETH', ['timestamp', 'asks', 'bids'], [book])
+            storage.flush()
+        self.assertRaises(TimestampError, storage.append, 'XRP/ETH', ['timestamp', 'asks', 'bids'], [books[0]])
+
+        # a new storage appends to the existing file from a keyframe
+        storage = OrderBookStorage(self.path, depth=5, keyframe_interval=3)
+        storage.append('XRP/ETH', ['timestamp', 'asks', 'bids'], books[15:])
+        self.assertEqual(storage.last_timestamp('XRP/ETH'), 20000)
+        self.check_books(storage, books)
+        self.check_books(storage, books, start=5500, end=11000)
+        self.check_books(storage, books, start=19000)
+        self.assertEqual(storage.timestamps('XRP/ETH').tolist(), [book[0] for book in books])
+
+        # deeper levels are dropped
+        _, asks, _ = storage.read('XRP/ETH', 1000, 1000)
+        self.assertEqual(asks.shape, (1, 5, 2))
+
+        deeper = OrderBookStorage(self.path, depth=10)
+        deeper.append('XRP/ETH', ['timestamp', 'asks', 'bids'], [[30000, [], []]])
+        self.assertRaises(ValueError, deeper.flush)
+
+        raw = OrderBookStorage(self.path + 'raw/', depth=5, delta=False, compression_level=0)
+        raw.append('XRP/ETH', ['timestamp', 'asks', 'bids'], books)
+        self.check_books(raw, books, start=2000, end=3000)
+        self.assertLess(os.path.getsize(storage.filename('XRP/ETH')), os.path.getsize(raw.filename('XRP/ETH')))
+
+    def test_parquet_order_book(self):
+        storage = ParquetStorage(self.path)
+        storage.append('XRP/ETH', ['timestamp', 'asks', 'bids'], [[1000, [[1.1, 5], [1.2, 3]], [[1.0, 2]]]])
+        storage.flush()
+        table = pq.read_table(storage.filename('XRP/ETH'))
+        self.assertEqual(table.column('asks').to_pylist(), [[[1.1, 5.0], [1.2, 3.0]]])
+
+
+
+class FakeExchange(object):
+    """
+    Local stand-in for a ccxt exchange, which records concurrency and fails some requests once.
+    """
+    id = 'fake'
+    rateLimit = 1
+
+    def __init__(self, symbols, failures=(), now=5 * 60000, holes=(), offline=False):
+        self.symbols = list(symbols)
+        self.markets = {}
+        self.currencies = {}
+        self.offline = offline
+        self.market_requests = 0
+        self.now = now
+        self.holes = set(holes)
+        self.failures = dict(failures)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def load_markets(self, reload=False):
+        if self.markets and not reload:
+            return self.markets
+        self.market_requests += 1
+        if self.offline:
+            raise ExchangeNotAvailable('fake')
+        return self.set_markets([{'symbol': symbol} for symbol in self.symbols])
+
+    def set_markets(self, markets, currencies=None):
+        markets = markets.values() if isinstance(markets, dict) else markets
+        self.markets = {market['symbol']: market for market in markets}
+        self.currencies = currencies or {}
+        return self.markets
+
+    def __request(self, symbol):
+        with self.lock:
+            self.calls.append(symbol)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failure = self.failures.pop(symbol, None)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        if failure is not None:
+            raise failure('fake')
+
+    def fetch_ohlcv(self, symbol, interval, since=None, limit=5):
+        self.__request(symbol)
+        if since is None:
+            since = self.now - limit * 60000
+        return [[t, 1.0, 2.0, 0.5, t / 60000, 10.0] for t in range(since, min(since + limit * 60000, self.now), 60000)
+                if t not in self.holes]
+
+    def fetchOrderBook(self, symbol, params):
+        self.__request(symbol)
+        return {'timestamp': 1000, 'asks': [[1.1, 2.0]], 'bids': [[1.0, 3.0]]}
+
+
+class CollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name + '/'
+        self.symbols = ['S' + str(i) + '/BTC' for i in range(12)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_token_bucket(self):
+        now, slept = [0.0], []
+        bucket = TokenBucket(10, 2, clock=lambda: now[0], sleep=slept.append)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(slept, [])
+        bucket.acquire()
+        self.assertAlmostEqual(slept[0], 0.1)
+        now[0] = 1
+        bucket.acquire(2)
+        self.assertEqual(len(slept), 1)
+
+    def test_concurrent_fetch(self):
+        exchange = FakeExchange(self.symbols, {'S3/BTC': DDoSProtection, 'S5/BTC': RequestTimeout})
+        binance = Binance(self.path, ddos_cooldown=0.05, max_in_flight=4, exchange=exchange)
+        binance.fetch_ohlcv()
+
+        self.assertEqual(sorted(binance.last_ohlcv), sorted(self.symbols))
+        self.assertEqual(len(exchange.calls), len(self.symbols) + 2)
+        self.assertLessEqual(exchange.max_in_flight, 4)
+        self.assertGreater(exchange.max_in_flight, 1)
+        # the symbol in cool down doesn't stall the others
+        self.assertEqual(exchange.calls[-1], 'S3/BTC')
+
+        quote = Quote('S3', 'BTC')
+        quote.read_from_csv(binance.storage['OHLCV'].filename('S3/BTC'))
+        self.assertEqual(quote.price_close(60000 * 4), 4)
+
+    def test_binary_order_book(self):
+        exchange = FakeExchange(self.symbols[:2])
+        binance = Binance(self.path, orderbook_storage='book', exchange=exchange)
+        binance.fetch_order_book()
+        timestamps, asks, bids = binance.storage['orderbook'].read('S1/BTC')
+        self.assertEqual(timestamps.tolist(), [1000])
+        self.assertEqual(asks[0, 0].tolist(), [1.1, 2.0])
+
+    def test_callback_failure(self):
+        pool = FetchPool(TokenBucket(1000, 10), max_in_flight=4)
+
+        def callback(key, result):
+            if key == 'S1/BTC':
+                raise TimestampError('fake')
+            saved.append(key)
+        saved = []
+        results, failed = pool.run(lambda key: key, self.symbols[:4], callback=callback)
+        # the failed callback doesn't abort the other symbols
+        self.assertEqual(failed, ['S1/BTC'])
+        self.assertEqual(sorted(results), sorted(saved))
+        self.assertEqual(sorted(saved), ['S0/BTC', 'S2/BTC', 'S3/BTC'])
+
+    def test_network_error(self):
+        exchange = FakeExchange(self.symbols[:3], {'S1/BTC': NetworkError})
+        binance = Binance(self.path, retry=2, ddos_cooldown=0, exchange=exchange)
+        # a plain network error, e.g. a connection reset, is retried like the other transient errors
+        binance.fetch_order_book()
+        self.assertEqual(sorted(binance.last_order_book), self.symbols[:3])
+        self.assertEqual(exchange.calls.count('S1/BTC'), 2)
+
+    def test_retry_exhausted(self):
+        exchange = FakeExchange(self.symbols[:2], {'S0/BTC': DDoSProtection})
+        binance = Binance(self.path, retry=1, ddos_cooldown=0, exchange=exchange)
+        binance.fetch_order_book()
+        self.assertEqual(list(binance.last_order_book), ['S1/BTC'])
+
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name + '/'
+        self.fieldnames = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find_gaps(self):
+        self.assertEqual(find_gaps(np.array([2, 3, 6, 7]), 1, 0, 10), [(0, 2), (4, 6), (8, 10)])
+        self.assertEqual(find_gaps(np.array([0, 1, 2]), 1, 0, 3), [])
+        self.assertEqual(find_gaps(np.array([], dtype=np.int64), 1, 0, 3), [(0, 3)])
+
+    def check_history(self, binance, symbol, end):
+        quote = Quote('ETH', 'BTC')
+        quote.read_from_csv(binance.storage['OHLCV'].filename(symbol))
+        np.testing.assert_array_equal(quote._data.index, np.arange(0, end, 60000))
+        self.assertEqual(quote.price_close(60000 * 7), 7)
+
+    def test_backfill(self):
+        exchange = FakeExchange(['ETH/BTC'], now=40 * 60000)
+        binance = Binance(self.path, exchange=exchange)
+        storage = binance.storage['OHLCV']
+        storage.append('ETH/BTC', self.fieldnames, [[t * 60000, 1.0, 2.0, 0.5, t, 10.0] for t in (5, 6, 12, 30)])
+
+        saved = binance.backfill_ohlcv(start=0, end=40 * 60000, symbols=['ETH/BTC'], limit=10)
+        self.assertEqual(saved, {'ETH/BTC': 36})
+        self.check_history(binance, 'ETH/BTC', 40 * 60000)
+
+        # nothing is missing on a second run
+        calls = len(exchange.calls)
+        self.assertEqual(binance.backfill_ohlcv(end=40 * 60000, symbols=['ETH/BTC']), {'ETH/BTC': 0})
+        self.assertEqual(len(exchange.calls), calls)
+
+    def test_empty_ranges(self):
+        holes = [t * 60000 for t in list(range(10, 14)) + list(range(36, 40))]
+        exchange = FakeExchange(['ETH/BTC'], now=40 * 60000, holes=holes)
+        binance = Binance(self.path, exchange=exchange)
+        saved = binance.backfill_ohlcv(start=0, end=40 * 60000, symbols=['ETH/BTC'], limit=10)
+        self.assertEqual(saved, {'ETH/BTC': 32})
+
+        # the hole before the last candle is not fetched again, the trailing one may not be published yet
+        backfill = Backfill(exchange, binance.storage['OHLCV'], binance.pool, limit=10)
+        self.assertEqual(backfill.empty, {'ETH/BTC': [(10 * 60000, 14 * 60000)]})
+        self.assertEqual(backfill.plan(['ETH/BTC'], 0, 40 * 60000), {'ETH/BTC': [(36 * 60000, 40 * 60000)]})
+
+    def test_failed_save(self):
+        exchange = FakeExchange(['ETH/BTC'], now=40 * 60000)
+        binance = Binance(self.path, exchange=exchange)
+        storage = binance.storage['OHLCV']
+        storage.append('ETH/BTC', self.fieldnames, [[t * 60000, 1.0, 2.0, 0.5, t, 10.0] for t in (30, 39)])
+        storage.flush()
+
+        def insert(*args):
+            raise IOError('disk full')
+        storage.insert = insert
+        # candles that failed to save are not taken as missing on the exchange
+        backfill = Backfill(exchange, storage, binance.pool, limit=10)
+        self.assertEqual(backfill.run(['ETH/BTC'], 0, 40 * 60000), {'ETH/BTC': 0})
+        self.assertEqual(backfill.empty, {})
+
+        del storage.insert
+        self.assertEqual(backfill.run(['ETH/BTC'], 0, 40 * 60000), {'ETH/BTC': 38})
+        self.check_history(binance, 'ETH/BTC', 40 * 60000)
+
+    def test_missed_run(self):
+        exchange = FakeExchange(['ETH/BTC'], now=5 * 60000)
+        binance = Binance(self.path, exchange=exchange)
+        binance.fetch_ohlcv()
+        exchange.now = 30 * 60000
+        binance.fetch_ohlcv()
+        self.check_history(binance, 'ETH/BTC', 30 * 60000)
+
+    def test_parquet_insert(self):
+        storage = ParquetStorage(self.path)
+        storage.append('ETH/BTC', self.fieldnames, [[t, 1.0, 2.0, 0.5, t, 10.0] for t in (0, 1, 5, 9)])
+        storage.insert('ETH/BTC', self.fieldnames, [[t, 1.0, 2.0, 0.5, t, 10.0] for t in range(8)])
+        np.testing.assert_array_equal(storage.timestamps('ETH/BTC'), [0, 1, 2, 3, 4, 5, 6, 7, 9])
+        self.assertEqual(storage.last_timestamp('ETH/BTC'), 9)
+
+        quote = Quote('ETH', 'BTC')
+        quote.read_from_parquet(storage.filename('ETH/BTC'))
+        self.assertEqual(quote.price_close(7), 7)
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the coinmarketcap ticker listing, with ETag validation and keep-alive.
+    """
+    protocol_version = 'HTTP/1.1'
+    coins = []
+    requests = []
+    in_flight = [0, 0]      # current, max
+    status = 200            # any other status answers an HTML error page, or nothing for 304
+    lock = threading.Lock()
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        start, limit = int(query['start'][0]), int(query['limit'][0])
+        body = json.dumps(self.coins[start:start + limit]).encode()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        with self.lock:
+            self.requests.append((start, self.client_address[1]))
+            self.in_flight[0] += 1
+            self.in_flight[1] = max(self.in_flight)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight[0] -= 1
+
+        if self.status != 200:
+            page = b'' if self.status == 304 else b'<html>Service Unavailable</html>'
+            self.send_response(self.status)
+            self.send_header('Content-Length', str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+            return
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CoinMarketCapTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        ListingHandler.coins = [self.coin(i, 1000) for i in range(250)]
+        ListingHandler.requests = []
+        ListingHandler.in_flight = [0, 0]
+        ListingHandler.status = 200
+        self.server = ThreadingServer(('127.0.0.1', 0), ListingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{:d}/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    @staticmethod
+    def coin(i, last_updated):
+        return {'symbol': 'C' + str(i), 'last_updated': str(last_updated), 'rank': str(i + 1),
+                'available_supply': '100.0', 'market_cap_usd': '1000.0', '24h_volume_usd': '50.0',
+                'percent_change_7d': '1.5', 'percent_change_24h': '-0.5', 'percent_change_1h': None,
+                'price_usd': '10.0', 'price_btc': '0.001'}
+
+    def test_listing(self):
+        cmc = CoinMarketCap(self.directory.name, max_in_flight=3, base_url=self.url)
+        cmc.fetch_volume(page_size=100)
+        self.assertEqual(len(cmc.last_volume), 250)
+        self.assertEqual(sorted(start for start, _ in ListingHandler.requests)[:3], [0, 100, 200])
+        self.assertGreater(ListingHandler.in_flight[1], 1)
+        self.assertLessEqual(ListingHandler.in_flight[1], 3)
+        self.assertEqual(cmc.storage.timestamps('C42').tolist(), [1000000])
+
+        # unchanged pages are not downloaded nor written again, changed ones are
+        ListingHandler.coins[120] = self.coin(120, 2000)
+        changed = []
+        append = cmc.storage.append
+        cmc.storage.append = lambda symbol, *args: changed.append(symbol) or append(symbol, *args)
+        cmc.fetch_volume(page_size=100)
+        self.assertEqual(changed, ['C120'])
+        self.assertEqual(cmc.storage.timestamps('C120').tolist(), [1000000, 2000000])
+        # connections are kept alive and reused
+        self.assertLessEqual(len(set(port for _, port in ListingHandler.requests)), 3)
+
+        # a single page request
+        cmc.fetch_volume(params={'start': 0, 'limit': 10})
+        self.assertEqual(len(cmc.last_volume), 250)
+
+    def test_listing_failed_page(self):
+        cmc = CoinMarketCap(self.directory.name, retry=1, base_url=self.url)
+        request = cmc.request
+        failures = {100: 1}
+
+        def flaky_request(endpoint, params):
+            if failures.get(params['start']):
+                failures[params['start']] -= 1
+                return None, False
+            return request(endpoint, params)
+        cmc.request = flaky_request
+
+        # a transient failure is sent again, and doesn't end the listing
+        self.assertEqual(cmc.fetch_volume(page_size=100), 250)
+        self.assertEqual(cmc.failed_pages, [])
+
+        # a page failing again is reported, the rest of the listing is still saved
+        cmc.last_volume = {}
+        failures[100] = 2
+        self.assertRaises(FetchError, cmc.fetch_volume, page_size=100)
+        self.assertEqual(cmc.failed_pages, [100])
+        self.assertEqual(len(cmc.last_volume), 150)
+        self.assertIn('C220', cmc.last_volume)
+
+
+    def test_listing_outage(self):
+        cmc = CoinMarketCap(self.directory.name, retry=1, max_in_flight=3, base_url=self.url)
+        ListingHandler.status = 503
+        # the listing is given up after a window of failed pages instead of sending new offsets forever
+        self.assertRaises(FetchError, cmc.fetch_volume, page_size=100)
+        self.assertLessEqual(len(ListingHandler.requests), 6)
+        self.assertGreater(len(cmc.failed_pages), 0)
+        self.assertEqual(cmc.last_volume, {})
+
+        # a closed port fails the same way
+        port = self.server.server_address[1]
+        self.tearDown()
+        self.directory = tempfile.TemporaryDirectory()
+        cmc = CoinMarketCap(self.directory.name, retry=1, base_url='http://127.0.0.1:{:d}/'.format(port))
+        self.assertRaises(FetchError, cmc.fetch_volume, page_size=100)
+
+        # a 304 without cached data is a failed request
+        self.setUp()
+        cmc = CoinMarketCap(self.directory.name, retry=1, base_url=self.url)
+        ListingHandler.status = 304
+        self.assertEqual(cmc.request('/ticker/', {'start': 0, 'limit': 10}), (None, False))
+
+
+class CollectorDaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.now = [1000.0]
+        self.collector = Collector(clock=lambda: self.now[0], sleep=self.sleep, seed=1)
+
+    def sleep(self, seconds):
+        self.now[0] += seconds
+
+    def test_schedule(self):
+        runs = {'fast': [], 'slow': [], 'flaky': []}
+
+        def fast():
+            runs['fast'].append(self.now[0])
+            return 3
+
+        def slow():
+            runs['slow'].append(self.now[0])
+            self.now[0] += 15
+
+        def flaky():
+            runs['flaky'].append(self.now[0])
+            if len(runs['flaky']) == 1:
+                raise RuntimeError('timeout')
+
+        self.collector.add_job('fast', fast, 20, jitter=1)
+        self.collector.add_job('slow', slow, 10)
+        self.collector.add_job('flaky', flaky, 30)
+        self.collector.run(duration=60)
+
+        # jitter delays runs within bounds, and doesn't accumulate
+        for i, t in enumerate(runs['fast'][:3]):
+            self.assertGreaterEqual(t, 1000 + 20 * i)
+        # a job overrunning its interval skips the missed grid points
+        self.assertEqual(runs['slow'][:2], [1000, 1020])
+        self.assertGreater(self.collector.jobs['slow'].missed, 0)
+
+        health = self.collector.health()
+        self.assertEqual(health['jobs']['flaky']['failures'], 1)
+        self.assertEqual(health['jobs']['flaky']['runs'], 2)
+        self.assertIn('timeout', health['jobs']['flaky']['last_error'][1])
+        self.assertEqual(health['jobs']['fast']['items'], 3 * len(runs['fast']))
+        self.assertTrue(health['healthy'])
+
+        # no success for more than two intervals is unhealthy
+        self.now[0] += 100
+        self.assertFalse(self.collector.health()['healthy'])
+
+    def test_stop(self):
+        self.collector.add_job('stop', self.collector.stop, 5)
+        self.collector.run()
+        self.assertEqual(self.collector.jobs['stop'].runs, 1)
+
+    def test_binance_collector(self):
+        directory = tempfile.TemporaryDirectory()
+        exchange = FakeExchange(['S0/BTC', 'S1/BTC'])
+        exchange.fetch_tickers = lambda: {'S0/BTC': {'timestamp': exchange.now, 'bid': 1, 'ask': 2, 'last': 1.5}}
+        binance = Binance(directory.name + '/', exchange=exchange)
+        collector = make_collector(binance, ohlcv=60, bid_ask=0, order_book=60, jitter=0)
+        self.assertEqual(sorted(collector.jobs), ['ohlcv', 'order_book'])
+        collector.run_pending()
+        self.assertEqual(collector.health()['jobs']['ohlcv']['items'], 2)
+        self.assertEqual(collector.health()['jobs']['order_book']['items'], 2)
+        directory.cleanup()
+
+    def test_binance_collector_offline(self):
+        directory = tempfile.TemporaryDirectory()
+        exchange = FakeExchange(['S0/BTC'], offline=True)
+        binance = Binance(directory.name + '/', retry=1, exchange=exchange)
+        collector = make_collector(binance, ohlcv=60, bid_ask=10, order_book=0, jitter=0)
+        collector.run_pending()
+        # nothing is collected, so nothing counts as a success
+        health = collector.health()
+        for name in ('ohlcv', 'bid_ask'):
+            self.assertEqual(health['jobs'][name]['failures'], 1)
+            self.assertIsNone(health['jobs'][name]['last_success'])
+            self.assertIn('FetchError', health['jobs'][name]['last_error'][1])
+        self.assertFalse(health['healthy'])
+        directory.cleanup()
+
+
+class MarketCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name + '/'
+        self.now = [0.0]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_shared_ttl(self):
+        cache = MarketCache(self.path, ttl=10, clock=lambda: self.now[0])
+        exchange = FakeExchange(['ETH/BTC', 'XRP/BTC'])
+        first = Binance(self.path, exchange=exchange, markets=cache)
+        second = Binance(self.path, exchange=FakeExchange(['ETH/BTC']), markets=cache)
+
+        self.assertTrue(first.load_markets())
+        self.assertTrue(first.load_markets())
+        self.assertTrue(second.load_markets())
+        self.assertEqual(exchange.market_requests, 1)
+        self.assertEqual(second.exchange.market_requests, 0)
+        self.assertEqual(sorted(second.exchange.markets), ['ETH/BTC', 'XRP/BTC'])
+
+        self.now[0] = 10
+        self.assertTrue(first.load_markets())
+        self.assertEqual(exchange.market_requests, 2)
+
+    def test_offline_cold_start(self):
+        MarketCache(self.path, clock=lambda: self.now[0]).fetch(FakeExchange(['ETH/BTC']))
+        self.assertTrue(os.path.exists(self.path + 'fake/markets.json'))
+
+        # fresh snapshot, no request
+        exchange = FakeExchange(['ETH/BTC'], offline=True)
+        binance = Binance(self.path, retry=1, exchange=exchange, markets=MarketCache(self.path, ttl=10,
+                                                                                  clock=lambda: self.now[0]))
+        self.assertTrue(binance.load_markets())
+        self.assertEqual(exchange.market_requests, 0)
+        self.assertEqual(list(exchange.markets), ['ETH/BTC'])
+
+        # stale snapshot, used when markets can't be requested
+        self.now[0] = 100
+        exchange = FakeExchange([], offline=True)
+        binance = Binance(self.path, retry=1, exchange=exchange, markets=MarketCache(self.path, ttl=10,
+                                                                                  clock=lambda: self.now[0]))
+        self.assertTrue(binance.load_markets())
+        self.assertEqual(exchange.market_requests, 1)
+        self.assertEqual(list(exchange.markets), ['ETH/BTC'])
+
+        binance = Binance(retry=1, exchange=FakeExchange([], offline=True), markets=MarketCache())
+        self.assertFalse(binance.load_markets())
+
+
+if __name__ == '__main__':
+    unittest.main()
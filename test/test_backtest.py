@@ -2,9 +2,18 @@ import unittest
 
 from backtest.Errors import NotSupported, InsufficientFunds, InvalidOrder
 from backtest.BackExchange import BackExchange
-from backtest.Slippage import VolumeSlippage, SpreadSlippage
-from core.Ticker import Quotes, BidAsks
-from core.Timer import Timer
+from backtest.BackTest import BackTest
+from backtest.Portfolio import Portfolio
+from backtest.Validation import Validation, run_branches, walk_forward_splits, purged_kfold_splits
+from backtest.Hypothesis import block_bootstrap, permutation_test, bootstrap_test, price_path_test, \
+    resample_quotes, backtest_test, strategy_returns
+from backtest.Analyzer import ReturnAnalyzer, DrawdownAnalyzer, TradeAnalyzer, default_analyzers
+from backtest.Slippage import SlippageBase, VolumeSlippage, SpreadSlippage, SpreadVolumeSlippage, DepthSlippage
+from backtest.Order import OrderType, OrderSide
+from core.Ticker import Quotes, BidAsks, TickerFields
+from core.Timer import Timer, EventTimer
+
+import numpy as np
 
 
 class BackExchangeBlackBoxTest(unittest.TestCase):
@@ -74,6 +83,47 @@ class BackExchangeBlackBoxTest(unittest.TestCase):
         history.append({'timestamp': 1517599620000, 'asset': 'ETH', 'amount': -3})
         self.assertListEqual(self.ex.fetch_deposit_history(), history)
 
+    def test_exact_ledger(self):
+        # sums of amounts are exact, 0.1 added ten times as floats is not 1
+        for i in range(10):
+            self.ex.deposit('ETH', 0.1)
+        self.assertEqual(self.ex.fetch_balance()['ETH']['total'], 1)
+        self.assertEqual(self.ex.deposit('ETH', 1e-9), 0)
+        self.assertRaises(InvalidOrder, self.ex.create_market_buy_order, 'XRP/ETH', 1e-9)
+
+        # a limit order is filled in parts that sum exactly to its amount
+        self.ex.slippage_model = VolumeSlippage(0.001)
+        order = self.ex.create_limit_buy_order('XRP/ETH', 0.3, 0.001)
+        self.next_tickers(10)
+        order = self.ex.fetch_order(order['id'])
+        self.assertEqual(order['status'], 'filled')
+        self.assertGreater(len(order['transaction']), 1)
+        self.assertEqual(order['filled'], 0.3)
+        self.assertEqual(order['remaining'], 0)
+        balance = self.ex.fetch_balance()
+        self.assertEqual(balance['XRP']['total'], 0.3 - order['fee']['XRP'])
+        self.assertEqual(balance['ETH']['used'], 0)
+
+    def test_balance_array(self):
+        self.forward_to_timestamp(1517601660000)
+        self.ex.deposit('ETH', 10)
+        self.ex.deposit('XRP', 10)
+        self.ex.create_limit_sell_order('XRP/ETH', 4, 1)
+        self.next_tickers(1)
+
+        names = self.ex.asset_names
+        self.assertListEqual(names, sorted(['BTC', 'ETH', 'NANO', 'USDT', 'XRP']))
+        total, free = self.ex.fetch_balance_array(), self.ex.fetch_balance_array(free=True)
+        balance = self.ex.fetch_balance()
+        for i, asset in enumerate(names):
+            self.assertEqual(total[i], balance[asset]['total'])
+            self.assertEqual(free[i], balance[asset]['free'])
+        self.assertEqual(total[names.index('XRP')] - free[names.index('XRP')], 4)
+
+        ticker = self.ex.fetch_ticker('XRP/ETH')
+        self.assertAlmostEqual(self.ex.fetch_balance_in('ETH'), 10 + 10 * ticker['open'], places=8)
+        self.assertEqual(self.ex.fetch_balance_in('ETH'), self.ex.fetch_balance_in('ETH'))
+
     def test_balance_in(self):
         self.forward_to_timestamp(1517601660000)
         self.ex.deposit('ETH', 10)
@@ -373,6 +423,487 @@ class BackExchangeBlackBoxTest(unittest.TestCase):
         self.assertTrue('NANO' not in self.ex.fetch_balance())
 
 
+class TimeframeTest(unittest.TestCase):
+    def test_resampled_exchange(self):
+        quotes = Quotes()
+        quotes.add_tickers_csv('../data/binance/')
+        five_minutes = 5 * 60 * 1000
+        timer = Timer(1517599500000, 1517604900000, five_minutes)
+        ex = BackExchange(timer=timer, quotes=quotes, timeframe=five_minutes)
+
+        self.assertDictEqual(ex.fetch_ticker('XRP/ETH'), quotes['XRP/ETH'].resample(five_minutes).ohlcv(1517599500000))
+        ex.deposit('ETH', 10)
+        order = ex.create_market_buy_order('XRP/ETH', 100)
+        timer.next()
+        ex._process()
+        self.assertEqual(ex.fetch_order(order['id'])['transaction'][0]['price'],
+                         quotes['XRP/ETH'].price_open(1517599800000))
+
+        ticks = 1
+        while not timer.next():
+            ex._process()
+            ticks += 1
+        self.assertEqual(ticks, 18)
+
+
+class EventTimerTest(unittest.TestCase):
+    def visit(self, timer):
+        times = []
+        while not timer.next():
+            times.append(timer.time)
+        return times
+
+    def test_event_timer(self):
+        self.assertEqual(self.visit(EventTimer(0, 15, [5, 3, 3, 10, 20])), [3, 5, 10])
+        self.assertEqual(self.visit(EventTimer(0, 15, [5, 3, 10], ticker_size=4)), [3, 5, 9, 10, 14])
+
+        timer = EventTimer(0, 15, [3, 10])
+        timer.next()
+        timer.add_event(7)
+        timer.add_event(2)
+        timer.add_event(16)
+        self.assertEqual(self.visit(timer), [7, 10])
+        self.assertTrue(timer.time > 15)
+
+    def test_event_exchange(self):
+        quotes = Quotes()
+        quotes.add_tickers_csv('../data/binance/')
+        start_time, end_time = 1517599560000, 1517604900000
+        timer = EventTimer.from_tickers(start_time, end_time, quotes)
+        self.assertEqual(self.visit(timer), list(range(start_time + 60000, end_time + 1, 60000)))
+
+        # only one event, the order wakes the timer where it can be executed
+        timer = EventTimer(start_time, end_time, [start_time + 600000])
+        ex = BackExchange(timer=timer, quotes=quotes)
+        ex.deposit('ETH', 10)
+        order = ex.create_market_buy_order('XRP/ETH', 100)
+        self.assertFalse(timer.next())
+        ex._process()
+        self.assertEqual(timer.time, start_time + 60000)
+        self.assertEqual(ex.fetch_order(order['id'])['transaction'][0]['price'],
+                         quotes['XRP/ETH'].price_open(start_time + 60000))
+        self.assertFalse(timer.next())
+        ex._process()
+        self.assertEqual(timer.time, start_time + 600000)
+        self.assertTrue(timer.next())
+
+
+class BackTestRunnerTest(unittest.TestCase):
+    class Algo(object):
+        def __init__(self, exchange):
+            self.exchange = exchange
+            self.events = []
+            self.runner = None
+
+        def initialize(self):
+            self.events.append('initialize')
+
+        def on_start(self, runner):
+            self.events.append('start')
+            self.runner = runner
+
+        def on_pause(self, runner):
+            self.events.append('pause')
+
+        def on_stop(self, runner):
+            self.events.append('stop')
+
+        def execute(self):
+            ticks = self.runner.ticks
+            if ticks == 0:
+                self.exchange.create_market_buy_order('XRP/ETH', 100)
+            elif ticks == 10:
+                self.runner.pause()
+
+    def setUp(self):
+        self.start_time, self.end_time = 1517599560000, 1517604900000
+        self.quotes = Quotes()
+        self.quotes.add_tickers_csv('../data/binance/')
+        self.timer = Timer(self.start_time, self.end_time, 60000)
+        self.ex = BackExchange(timer=self.timer, quotes=self.quotes)
+
+    def test_noop(self):
+        algorithm = self.Algo(self.ex)
+        algorithm.execute = lambda: None
+        runner = BackTest(algorithm, self.ex, self.timer)
+        self.assertTrue(runner.run())
+        self.assertEqual(runner.state, 'stopped')
+        np.testing.assert_array_equal(runner.timestamps, np.arange(self.start_time, self.end_time + 1, 60000))
+        stats = runner.stats()
+        self.assertEqual(stats['ticks'], 90)
+        self.assertGreater(stats['overhead_per_tick'], 0)
+        self.assertEqual(len(runner.fills), 0)
+
+    def test_stop_from_execute(self):
+        algorithm = self.Algo(self.ex)
+        runner = BackTest(algorithm, self.ex, self.timer)
+        algorithm.execute = lambda: runner.stop() if runner.ticks == 5 else None
+        # a stopped backtest is finished, even before timer ends
+        self.assertTrue(runner.run())
+        self.assertEqual(runner.ticks, 6)
+        self.assertTrue(runner.run())
+        self.assertEqual(algorithm.events, ['initialize', 'start', 'stop'])
+
+    def test_record_and_pause(self):
+        self.ex.deposit('ETH', 10)
+        algorithm = self.Algo(self.ex)
+        runner = BackTest(algorithm, self.ex, self.timer, currency='ETH')
+        self.assertFalse(runner.run())
+        self.assertEqual(runner.state, 'paused')
+        self.assertEqual(runner.ticks, 11)
+        self.assertFalse(runner.run(max_ticks=5))
+        self.assertEqual(runner.ticks, 16)
+        self.assertTrue(runner.run())
+        # reaching max_ticks pauses through pause too
+        self.assertEqual(algorithm.events, ['initialize', 'start', 'pause', 'pause', 'stop'])
+
+        fills = runner.fills
+        self.assertEqual(len(fills), 1)
+        self.assertEqual(fills[0]['timestamp'], self.start_time + 60000)
+        self.assertEqual(runner.symbols[fills[0]['symbol']], 'XRP/ETH')
+        self.assertEqual(fills[0]['side'], 1)
+        self.assertEqual(fills[0]['price'], self.quotes['XRP/ETH'].price_open(self.start_time + 60000))
+
+        xrp = runner.assets.index('XRP')
+        self.assertEqual(runner.positions[0, xrp], 0)
+        self.assertAlmostEqual(runner.positions[1, xrp], 100 * (1 - 0.05 / 100))
+        self.assertEqual(runner.equity[0], 10)
+        self.assertFalse(np.isnan(runner.equity).any())
+
+
+class AnalyzerTest(unittest.TestCase):
+    def test_returns_and_drawdown(self):
+        equity = [100, 110, 99, 120, 108]
+        returns, drawdown = ReturnAnalyzer(periods_per_year=4), DrawdownAnalyzer()
+        for i, value in enumerate(equity):
+            returns.on_tick(i * 1000, value)
+            drawdown.on_tick(i * 1000, value)
+
+        series = np.diff(equity) / equity[:-1]
+        result = returns.result()
+        self.assertAlmostEqual(result['mean'], series.mean())
+        self.assertAlmostEqual(result['std'], series.std(ddof=1))
+        self.assertAlmostEqual(result['sharpe'], series.mean() / series.std(ddof=1) * 2)
+        downside = np.sqrt(np.mean(np.minimum(series, 0) ** 2))
+        self.assertAlmostEqual(result['sortino'], series.mean() / downside * 2)
+        self.assertAlmostEqual(result['total_return'], 0.08)
+
+        result = drawdown.result()
+        self.assertAlmostEqual(result['max_drawdown'], 0.1)
+        self.assertEqual(result['max_duration'], 1000)
+        self.assertAlmostEqual(result['drawdown'], 0.1)
+
+    def test_trades(self):
+        trades = TradeAnalyzer()
+        trades.on_fill(0, 1, 'XRP/BTC', 1, 1.0, 10, 0.1)
+        trades.on_fill(1, 2, 'XRP/BTC', -1, 2.0, 5, 0.01)
+        trades.on_fill(2, 3, 'XRP/BTC', -1, 0.5, 2, 0)
+        trades.on_fill(3, 3, 'XRP/BTC', -1, 0.5, 2.9, 0)
+        # sell of a deposited position
+        trades.on_fill(4, 4, 'ETH/BTC', -1, 0.1, 1, 0)
+        # orders are only counted when closed
+        self.assertEqual(trades.result()['trades'], 0)
+        for order_id, symbol, side in ((1, 'XRP/BTC', 1), (2, 'XRP/BTC', -1), (3, 'XRP/BTC', -1), (4, 'ETH/BTC', -1)):
+            trades.on_close(5, order_id, symbol, side)
+        result = trades.result()
+        self.assertEqual(result['trades'], 2)
+        self.assertEqual(result['win_rate'], 0.5)
+        self.assertEqual(trades._profits, {})
+        self.assertAlmostEqual(result['turnover']['BTC'], 10 + 10 + 1 + 1.45 + 0.1)
+        self.assertAlmostEqual(result['fees']['XRP'], 0.1)
+        self.assertAlmostEqual(result['fees']['BTC'], 0.01)
+
+    def test_backtest_analysis(self):
+        quotes = Quotes()
+        quotes.add_tickers_csv('../data/binance/')
+        timer = Timer(1517599560000, 1517604900000, 60000)
+        ex = BackExchange(timer=timer, quotes=quotes)
+        ex.deposit('ETH', 10)
+
+        class Algo(object):
+            def initialize(self):
+                pass
+
+            def execute(self):
+                if ex.fetch_timestamp() == 1517599560000:
+                    ex.create_market_buy_order('XRP/ETH', 1000)
+                elif ex.fetch_timestamp() == 1517600160000:
+                    ex.create_market_sell_order('XRP/ETH', 500)
+
+        runner = BackTest(Algo(), ex, timer, currency='ETH', analyzers=default_analyzers())
+        runner.run(max_ticks=30)
+        self.assertEqual(runner.analysis()['returns']['periods'], 29)
+        runner.run()
+        analysis = runner.analysis()
+
+        series = np.diff(runner.equity) / runner.equity[:-1]
+        self.assertAlmostEqual(analysis['returns']['mean'], series.mean())
+        peak = np.maximum.accumulate(runner.equity)
+        self.assertAlmostEqual(analysis['drawdown']['max_drawdown'], np.max(1 - runner.equity / peak))
+        self.assertEqual(analysis['trades']['fills'], 2)
+        self.assertEqual(analysis['trades']['trades'], 1)
+        self.assertAlmostEqual(analysis['trades']['turnover']['ETH'],
+                               float(np.sum(runner.fills['price'] * runner.fills['amount'])))
+
+
+class RandomAlgo(object):
+    def __init__(self, exchange, fold):
+        self.exchange = exchange
+
+    def initialize(self):
+        pass
+
+    def execute(self):
+        if np.random.rand() < 0.2:
+            self.exchange.create_market_buy_order('XRP/ETH', float(np.random.randint(1, 100)))
+
+
+class ValidationTest(unittest.TestCase):
+    def test_splits(self):
+        self.assertEqual(walk_forward_splits(0, 9, 4, 2, 1),
+                         [([(0, 3)], (4, 5)), ([(2, 5)], (6, 7)), ([(4, 7)], (8, 9))])
+        self.assertEqual(walk_forward_splits(0, 9, 4, 3, 1, anchored=True), [([(0, 3)], (4, 6)), ([(0, 6)], (7, 9))])
+        self.assertEqual(purged_kfold_splits(0, 8, 3, 1, purge=1, embargo=1),
+                         [([(4, 8)], (0, 2)), ([(0, 1), (7, 8)], (3, 5)), ([(0, 4)], (6, 8))])
+
+    def test_parallel_folds(self):
+        quotes = Quotes()
+        quotes.add_tickers_csv('../data/binance/')
+        splits = purged_kfold_splits(1517599560000, 1517604900000, 3, 60000)
+        validation = Validation(quotes, RandomAlgo, 60000, {'ETH': 10}, currency='ETH', seed=7, processes=3)
+        parallel = validation.run(splits)
+        validation.processes = 1
+        serial = validation.run(splits)
+
+        self.assertEqual([fold['test'] for fold in parallel], [split[1] for split in splits])
+        for a, b in zip(parallel, serial):
+            self.assertEqual(a['seed'], b['seed'])
+            for key in ('fills', 'turnover', 'fees'):
+                self.assertEqual(a['analysis']['trades'][key], b['analysis']['trades'][key])
+            self.assertEqual(a['analysis']['returns']['total_return'], b['analysis']['returns']['total_return'])
+        self.assertEqual(parallel[0]['stats']['ticks'], 30)
+        self.assertGreater(sum(fold['analysis']['trades']['fills'] for fold in parallel), 0)
+
+
+class BuyAndHoldAlgo(object):
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def initialize(self):
+        pass
+
+    def execute(self):
+        if self.exchange.fetch_timestamp() == 1517599560000:
+            self.exchange.create_market_buy_order('XRP/ETH', 1000)
+
+
+class HypothesisTest(unittest.TestCase):
+    def test_block_bootstrap(self):
+        samples = block_bootstrap(np.arange(10), 5, 4, seed=1)
+        self.assertEqual(samples.shape, (5, 10))
+        # consecutive within blocks, circularly
+        steps = (np.diff(samples, axis=1) % 10)[:, [0, 1, 2, 4, 5, 6, 8]]
+        self.assertTrue((steps == 1).all())
+
+    def test_vectorized_tests(self):
+        rng = np.random.default_rng(0)
+        returns = rng.normal(0, 0.01, 500)
+        # positions that know the next return
+        oracle = np.sign(np.roll(returns, -1))
+        self.assertLess(permutation_test(oracle, returns, n_samples=999, seed=1)['p_value'], 0.01)
+        noise = rng.choice([-1.0, 1.0], 500)
+        result = permutation_test(noise, returns, n_samples=999, seed=1)
+        self.assertGreater(result['p_value'], 0.05)
+        self.assertAlmostEqual(result['statistic'], strategy_returns(noise, returns).mean())
+
+        self.assertLess(bootstrap_test(returns + 0.005, n_samples=999, block_size=10, seed=1)['p_value'], 0.01)
+        self.assertGreater(bootstrap_test(returns - returns.mean(), n_samples=999, seed=1)['p_value'], 0.05)
+
+        prices = 100 * np.exp(np.cumsum(returns))
+        momentum = lambda paths: np.sign(np.diff(paths, axis=-1, prepend=paths[..., :1]))
+        result = price_path_test(momentum, prices, n_samples=999, seed=1)
+        self.assertEqual(len(result['null']), 999)
+        self.assertGreater(result['p_value'], 0.01)
+
+    def test_backtest_test(self):
+        quotes = Quotes()
+        quotes.add_tickers_csv('../data/binance/')
+        start, end = 1517599560000, 1517604900000
+        original = resample_quotes(quotes, ['XRP/ETH'], start, end)
+        self.assertEqual(original['XRP/ETH'].price_close(start + 60000), quotes['XRP/ETH'].price_close(start + 60000))
+
+        kwargs = dict(symbols=['XRP/ETH', 'ETH/BTC'], start=start, end=end, step=60000, deposit={'ETH': 10},
+                      currency='ETH', n_samples=6, block_size=10, seed=3)
+        parallel = backtest_test(quotes, BuyAndHoldAlgo, processes=3, **kwargs)
+        serial = backtest_test(quotes, BuyAndHoldAlgo, processes=1, **kwargs)
+        self.assertEqual(len(parallel['null']), 6)
+        np.testing.assert_array_equal(parallel['null'], serial['null'])
+        self.assertEqual(parallel['statistic'], serial['statistic'])
+
+
+class SnapshotTest(unittest.TestCase):
+    class Algo(object):
+        def __init__(self, exchange):
+            self.exchange = exchange
+            self.ticks = 0
+
+        def initialize(self):
+            pass
+
+        def execute(self):
+            self.ticks += 1
+            price = self.exchange.fetch_ticker('XRP/ETH')['open']
+            if self.ticks % 5 == 1:
+                self.exchange.create_limit_buy_order('XRP/ETH', 100, price * 1.001)
+                self.exchange.create_limit_sell_order('XRP/ETH', 50, price * 1.01)
+
+    def setUp(self):
+        self.quotes = Quotes()
+        self.quotes.add_tickers_csv('../data/binance/')
+        timer = Timer(1517599560000, 1517604900000, 60000)
+        self.ex = BackExchange(timer=timer, quotes=self.quotes, slippage_model=VolumeSlippage(50))
+        self.ex.deposit('ETH', 10)
+        self.ex.deposit('XRP', 1000)
+
+    def strip_ids(self, value):
+        if isinstance(value, dict):
+            return {key: self.strip_ids(value[key]) for key in value if key != 'id'}
+        if isinstance(value, list):
+            return [self.strip_ids(item) for item in value]
+        return value
+
+    def test_resume(self):
+        runner = BackTest(self.Algo(self.ex), self.ex, self.ex.timer, currency='ETH')
+        runner.run(max_ticks=23)
+        self.assertGreater(len(self.ex.fetch_open_orders()), 0)
+        snapshot = self.ex.snapshot(runner)
+
+        runner.run()
+        branches = [BackExchange.restore(snapshot, self.quotes) for _ in range(2)]
+        for ex, (restored,) in branches:
+            self.assertIs(restored.exchange, ex)
+            self.assertIs(restored.timer, ex.timer)
+            self.assertIs(ex._panel, self.ex._panel)
+            self.assertEqual(restored.ticks, 23)
+            self.assertTrue(restored.run())
+
+            self.assertEqual(ex.fetch_balance(), self.ex.fetch_balance())
+            # orders created after the snapshot have new ids
+            self.assertEqual(self.strip_ids(ex.fetch_open_orders()), self.strip_ids(self.ex.fetch_open_orders()))
+            self.assertEqual(self.strip_ids(ex.fetch_closed_orders('XRP/ETH')),
+                             self.strip_ids(self.ex.fetch_closed_orders('XRP/ETH')))
+            self.assertEqual(ex.fetch_deposit_history(), self.ex.fetch_deposit_history())
+            np.testing.assert_array_equal(restored.equity, runner.equity)
+            np.testing.assert_array_equal(restored.fills['price'], runner.fills['price'])
+
+
+    def test_fork(self):
+        runner = BackTest(self.Algo(self.ex), self.ex, self.ex.timer, currency='ETH')
+        runner.run(max_ticks=23)
+        balance = self.ex.fetch_balance()
+        closed = len(self.ex._closed_orders)
+
+        ex, (branch,) = self.ex.fork(runner)
+        self.assertIs(branch.exchange, ex)
+        self.assertIs(ex._panel, self.ex._panel)
+        self.assertIs(ex._closed_orders, self.ex._closed_orders)
+        self.assertIsNot(ex._open_orders, self.ex._open_orders)
+        self.assertEqual(ex.fetch_balance(), balance)
+
+        control, (control_runner,) = self.ex.fork(runner)
+        ex.create_market_sell_order('XRP/ETH', 200)
+        self.assertTrue(branch.run())
+        self.assertTrue(control_runner.run())
+        self.assertEqual(self.ex.fetch_balance(), balance)
+        self.assertEqual(len(self.ex._closed_orders), closed)
+        self.assertEqual(self.ex.timer.time, 1517599560000 + 23 * 60000)
+        self.assertLess(ex.fetch_balance()['XRP']['total'], control.fetch_balance()['XRP']['total'])
+        self.assertEqual(len(ex._closed_orders), len(control._closed_orders) + 1)
+
+        def what_if(amount, ex, runner):
+            ex.create_market_sell_order('XRP/ETH', amount)
+            runner.run()
+            return ex.fetch_balance()['XRP']['total'], runner.equity[-1]
+
+        variants = [100, 200, 300]
+        serial = run_branches(self.ex, variants, what_if, (runner,))
+        self.assertEqual(serial[1][0], ex.fetch_balance()['XRP']['total'])
+        self.assertEqual(run_branches(self.ex, variants, what_if, (runner,), processes=3), serial)
+        self.assertEqual(self.ex.fetch_balance(), balance)
+
+
+class PortfolioTest(unittest.TestCase):
+    class PeriodicAlgo(object):
+        def __init__(self, exchange, period=10):
+            self.exchange = exchange
+            self.period = period
+            self.ticks = 0
+
+        def initialize(self):
+            pass
+
+        def execute(self):
+            if self.ticks % self.period == 0:
+                self.exchange.create_market_buy_order('XRP/ETH', 10)
+            elif self.ticks % self.period == self.period // 2:
+                self.exchange.create_limit_sell_order('XRP/ETH', 5, 0.0001)
+            self.ticks += 1
+
+    class NoopAlgo(object):
+        def __init__(self, exchange):
+            self.exchange = exchange
+
+        def initialize(self):
+            pass
+
+        def execute(self):
+            pass
+
+    def setUp(self):
+        self.start_time, self.end_time = 1517599560000, 1517604900000
+        self.quotes = Quotes()
+        self.quotes.add_tickers_csv('../data/binance/')
+        self.strategies = {'hold': BuyAndHoldAlgo, 'periodic': self.PeriodicAlgo,
+                           'fast': lambda exchange: self.PeriodicAlgo(exchange, 4), 'noop': self.NoopAlgo}
+
+    def test_same_as_separate_backtests(self):
+        timer = Timer(self.start_time, self.end_time, 60000)
+        portfolio = Portfolio(timer, self.quotes, self.strategies, {'ETH': 10}, currency='ETH',
+                              make_analyzers=default_analyzers)
+        events = []
+        for event in ('pause', 'stop'):
+            portfolio.runners['hold'].add_hook(event, lambda runner, event=event: events.append(event))
+        self.assertFalse(portfolio.run(max_ticks=30))
+        self.assertEqual(portfolio.state, 'paused')
+        self.assertEqual(portfolio.runners['hold'].state, 'paused')
+        self.assertTrue(portfolio.run())
+        self.assertEqual(events, ['pause', 'stop'])
+        self.assertEqual(portfolio.stats()['ticks'], 90)
+        self.assertEqual(portfolio.equity.shape, (90, 4))
+
+        for name, make_algorithm in self.strategies.items():
+            timer = Timer(self.start_time, self.end_time, 60000)
+            exchange = BackExchange(timer=timer, quotes=self.quotes, verbose=False)
+            exchange.deposit('ETH', 10)
+            backtest = BackTest(make_algorithm(exchange), exchange, timer, currency='ETH',
+                                analyzers=default_analyzers())
+            backtest.run()
+
+            runner = portfolio.runners[name]
+            self.assertEqual(runner.state, 'stopped')
+            np.testing.assert_array_equal(runner.timestamps, backtest.timestamps)
+            np.testing.assert_array_equal(runner.positions, backtest.positions)
+            np.testing.assert_array_equal(runner.equity, backtest.equity)
+            np.testing.assert_array_equal(runner.fills[['timestamp', 'price', 'amount', 'fee']],
+                                          backtest.fills[['timestamp', 'price', 'amount', 'fee']])
+            self.assertEqual(portfolio.analysis()[name]['trades']['fills'], backtest.analysis()['trades']['fills'])
+            self.assertEqual(portfolio.accounts[name].fetch_balance(), exchange.fetch_balance())
+
+        # sub-accounts are isolated
+        self.assertEqual(portfolio.accounts['noop'].fetch_balance()['ETH']['total'], 10)
+        self.assertEqual(len(portfolio.runners['noop'].fills), 0)
+
+
 class SlippageModelBlackboxTest(unittest.TestCase):
     def setUp(self):
         file_path = '../data/binance/'
@@ -460,6 +991,84 @@ class SlippageModelBlackboxTest(unittest.TestCase):
         self.next_tickers(1)
         self.assertEqual(len(self.ex.fetch_open_orders()), 0)
 
+    def test_depth_slippage(self):
+        nan = np.nan
+        asks = [[[1.0, 10], [1.1, 20], [1.3, 5]], [[2.0, 1], [nan, nan], [nan, nan]]]
+        bids = [[[0.9, 10], [0.8, 10], [nan, nan]], [[1.9, 1], [1.8, 1], [nan, nan]]]
+        model = DepthSlippage()
+        model.add_order_book('XRP/ETH', [1517599560000, 1517599680000], asks, bids)
+
+        # vwap of 10 @ 1.0 and 5 @ 1.1
+        self.assertAlmostEqual(model.walk('XRP/ETH', 1517599560000, OrderSide.Buy, 15)[0], 15.5 / 15)
+        self.assertEqual(model.walk('XRP/ETH', 1517599560000, OrderSide.Sell, 10), (0.9, 0.9, 10))
+        # beyond the recorded book, market orders fill at the deepest price and limit orders fill the book
+        self.assertAlmostEqual(model.walk('XRP/ETH', 1517599620000, OrderSide.Buy, 40)[0], (10 + 22 + 1.3 * 10) / 40)
+        self.assertEqual(model.walk('XRP/ETH', 1517599620000, OrderSide.Buy, 40, partial=True)[2], 35)
+        self.assertIsNone(model.walk('XRP/ETH', 1517599500000, OrderSide.Buy, 1))
+        self.assertIsNone(model.walk('ETH/BTC', 1517599560000, OrderSide.Buy, 1))
+
+        self.assertAlmostEqual(model.generate_tx(0.5, 15, OrderType.Market, OrderSide.Buy, 'XRP/ETH', {},
+                                                 1517599560000)[0], 0.5 + 15.5 / 15 - 1.0)
+        price, amount = model.generate_tx(0.5, 3, OrderType.Limit, OrderSide.Sell, 'XRP/ETH', {}, 1517599700000)
+        self.assertAlmostEqual(price, 0.45)
+        self.assertEqual(amount, 2)
+
+        # orders on the exchange pay the impact on top of the ticker price
+        self.ex.slippage_model = model
+        self.ex.deposit('ETH', 100)
+        self.ex.create_market_buy_order('XRP/ETH', 15)
+        self.next_tickers(1)
+        price = self.ex.fetch_ticker('XRP/ETH')['open']
+        self.assertAlmostEqual(self.ex.fetch_closed_orders('XRP/ETH')[0]['transaction'][0]['price'],
+                               price + 15.5 / 15 - 1.0)
+
+    def test_batch_slippage(self):
+        bidask = BidAsks()
+        bidask.add_tickers_csv('../data/')
+        depth = DepthSlippage()
+        depth.add_order_book('XRP/ETH', [1517599560000], [[[0.001, 100], [0.0011, 100]]], [[[0.0009, 50]]])
+
+        timestamp = 1517599620000
+        symbols = np.array(['XRP/ETH', 'ETH/BTC', 'XRP/ETH', 'XRP/ETH'], dtype=object)
+        sides = np.array([OrderSide.Buy, OrderSide.Sell, OrderSide.Sell, OrderSide.Buy], dtype=object)
+        types = np.array([OrderType.Limit, OrderType.Market, OrderType.Limit, OrderType.Market], dtype=object)
+        prices = np.array([0.00095, 0.1, 0.00096, 0.00095])
+        amounts = np.array([1000.0, 5, 80, 150])
+        tickers = {'open': prices, 'high': prices, 'low': prices, 'close': prices,
+                   'volume': np.array([20000.0, 100, 1000, 20000])}
+
+        for model in (SlippageBase(), VolumeSlippage(), SpreadSlippage(bidask), SpreadVolumeSlippage(bidask), depth):
+            tx_prices, tx_amounts = model.generate_txs(prices, amounts, types, sides, symbols, tickers, timestamp)
+            for i in range(len(prices)):
+                price, amount = model.generate_tx(prices[i], amounts[i], types[i], sides[i], symbols[i],
+                                                  {field: tickers[field][i] for field in tickers}, timestamp)
+                self.assertAlmostEqual(tx_prices[i], price, places=12)
+                self.assertAlmostEqual(tx_amounts[i], amount, places=12)
+
+    def test_spread_cache(self):
+        bidask = BidAsks()
+        bidask.add_tickers_csv('../data/')
+        ticker = bidask.get_ticker('XRP/ETH')
+        for timestamp in (1517599500000, 1517599620000, 1517599650000, 1517610000000):
+            self.assertEqual(ticker.get_closet_spread(timestamp),
+                             ticker.get_closet_value(timestamp, TickerFields.Ask) -
+                             ticker.get_closet_value(timestamp, TickerFields.Bid))
+
+        # one lookup per symbol and tick, however many orders
+        lookups = []
+        get_closet_spread = ticker.get_closet_spread
+        ticker.get_closet_spread = lambda timestamp: lookups.append(timestamp) or get_closet_spread(timestamp)
+        model = SpreadVolumeSlippage(bidask)
+        for i in range(5):
+            model.generate_tx(0.001, 10, OrderType.Market, OrderSide.Buy, 'XRP/ETH', {'volume': 100}, 1517599620000)
+        model.generate_tx(0.001, 10, OrderType.Market, OrderSide.Buy, 'XRP/ETH', {'volume': 100}, 1517599680000)
+        self.assertEqual(lookups, [1517599620000, 1517599680000])
+
+        # spread is applied by symbol, not by a ticker key
+        price, _ = model.generate_tx(0.001, 10, OrderType.Market, OrderSide.Sell, 'XRP/ETH', {'volume': 100},
+                                     1517599680000)
+        self.assertLess(price, 0.001)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,49 @@
 import unittest
+import tempfile
+import threading
+import math
+import os
+import pandas as pd
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 # import re
 # from backtest.Errors import NotSupported, InsufficientFunds, InvalidOrder, OrderNotFound, SlippageModelError
 # from backtest.BackExchange import BackExchange
 # from backtest.Slippage import VolumeSlippage, SpreadSlippage
-from core.Ticker import Quotes, BidAsks
+from core.Ticker import Quotes, BidAsks, Quote, TickerFields
 # from core.Timer import Timer
 
 
+class CSVHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.body at /data.csv with range request support, and server.pages at /page?page=i.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/page':
+            body = self.server.pages[int(parse_qs(url.query)['page'][0])]
+            status = 200
+        else:
+            body = self.server.body
+            status = 200
+            if 'Range' in self.headers:
+                start = int(self.headers['Range'][len('bytes='):-1])
+                if start >= len(body):
+                    self.send_response(416)
+                    self.end_headers()
+                    return
+                body = body[start:]
+                status = 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
 class Ticker(unittest.TestCase):
     def setUp(self):
         pass
@@ -26,6 +63,187 @@ class Ticker(unittest.TestCase):
         bidasks.add_tickers_csv(file_path)
         self.assertEqual(len(bidasks), 1)
 
+    def test_parquet_ticker(self):
+        quotes = Quotes()
+        quotes.add_tickers_csv('../data/binance/')
+
+        with tempfile.TemporaryDirectory() as directory:
+            quotes.write_tickers_parquet(directory)
+            self.assertEqual(len(os.listdir(directory)), 5)
+
+            parquet_quotes = Quotes()
+            parquet_quotes.add_tickers_parquet(directory + '/')
+            self.assertEqual(len(parquet_quotes), 5)
+            self.assertEqual(parquet_quotes['XRP/ETH'].ohlcv(1517599560000), quotes['XRP/ETH'].ohlcv(1517599560000))
+
+            # read only a time range and a subset of columns
+            quote = Quote('XRP', 'ETH')
+            quote.read_from_parquet(directory + '/XRP-ETH.parquet', ('timestamp', 'close'), start=1517599620000,
+                                    end=1517599740000)
+            self.assertEqual(quote.get_value(1517599620000, TickerFields.Close), 0.00095605)
+            self.assertRaises(KeyError, quote.get_value, 1517599560000, TickerFields.Close)
+            self.assertRaises(KeyError, quote.get_value, 1517599620000, TickerFields.Open)
+            self.assertRaises(KeyError, quote.get_value, 1517599800000, TickerFields.Close)
+
+    def test_panel(self):
+        quotes = Quotes()
+        quotes.add_tickers_csv('../data/binance/')
+        panel = quotes.get_panel()
+        self.assertIs(quotes.get_panel(), panel)
+        self.assertListEqual(panel.symbols, ['ETH/BTC', 'ETH/USDT', 'NANO/BTC', 'NANO/ETH', 'XRP/ETH'])
+
+        # NANO is not listed yet
+        listed = panel.get_listed(1517599560000)
+        self.assertListEqual(list(listed), [True, True, False, False, True])
+        closes = panel.get_values(1517599560000, TickerFields.Close)
+        self.assertEqual(closes[panel.symbol_index['XRP/ETH']], 0.00095518)
+        self.assertTrue(math.isnan(closes[panel.symbol_index['NANO/BTC']]))
+
+        self.assertEqual(panel.get_value(1517601360000, 'NANO/ETH', TickerFields.Open), 0.0201)
+        self.assertRaises(KeyError, panel.get_value, 1517599560000, 'NANO/ETH', TickerFields.Open)
+        self.assertFalse(panel.get_listed(1).any())
+
+        # adding tickers invalidates the cached panel
+        quotes.add_tickers_csv('../data/binance/', '(\\w+)-(USDT).csv')
+        self.assertIsNot(quotes.get_panel(), panel)
+
+    def test_resample(self):
+        quote = Quote('XRP', 'ETH')
+        quote.read_from_csv('../data/binance/XRP-ETH.csv')
+        five_minutes = 5 * 60 * 1000
+
+        bars = quote.resample(five_minutes)
+        self.assertIs(quote.resample(five_minutes), bars)
+        self.assertEqual(bars._data.shape[0], 19)
+
+        # the first bar holds 4 one-minute bars from 1517599560000 to 1517599740000
+        minutes = [quote.ohlcv(1517599560000 + i * 60 * 1000) for i in range(4)]
+        self.assertDictEqual(bars.ohlcv(1517599500000),
+                             {'open': minutes[0]['open'], 'high': max(m['high'] for m in minutes),
+                              'low': min(m['low'] for m in minutes), 'close': minutes[-1]['close'],
+                              'volume': sum(m['volume'] for m in minutes)})
+        self.assertRaises(KeyError, bars.get_value, 1517599560000, TickerFields.Open)
+        self.assertRaises(ValueError, quote.resample, 90 * 1000)
+
+        quotes = Quotes()
+        quotes.add_tickers_csv('../data/binance/')
+        resampled = quotes.resample(five_minutes)
+        self.assertIs(quotes.resample(five_minutes), resampled)
+        self.assertEqual(len(resampled), 5)
+        self.assertEqual(resampled['XRP/ETH'].ohlcv(1517599500000), bars.ohlcv(1517599500000))
+
+    def test_refresh(self):
+        with open('../data/binance/XRP-ETH.csv', 'rb') as file:
+            lines = file.read().splitlines(keepends=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = directory + '/XRP-ETH.csv'
+            with open(file_path, 'wb') as file:
+                file.write(b''.join(lines[:40]))
+
+            quotes = Quotes()
+            quotes.add_tickers_csv(directory + '/')
+            quote = quotes['XRP/ETH']
+            panel = quotes.get_panel()
+            self.assertEqual(len(panel), 39)
+            self.assertEqual(quotes.refresh(), 0)
+
+            # a row being written is not consumed until it is complete
+            with open(file_path, 'ab') as file:
+                file.write(b''.join(lines[40:60]) + lines[60][:10])
+            self.assertEqual(quotes.refresh(), 20)
+            with open(file_path, 'ab') as file:
+                file.write(lines[60][10:] + b''.join(lines[61:]))
+            self.assertEqual(quotes.refresh(), 31)
+            self.assertEqual(quote._data.shape[0], 90)
+
+            expected = Quote('XRP', 'ETH')
+            expected.read_from_csv('../data/binance/XRP-ETH.csv')
+            self.assertEqual(quote.ohlcv(1517602920000), expected.ohlcv(1517602920000))
+
+            # the cached panel is extended in place
+            self.assertIs(quotes.get_panel(), panel)
+            self.assertEqual(len(panel), 90)
+            self.assertEqual(panel.get_value(1517604900000, 'XRP/ETH', TickerFields.Close),
+                             expected.price_close(1517604900000))
+
+    def test_url_ticker(self):
+        server = HTTPServer(('127.0.0.1', 0), CSVHandler)
+        with open('../data/binance/XRP-ETH.csv', 'rb') as file:
+            lines = file.read().splitlines(keepends=True)
+        server.body = b''.join(lines[:50])
+        server.pages = [lines[0] + b''.join(lines[1:30]), lines[0] + b''.join(lines[30:])]
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:{:d}/'.format(server.server_port)
+
+        try:
+            expected = Quote('XRP', 'ETH')
+            expected.read_from_csv('../data/binance/XRP-ETH.csv')
+
+            quote = Quote('XRP', 'ETH')
+            self.assertEqual(quote.read_from_url(url + 'data.csv', batch_size=7), 49)
+            self.assertEqual(quote.ohlcv(1517599620000), expected.ohlcv(1517599620000))
+
+            # only newly appended bytes are requested
+            server.body = b''.join(lines)
+            self.assertEqual(quote.read_from_url(url + 'data.csv', append=True), 41)
+            self.assertEqual(quote.read_from_url(url + 'data.csv', append=True), 0)
+            self.assertEqual(quote._data.shape, expected._data.shape)
+            self.assertEqual(quote.ohlcv(1517604900000), expected.ohlcv(1517604900000))
+
+            # a row being written is left for the next read
+            row = b'1517604960000,0.001,0.002,0.0005,0.0015,30830.0\r\n'
+            server.body = b''.join(lines) + row[:-4]
+            self.assertEqual(quote.read_from_url(url + 'data.csv', append=True), 0)
+            server.body = b''.join(lines) + row
+            self.assertEqual(quote.read_from_url(url + 'data.csv', append=True), 1)
+            self.assertEqual(quote.get_value(1517604960000, TickerFields.Volume), 30830.0)
+
+            # paginated
+            quote = Quote('XRP', 'ETH')
+            self.assertEqual(quote.read_from_url(url + 'page', params=[{'page': 0}, {'page': 1}]), 90)
+            self.assertEqual(quote.ohlcv(1517604900000), expected.ohlcv(1517604900000))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_string_column(self):
+        quote = Quote('XRP', 'ETH')
+        self.assertRaises(ValueError, quote.get_closet_value, 1000, TickerFields.Close)
+        quote.read_from_pandas(pd.DataFrame({'timestamp': [1000, 2000], 'close': [1.0, 2.0], 'venue': ['a', 'b']}))
+        self.assertEqual(quote.get_value(2000, TickerFields.Close), 2.0)
+        self.assertEqual(quote.get_closet_value(1900, TickerFields.Close), 2.0)
+
+    def test_api_ticker(self):
+        table = [[1000 * i, 1.0 * i, 2.0 * i, 0.5 * i, 1.5 * i, 10.0] for i in range(1, 101)]
+        calls = []
+
+        def api_fun(since):
+            calls.append(since)
+            start = 0 if since is None else since // 1000
+            for i in range(start, len(table), 30):
+                yield table[i:i + 30]
+
+        quote = Quote('XRP', 'ETH')
+        self.assertEqual(quote.read_from_api(api_fun), 100)
+        self.assertEqual(quote.price_close(50000), 75.0)
+
+        table += [[1000 * i, 1.0 * i, 2.0 * i, 0.5 * i, 1.5 * i, 10.0] for i in range(101, 111)]
+        self.assertEqual(quote.read_from_api(api_fun, append=True), 10)
+        self.assertListEqual(calls, [None, 100000])
+        self.assertEqual(quote.price_close(110000), 165.0)
+        self.assertEqual(quote._data.shape[0], 110)
+
+        # appended data is visible through cached panels
+        quotes = Quotes()
+        quotes._tickers['XRP/ETH'] = quote
+        panel = quotes.get_panel()
+        table.append([111000, 1.0, 1.0, 1.0, 1.0, 1.0])
+        quote.read_from_api(api_fun, append=True)
+        self.assertEqual(len(quotes.get_panel()), 111)
+        self.assertEqual(quotes.get_panel().get_value(111000, 'XRP/ETH', TickerFields.Close), 1.0)
+
     def test_exchange_ticker(self):
         quotes = Quotes()
         quotes.add_tickers_exchange('binance', pattern='(\w+)/(USDT)')